@@ -1,4 +1,5 @@
 import os
+import sys
 # This program can be used to verify that the log message containing 
 # "Going to preempt 1 due to lack of space for maps" is not part of normal runs
 # and, in fact, only appears in these two runs: 1445182159119_0013 and 
@@ -6,6 +7,10 @@ import os
 # We can also verify that "Could not delete hdfs:"
 # also exists in the normal runs. Thus, the existence of these log lines in runs
 # 1445182159119_0017 and 1445062781478_0020 does not prevent them from being normal runs.
+#
+# With token_index enabled in the config the runs are looked up from the index instead of
+# reading the files again: python find_string.py Output/token_index
+# or directly: python -m logdelta.token_index runs "Going to preempt 1 due to lack of space for maps" --substring -i Output/token_index
 
 
 def find_folders_with_string(base_directory, file_suffix, search_string):
@@ -28,9 +33,19 @@ def find_folders_with_string(base_directory, file_suffix, search_string):
                 except Exception as e:
                     print(f"Error reading {file_path}: {e}")
 
+def find_runs_with_string(index_folder, search_string):
+    from logdelta.token_index import TokenIndex
+    # Substring matching of the words, like the line search of find_folders_with_string
+    for run in TokenIndex(index_folder).runs(search_string, substring=True):
+        if run.startswith("PageRank"):
+            print(f"Found in run: {run}")
+
 # Variables
 base_directory = "Hadoop"  # Update this if needed
 file_suffix = "_01_000001.log"
 #search_string = "Could not delete hdfs:"
 search_string = "Going to preempt 1 due to lack of space for maps"
-find_folders_with_string(base_directory, file_suffix, search_string)
+if len(sys.argv) > 1:
+    find_runs_with_string(sys.argv[1], search_string)
+else:
+    find_folders_with_string(base_directory, file_suffix, search_string)
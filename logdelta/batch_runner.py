@@ -0,0 +1,97 @@
+import os
+import sys
+import warnings
+from dotenv import load_dotenv, find_dotenv
+
+from logdelta.config_runner import load_config, dataset_key, load_data, run_config, configure_profiling
+
+def expand_config_paths(paths):
+    """
+    Expand the given config files and folders to a sorted list of YAML config files.
+    Folders are searched recursively for *.yml and *.yaml files.
+    """
+    config_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                config_paths.extend(os.path.join(root, f) for f in files if f.endswith((".yml", ".yaml")))
+        else:
+            config_paths.append(path)
+    return sorted(config_paths)
+
+def group_configs(config_paths):
+    """
+    Group configs that need the same prepared dataset (see config_runner.dataset_key). A config that
+    cannot be loaded or keyed (e.g. its run list is missing) is reported and left out.
+
+    Returns:
+    - Tuple (dictionary of dataset key -> list of (config_path, config) in the given order,
+      list of config paths that failed).
+    """
+    groups = {}
+    failed = []
+    for config_path in config_paths:
+        try:
+            config = load_config(config_path)
+            key = dataset_key(config)
+        except Exception as e:
+            print(f"Config {config_path} failed: {e}")
+            failed.append(config_path)
+            continue
+        groups.setdefault(key, []).append((config_path, config))
+    return groups, failed
+
+def main(config_paths):
+    """
+    Run many configs. Each distinct dataset (input folder, masking, pre-parse and preprocessing
+    settings) is loaded and prepared once, then the steps of all configs using it are run.
+
+    Returns:
+    - List of config paths that failed.
+    """
+    config_paths = expand_config_paths(config_paths)
+    groups, failed = group_configs(config_paths)
+    print(f"Running {len(config_paths) - len(failed)} configs on {len(groups)} distinct datasets")
+    for group in groups.values():
+        print(f"Loading dataset for {len(group)} configs: {[path for path, _ in group]}")
+        try:
+            configure_profiling(group[0][1])
+            df = load_data(group[0][1])
+        except Exception as e:
+            print(f"Loading data failed for configs {[path for path, _ in group]}: {e}")
+            failed.extend(path for path, _ in group)
+            continue
+        for config_path, config in group:
+            print(f"Starting loaded config: {config_path}")
+            try:
+                configure_profiling(config)
+                run_config(config, df)
+            except Exception as e:
+                print(f"Config {config_path} failed: {e}")
+                failed.append(config_path)
+        del df
+    if failed:
+        print(f"{len(failed)} configs failed: {failed}")
+    return failed
+
+
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv(find_dotenv())
+
+    # Suppress specific warnings
+    warnings.filterwarnings("ignore", "WARNING! data has no labels. Only unsupervised methods will work.", UserWarning)
+
+    import argparse
+    parser = argparse.ArgumentParser(description="LogDelta batch runner. Loads each distinct dataset once for many configs.")
+    parser.add_argument(
+        "-c", "--configs",
+        nargs="+",
+        required=True,
+        help="Configuration files and/or folders containing configuration files"
+    )
+    args = parser.parse_args()
+
+    # Run main process
+    failed = main(args.configs)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,341 @@
+# Benchmark suite timing the L1-L4 distance, anomaly and plot steps on synthetic corpora
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import subprocess
+import statistics
+
+from logdelta.synthetic_logs import generate_corpus
+
+# Corpus sizes. Each scale is generated once into the work folder and reused
+scales = {
+    "small": {"runs": 10, "files_per_run": 3, "lines_per_file": 500, "templates": 30},
+    "medium": {"runs": 30, "files_per_run": 5, "lines_per_file": 2000, "templates": 80},
+    "large": {"runs": 100, "files_per_run": 10, "lines_per_file": 5000, "templates": 200},
+}
+
+def benchmark_config(corpus_folder, output_folder, target_run, target_files):
+    """
+    Config (as loaded from YAML) with one step per analysis type and level.
+    """
+    content = {"mask": True, "content_format": "Words", "vectorizer": "Count"}
+    detectors = ["IsolationForest", "KMeans", "RarityModel", "OOVDetector"]
+    return {
+        "input_data_folder": corpus_folder,
+        "output_folder": output_folder,
+        "table_output": "csv",
+        "preprocessing_steps": [{"name": "remove_run_name_from_file_names"}],
+        "regex_masking": {"enabled": True, "pattern": [{"name": "myllari_extended"}]},
+        "pre_parse": {"enabled": False},
+        "steps": {
+            "distance_run_file": [{"target_run": target_run, "comparison_runs": "ALL"}],
+            "distance_run_content": [{"target_run": target_run, "comparison_runs": "ALL", **content}],
+            "distance_file_content": [{"target_run": target_run, "comparison_runs": "ALL", "target_files": target_files, **content}],
+            "distance_line_content": [{"target_run": target_run, "comparison_runs": 3, "target_files": target_files, "mask": True}],
+            "anomaly_run_file": [{"target_run": target_run, "comparison_runs": "ALL", "detectors": detectors}],
+            "anomaly_run_content": [{"target_run": target_run, "comparison_runs": "ALL", "detectors": detectors, **content}],
+            "anomaly_file_content": [{"target_run": target_run, "comparison_runs": "ALL", "target_files": target_files, "detectors": detectors, **content}],
+            "anomaly_line_content": [{"target_run": target_run, "comparison_runs": "ALL", "target_files": target_files, "detectors": detectors, **content}],
+            "plot_run_file": [{"target_run": target_run, "comparison_runs": "ALL", "random_seed": 42}],
+            "plot_run_content": [{"target_run": target_run, "comparison_runs": "ALL", "random_seed": 42, **content}],
+            "plot_file_content": [{"target_run": target_run, "comparison_runs": "ALL", "target_files": target_files, "random_seed": 42, **content}],
+        },
+    }
+
+def _prepare_corpus(work_folder, scale, params):
+    """
+    Generate the corpus of a scale unless it already exists with the same parameters.
+    """
+    corpus_folder = os.path.join(work_folder, f"corpus_{scale}")
+    params_path = os.path.join(corpus_folder, "corpus.json")
+    if os.path.exists(params_path):
+        with open(params_path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        if all(existing.get(k) == v for k, v in params.items()):
+            return corpus_folder
+    generate_corpus(corpus_folder, **params)
+    return corpus_folder
+
+def _version():
+    """
+    Installed LogDelta version, used to compare results across versions.
+    """
+    try:
+        from importlib.metadata import version
+        return version("logdelta")
+    except Exception:
+        return "dev"
+
+def run_benchmark(work_folder="Benchmark", scale_names=("small",), label=None, repeat=1):
+    """
+    Time loading and each analysis step for the given scales.
+
+    Returns:
+    - List of result dictionaries (scale, step, repeat, seconds, ...). Also written to
+      <work_folder>/results/<version>_<timestamp>.json.
+    """
+    # Imported here so that the corpus generator and result comparison work without the analysis dependencies
+    from logdelta import config_runner
+    import logdelta.log_analysis_functions as log_analysis_functions
+
+    version = label or _version()
+    results = []
+    for scale in scale_names:
+        params = scales[scale]
+        corpus_folder = os.path.abspath(_prepare_corpus(work_folder, scale, params))
+        output_folder = os.path.abspath(os.path.join(work_folder, f"output_{scale}"))
+        target_run = sorted(d for d in os.listdir(corpus_folder) if os.path.isdir(os.path.join(corpus_folder, d)))[0]
+        target_files = ["container__01_000001.log", "container__01_000002.log"][:params["files_per_run"]]
+        config = benchmark_config(corpus_folder, output_folder, target_run, target_files)
+        for rep in range(repeat):
+            start = time.perf_counter()
+            df = config_runner.load_data(config)
+            results.append({"scale": scale, "step": "load_data", "repeat": rep, "seconds": time.perf_counter() - start, "rows": df.height})
+            config_runner.configure_output(config)
+            for step_type, items in config["steps"].items():
+                start = time.perf_counter()
+                config_runner.run_steps(df, {step_type: items})
+                log_analysis_functions.flush_output()
+                results.append({"scale": scale, "step": step_type, "repeat": rep, "seconds": time.perf_counter() - start, "rows": df.height})
+                print(f"[{scale}] {step_type}: {results[-1]['seconds']:.2f}s")
+            del df
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    for result in results:
+        result.update({"version": version, "timestamp": timestamp, "python": platform.python_version(), "machine": platform.machine()})
+    results_folder = os.path.join(work_folder, "results")
+    os.makedirs(results_folder, exist_ok=True)
+    results_path = os.path.join(results_folder, f"{version}_{timestamp}.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Benchmark results written to: {results_path}")
+    return results
+
+# Dependencies that are imported only by the steps that need them
+heavy_modules = ["loglead", "sklearn", "umap", "numba", "plotly", "scipy"]
+
+def _time_in_fresh_interpreter(statement):
+    """
+    Seconds it takes to run statements in a new Python process and the heavy modules they loaded.
+    """
+    code = (
+        "import time, sys, json\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {heavy_modules!r} if m in sys.modules]}}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def light_config(corpus_folder, output_folder, target_run):
+    """
+    Config with only a step that needs no heavy dependency (distance_run_file) and no masking or parsing.
+    """
+    return {
+        "input_data_folder": corpus_folder,
+        "output_folder": output_folder,
+        "table_output": "csv",
+        "preprocessing_steps": [{"name": "remove_run_name_from_file_names"}],
+        "regex_masking": {"enabled": False},
+        "pre_parse": {"enabled": False},
+        "steps": {"distance_run_file": [{"target_run": target_run, "comparison_runs": "ALL"}]},
+    }
+
+def benchmark_startup(repeat=5, work_folder="Benchmark"):
+    """
+    Compare the cold start of the config runner with the time of importing all heavy dependencies
+    eagerly, which is what every config paid before they were imported lazily, and time a light
+    config (see light_config) end to end on the small corpus in a fresh interpreter.
+
+    Returns:
+    - Dictionary with the median seconds and the heavy modules loaded by the config runner import
+      and by the light config.
+    """
+    corpus_folder = os.path.abspath(_prepare_corpus(work_folder, "small", scales["small"]))
+    target_run = sorted(d for d in os.listdir(corpus_folder) if os.path.isdir(os.path.join(corpus_folder, d)))[0]
+    config = light_config(corpus_folder, os.path.abspath(os.path.join(work_folder, "output_light")), target_run)
+    light_run = (
+        "from logdelta import config_runner\n"
+        f"config = json.loads({json.dumps(config)!r})\n"
+        "config_runner.run_config(config, config_runner.load_data(config))"
+    )
+    runner = [_time_in_fresh_interpreter("import logdelta.config_runner") for _ in range(repeat)]
+    eager = [_time_in_fresh_interpreter("import logdelta.config_runner, loglead, loglead.enhancers, sklearn.feature_extraction.text, umap, plotly.express")
+             for _ in range(repeat)]
+    light = [_time_in_fresh_interpreter(light_run) for _ in range(repeat)]
+    result = {
+        "config_runner_import_s": statistics.median(r["seconds"] for r in runner),
+        "eager_heavy_import_s": statistics.median(r["seconds"] for r in eager),
+        "light_config_s": statistics.median(r["seconds"] for r in light),
+        "heavy_modules_loaded_by_config_runner": runner[0]["loaded"],
+        "heavy_modules_loaded_by_light_config": light[0]["loaded"],
+    }
+    print(f"Cold start import of logdelta.config_runner: {result['config_runner_import_s']:.3f}s (median of {repeat})")
+    print(f"With all heavy dependencies imported eagerly: {result['eager_heavy_import_s']:.3f}s (median of {repeat})")
+    print(f"Light config (load and distance_run_file) end to end: {result['light_config_s']:.3f}s (median of {repeat})")
+    print(f"Heavy modules loaded by config_runner import: {result['heavy_modules_loaded_by_config_runner']}")
+    print(f"Heavy modules loaded by the light config: {result['heavy_modules_loaded_by_light_config']}")
+    return result
+
+def check_equivalence(work_folder="Benchmark", scale="small", comparisons=3, tolerance=1e-9):
+    """
+    Check that the shared (run, file) counts (see RunFileCounts) give the results of loglead on a
+    synthetic corpus: _content_distances against LogDistance at run and file level, and
+    _train_test_features against AnomalyDetector.prepare_train_test_data at run and file level, with
+    Count and Tfidf vectorizers. At file level the anomaly scores are compared too, for the detectors
+    that are deterministic (RarityModel and OOVDetector).
+
+    Returns:
+    - List of mismatch descriptions. Empty when everything matches within tolerance.
+    """
+    import polars as pl
+    from loglead import AnomalyDetector, LogDistance
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+    from logdelta import config_runner
+    import logdelta.log_analysis_functions as log_analysis_functions
+
+    params = scales[scale]
+    corpus_folder = os.path.abspath(_prepare_corpus(work_folder, scale, params))
+    output_folder = os.path.abspath(os.path.join(work_folder, f"output_{scale}"))
+    config = benchmark_config(corpus_folder, output_folder, None, [])
+    config_runner.configure_output(config)
+    df = config_runner.load_data(config)
+    df_content, field = log_analysis_functions._prepare_content(df, True, "Words")
+    runs = log_analysis_functions.get_run_catalog(df_content).runs[:comparisons + 1]
+    target_run, comparison_run_names = runs[0], runs[1:]
+    vectorizers = {"Count": CountVectorizer, "Tfidf": TfidfVectorizer}
+    mismatches = []
+
+    def compare(what, ours, theirs):
+        for name, a, b in zip(("cosine", "jaccard", "compression", "containment"), ours, theirs):
+            if (a is None) != (b is None) or (a is not None and abs(a - b) > tolerance):
+                mismatches.append(f"{what} {name}: {a} != {b}")
+
+    def frame(run, file_name=None):
+        # Run level texts join the files in file name order (see RunFileCounts.run_text)
+        selected = df_content.filter(pl.col("run") == run)
+        if file_name is not None:
+            selected = selected.filter(pl.col("file_name") == file_name)
+        return selected.sort("file_name", maintain_order=True)
+
+    def compare_features(what, ours, theirs):
+        for name, a, b in zip(("X_train", "X_test"), ours, theirs):
+            if a.shape != b.shape or abs(a - b).max() > tolerance:
+                mismatches.append(f"anomaly {what} {name}: shapes {a.shape} and {b.shape} or values differ")
+
+    def distances(distance):
+        return distance.cosine(), distance.jaccard(), distance.compression(), distance.containment()
+
+    run_files, _ = log_analysis_functions.get_run_file_counts(df_content, runs, field, "text", True, "Words")
+    run_counts = run_files.run_counts(runs)
+    for vectorizer, vectorizer_class in vectorizers.items():
+        for row, other_run in enumerate(comparison_run_names, start=1):
+            ours = log_analysis_functions._content_distances(run_counts[[0, row]], run_files.run_text(df_content, target_run),
+                                                             run_files.run_text(df_content, other_run), vectorizer)
+            compare(f"run {other_run} {vectorizer}", ours,
+                    distances(LogDistance(frame(target_run), frame(other_run), field=field, vectorizer=vectorizer_class)))
+            for file_name in run_files.file_groups([target_run]):
+                row1, row2 = run_files.row_of[(target_run, file_name)], run_files.row_of.get((other_run, file_name))
+                if row2 is None:
+                    continue
+                ours = log_analysis_functions._content_distances(run_files.counts[[row1, row2]], run_files.file_texts(df_content, target_run)[file_name],
+                                                                 run_files.file_texts(df_content, other_run)[file_name], vectorizer)
+                compare(f"file {other_run}/{file_name} {vectorizer}", ours,
+                        distances(LogDistance(frame(target_run, file_name), frame(other_run, file_name), field=field, vectorizer=vectorizer_class)))
+
+    run_files, _ = log_analysis_functions.get_run_file_counts(df_content, runs, field, "items", True, "Words")
+    for vectorizer, vectorizer_class in vectorizers.items():
+        sad = AnomalyDetector(item_list_col=field, print_scores=False)
+        sad.train_df = run_files.run_documents(df_content, comparison_run_names)
+        sad.test_df = run_files.run_documents(df_content, [target_run])
+        sad.prepare_train_test_data(vectorizer_class=vectorizer_class)
+        X_train, X_test = log_analysis_functions._train_test_features(
+            run_files.counts, [run_files.rows_by_run[run] for run in comparison_run_names], [run_files.rows_by_run[target_run]], vectorizer)
+        compare_features(f"run {vectorizer}", (X_train, X_test), (sad.X_train, sad.X_test))
+
+    # File level as anomaly_file_content: a training document is a file name over all comparison runs,
+    # as the file name groups of the unshared implementation (in the order of file_groups)
+    train_groups = run_files.file_groups(comparison_run_names)
+    df_other_runs = df_content.filter(pl.col("run").is_in(comparison_run_names))
+    train_df = log_analysis_functions._aggregate_dataframe(df_other_runs.with_columns(pl.col("file_name").cast(pl.Utf8)), "file_name", field)
+    train_df = pl.concat([train_df.filter(pl.col("file_name") == file_name) for file_name in train_groups])
+    target_documents = run_files.file_documents(df_content, target_run)
+    detectors = ["RarityModel", "OOVDetector"]
+    for vectorizer, vectorizer_class in vectorizers.items():
+        for file_name in run_files.file_groups([target_run]):
+            test_df = log_analysis_functions._aggregate_dataframe(
+                frame(target_run, file_name).with_columns(pl.col("file_name").cast(pl.Utf8)), "file_name", field)
+            sad = AnomalyDetector(item_list_col=field, print_scores=False)
+            sad.train_df, sad.test_df = train_df, test_df
+            sad.prepare_train_test_data(vectorizer_class=vectorizer_class)
+            features = log_analysis_functions._train_test_features(
+                run_files.counts, list(train_groups.values()), [[run_files.row_of[(target_run, file_name)]]], vectorizer)
+            compare_features(f"file {file_name} {vectorizer}", features, (sad.X_train, sad.X_test))
+            ours = log_analysis_functions._run_anomaly_detection(
+                target_documents.filter(pl.col("file_name") == file_name), pl.DataFrame({"file_name": list(train_groups)}),
+                field, detectors=detectors, vectorizer=vectorizer, features=features)
+            theirs = log_analysis_functions._run_anomaly_detection(test_df, train_df, field, detectors=detectors, vectorizer=vectorizer)
+            for detector in detectors:
+                column = log_analysis_functions._detector_columns[detector]
+                a, b = ours.get_column(column).to_list(), theirs.get_column(column).to_list()
+                if len(a) != len(b) or any(abs(x - y) > tolerance for x, y in zip(a, b)):
+                    mismatches.append(f"anomaly file {file_name} {vectorizer} {detector}: {a} != {b}")
+    log_analysis_functions.clear_prepared_content()
+
+    for mismatch in mismatches:
+        print(mismatch)
+    print(f"Equivalence check on the {scale} corpus: {'OK' if not mismatches else f'{len(mismatches)} mismatches'}")
+    return mismatches
+
+def compare_results(work_folder="Benchmark"):
+    """
+    Print the median seconds per scale and step for every stored result file side by side.
+    """
+    import polars as pl
+    results_folder = os.path.join(work_folder, "results")
+    files = sorted(f for f in os.listdir(results_folder) if f.endswith(".json"))
+    if not files:
+        print(f"No results in {results_folder}")
+        return None
+    rows = []
+    for file in files:
+        with open(os.path.join(results_folder, file), "r", encoding="utf-8") as f:
+            for result in json.load(f):
+                rows.append({"result": file[:-len(".json")], "scale": result["scale"], "step": result["step"], "seconds": result["seconds"]})
+    df = pl.DataFrame(rows)
+    table = (df
+             .group_by("result", "scale", "step")
+             .agg(pl.col("seconds").median())
+             .pivot(on="result", index=["scale", "step"], values="seconds")
+             .sort("scale", "step"))
+    with pl.Config(tbl_rows=200, tbl_cols=20):
+        print(table)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="LogDelta benchmark suite on synthetic corpora")
+    parser.add_argument("-w", "--work-folder", default="Benchmark", help="Folder for corpora, outputs and results (default: Benchmark)")
+    parser.add_argument("-s", "--scales", nargs="+", default=["small"], choices=list(scales), help="Corpus scales to run")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Repetitions per scale")
+    parser.add_argument("-l", "--label", default=None, help="Label of the results (default: installed LogDelta version)")
+    parser.add_argument("--compare", action="store_true", help="Only compare stored results")
+    parser.add_argument("--startup", action="store_true", help="Only measure cold start import time")
+    parser.add_argument("--check", action="store_true", help="Only check the shared count matrices against loglead")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check_equivalence(args.work_folder, args.scales[0]) else 0)
+
+    if args.startup:
+        benchmark_startup(max(args.repeat, 5), args.work_folder)
+        sys.exit(0)
+    if args.compare:
+        compare_results(args.work_folder)
+        sys.exit(0)
+    run_benchmark(args.work_folder, args.scales, label=args.label, repeat=args.repeat)
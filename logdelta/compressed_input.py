@@ -0,0 +1,220 @@
+# Reading of compressed log files (.gz, .bz2, .xz, .zst) and archives (.zip, .tar and compressed tars)
+# without unpacking them to disk. Paths inside the input folder are mapped to run and file name as for
+# plain files: a compressed file loses its compression suffix (run1/app.log.gz -> /run1/app.log) and
+# archive members are placed in the folder of the archive (Hadoop.zip with member run1/app.log -> /run1/app.log).
+import os
+import gzip
+import bz2
+import lzma
+import fnmatch
+import threading
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+compression_suffixes = (".gz", ".bz2", ".xz", ".zst")
+archive_suffixes = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".tar.zst")
+
+def is_archive(path):
+    return path.lower().endswith(archive_suffixes)
+
+def is_compressed(path):
+    return path.lower().endswith(compression_suffixes) and not is_archive(path)
+
+def strip_compression_suffix(path):
+    lower = path.lower()
+    for suffix in compression_suffixes:
+        if lower.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def _open_zstd(fileobj):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files needs the zstandard package: pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+def open_decompressed(fileobj, name):
+    """
+    Binary stream that decompresses fileobj on the fly according to the compression suffix of name.
+    Files without a compression suffix are returned as they are.
+    """
+    lower = name.lower()
+    if lower.endswith(".gz"):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if lower.endswith(".bz2"):
+        return bz2.BZ2File(fileobj, mode="rb")
+    if lower.endswith(".xz"):
+        return lzma.LZMAFile(fileobj, mode="rb")
+    if lower.endswith(".zst"):
+        return _open_zstd(fileobj)
+    return fileobj
+
+# Decompressed data is read in blocks of this many bytes, so a file is never held in memory at once
+_block_bytes = 16 * 1024 * 1024
+
+def _split_lines(data):
+    # A line break never occurs inside a multi-byte UTF-8 character, so blocks end on whole characters
+    return (pl.Series("m_message", [data.decode("utf-8", errors="replace")], dtype=pl.Utf8)
+            .str.split("\n").explode().str.strip_suffix("\r"))
+
+def _lines_frame(stream, file_name):
+    """
+    DataFrame with one row per line of a binary stream in m_message. The stream is read in blocks
+    that are decompressed and split into lines in bulk. Bytes that are not UTF-8 become U+FFFD and
+    such lines are dropped by read_folders like with plain files.
+    """
+    chunks, rest = [], b""
+    while True:
+        block = stream.read(_block_bytes)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind(b"\n")
+        if end < 0:
+            rest = block
+            continue
+        chunks.append(_split_lines(block[:end]))
+        rest = block[end + 1:]
+    if rest:
+        chunks.append(_split_lines(rest))
+    messages = pl.concat(chunks) if chunks else pl.Series("m_message", [], dtype=pl.Utf8)
+    return pl.DataFrame([messages]).with_columns(pl.lit(file_name).alias("file_name"))
+
+def _matches(name, filename_pattern):
+    return fnmatch.fnmatch(os.path.basename(strip_compression_suffix(name)), filename_pattern)
+
+def find_sources(path, folder):
+    """
+    Compressed files and archives below path.
+
+    Returns:
+    - List of (absolute path, path relative to folder) tuples.
+    """
+    sources = []
+    if os.path.isfile(path):
+        candidates = [path]
+    else:
+        candidates = [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+    for candidate in sorted(candidates):
+        if is_archive(candidate) or is_compressed(candidate):
+            sources.append((candidate, os.path.relpath(candidate, folder).replace(os.sep, "/")))
+    return sources
+
+def _member_file_name(relative_dir, member):
+    # Members of tars created from '.' start with './'
+    member = member[2:] if member.startswith("./") else member
+    return "/" + "/".join(part for part in (relative_dir, strip_compression_suffix(member)) if part)
+
+def _read_zip_member(path, relative_dir, member):
+    # One handle per member so that members are decompressed in parallel
+    with zipfile.ZipFile(path) as archive, archive.open(member) as raw, open_decompressed(raw, member) as stream:
+        return [_lines_frame(stream, _member_file_name(relative_dir, member))]
+
+@contextmanager
+def _open_tar(path):
+    if path.lower().endswith(".tar.zst"):
+        with open(path, "rb") as raw, _open_zstd(raw) as reader, tarfile.open(fileobj=reader, mode="r|") as archive:
+            yield archive
+    else:
+        # Streaming mode reads members in archive order without seeking
+        with tarfile.open(path, mode="r|*") as archive:
+            yield archive
+
+def _in_runs(file_name, runs):
+    # file_name is '/run/file'
+    return runs is None or file_name.split("/")[1] in runs
+
+def _read_tar(path, relative_dir, filename_pattern, runs=None):
+    frames = []
+    with _open_tar(path) as archive:
+        for member in archive:
+            file_name = _member_file_name(relative_dir, member.name)
+            if not member.isfile() or not _matches(member.name, filename_pattern) or not _in_runs(file_name, runs):
+                continue
+            with open_decompressed(archive.extractfile(member), member.name) as stream:
+                frames.append(_lines_frame(stream, file_name))
+    return frames
+
+def _read_compressed_file(path, relative):
+    with open(path, "rb") as raw, open_decompressed(raw, path) as stream:
+        return [_lines_frame(stream, "/" + strip_compression_suffix(relative))]
+
+def read_sources(sources, filename_pattern="*.log", workers=None, runs=None):
+    """
+    Read compressed files and archive members into one DataFrame with 'm_message' and 'file_name'
+    ('/run/file' like RawLoader with strip_full_data_path). Files are decompressed as streams and
+    split into lines block by block. Compressed files, zip members and tar archives (which can only be
+    read in order) are read in parallel on one thread pool.
+
+    Parameters:
+    - sources: List of (absolute path, path relative to the input folder) from find_sources.
+    - filename_pattern: Pattern the file names must match after removing the compression suffix.
+    - workers: Number of threads. Defaults to the number of CPUs.
+    - runs: Read only the files of these runs. None reads all.
+    """
+    runs = set(runs) if runs is not None else None
+    workers = workers or os.cpu_count() or 1
+    tasks = []
+    for path, relative in sources:
+        if path.lower().endswith(".zip"):
+            relative_dir = os.path.dirname(relative)
+            with zipfile.ZipFile(path) as archive:
+                members = [info.filename for info in archive.infolist() if not info.is_dir() and _matches(info.filename, filename_pattern)
+                           and _in_runs(_member_file_name(relative_dir, info.filename), runs)]
+            tasks.extend((_read_zip_member, (path, relative_dir, member)) for member in members)
+        elif is_archive(path):
+            tasks.append((_read_tar, (path, os.path.dirname(relative), filename_pattern, runs)))
+        elif _matches(relative, filename_pattern) and _in_runs("/" + relative, runs):
+            tasks.append((_read_compressed_file, (path, relative)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = [frame for result in executor.map(lambda task: task[0](*task[1]), tasks) for frame in result]
+    if not frames:
+        return pl.DataFrame(schema={"m_message": pl.Utf8, "file_name": pl.Utf8})
+    return pl.concat(frames)
+
+# Archive path -> (size, modification time, runs of the members)
+_archive_runs = {}
+_archive_runs_lock = threading.Lock()
+
+def _member_runs(path):
+    """
+    Runs (first folder of the member paths) in an archive. Listed once until the archive changes.
+    """
+    stat = os.stat(path)
+    with _archive_runs_lock:
+        cached = _archive_runs.get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime):
+        return cached[2]
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        with _open_tar(path) as archive:
+            names = [member.name for member in archive if member.isfile()]
+    # Members at the top of the archive ('/file') do not belong to a run
+    parts = [_member_file_name("", name).split("/") for name in names]
+    runs = sorted({part[1] for part in parts if len(part) > 2})
+    with _archive_runs_lock:
+        _archive_runs[path] = (stat.st_size, stat.st_mtime, runs)
+    return runs
+
+def archive_runs(folder):
+    """
+    Runs that are stored in archives placed directly in folder (e.g. Hadoop.zip with the run folders
+    inside) instead of run folders.
+
+    Returns:
+    - Dictionary of run -> list of (absolute path, path relative to folder) of the archives with files of the run.
+    """
+    runs = {}
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if entry.is_file() and is_archive(entry.name):
+            for run in _member_runs(entry.path):
+                runs.setdefault(run, []).append((entry.path, entry.name))
+    return runs
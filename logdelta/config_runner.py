@@ -1,12 +1,13 @@
 import os
+import json
+import hashlib
 import yaml
 import warnings
 from dotenv import load_dotenv, find_dotenv
-from loglead.enhancers import EventLogEnhancer
 
 import logdelta.log_analysis_functions as log_analysis_functions
 from logdelta.log_analysis_functions import (
-    set_output_folder_and_format, read_folders, distance_run_file, distance_run_content,
+    set_output_folder_and_format, set_html_output, set_umap_cache, set_feature_cache, set_parse_workers, set_background_writer, flush_output, read_folders, distance_run_file, distance_run_content,
     distance_file_content, distance_line_content,
     plot_run, plot_file_content,
     anomaly_file_content, anomaly_line_content,
@@ -15,9 +16,15 @@ from logdelta.log_analysis_functions import (
 
 
 import logdelta.regex_masking as regex_masking
+import logdelta.profiling as profiling
+import logdelta.template_state as template_state
+import logdelta.run_store as run_store
+import logdelta.line_index as line_index
+import logdelta.token_index as token_index
 from logdelta.data_specific_preprocessing import preprocess_files
 import inspect
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 def load_config(config_path):
     """
     Load the YAML configuration file.
@@ -35,28 +42,275 @@ def load_config(config_path):
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
-def main(config_path):
-    # Load configuration
-    config = load_config(config_path)
-    print(f"Starting loaded config: {config_path}")
+# Map step types that need to be handled differently
+special_cases = {
+    'plot_run_file': {'func_name': 'plot_run', 'fixed_args': {'file': True, 'content_format':'File'}},
+    'plot_run_content': {'func_name': 'plot_run', 'fixed_args': {'file': False}},
+    'anomaly_run_file': {'func_name': 'anomaly_run', 'fixed_args': {'file': True, 'content_format':'File'}},
+    'anomaly_run_content': {'func_name': 'anomaly_run', 'fixed_args': {'file': False}},
+}
+
+# Steps that prepare content (_prepare_content) on the full DataFrame. Steps with the same
+# mask and content_format share one prepared DataFrame.
+shared_content_steps = {
+    'distance_run_content', 'distance_file_content',
+    'anomaly_run', 'anomaly_file_content', 'anomaly_line_content',
+}
+
+def plan_steps(steps):
+    """
+    Build the step graph from the `steps:` mapping of the config.
+
+    Returns:
+    - tasks: List of (config_item, func, kwargs, content_key) in config order. config_item is a label
+      like 'distance_run_content[3]' (step type and position in the config). content_key is the
+      (mask, content_format) prepared content node the step depends on or None.
+    - content_keys: Prepared content nodes in order of first use.
+    """
+    tasks = []
+    content_keys = []
+    for step_type, configs in steps.items():
+        for config_item in configs:
+            # Determine function to call
+            if step_type in special_cases:
+                func_name = special_cases[step_type]['func_name']
+                fixed_args = special_cases[step_type]['fixed_args']
+            else:
+                func_name = step_type
+                fixed_args = {}
+
+            # Get the function from the module
+            func = getattr(log_analysis_functions, func_name, None)
+
+            if func is None:
+                print(f"Function {func_name} not found")
+                continue
+
+            # Get function parameters
+            func_params = inspect.signature(func).parameters
 
+            # Build kwargs
+            kwargs = {k: v for k, v in config_item.items() if k in func_params}
+
+            # Add fixed args
+            kwargs.update(fixed_args)
+
+            content_key = None
+            if func_name in shared_content_steps:
+                mask = kwargs.get('mask', func_params['mask'].default)
+                content_format = kwargs.get('content_format', func_params['content_format'].default)
+                if content_format != "File":
+                    content_key = (mask, content_format)
+                    if content_key not in content_keys:
+                        content_keys.append(content_key)
+            tasks.append((f"{step_type}[{len(tasks)}]", func, kwargs, content_key))
+    return tasks, content_keys
+
+def run_steps(df, steps, workers=1, keep_prepared=False):
+    """
+    Run the analysis steps of a config against a loaded DataFrame.
+
+    Steps form a graph where shared prepared content stages (mask, content_format) are nodes that
+    the content based steps depend on. With workers > 1 independent nodes run concurrently on a
+    thread pool. Each step writes its own outputs so results match serial execution. With
+    workers=1 steps run one at a time in config order. Prepared content is released after the last
+    step that depends on it. With keep_prepared the prepared content is kept for later calls with
+    the same DataFrame (see clear_prepared_content).
+    """
+    tasks, content_keys = plan_steps(steps)
+    try:
+        if workers is None or workers <= 1:
+            last_use = {task[3]: i for i, task in enumerate(tasks) if task[3] is not None}
+            for i, (config_item, func, kwargs, content_key) in enumerate(tasks):
+                if content_key is not None:
+                    _prepare_shared_content(df, content_key)
+                # Call the function
+                _run_step(config_item, func, df, kwargs)
+                # Wait for the background writes of the step. Raises if writing failed
+                flush_output()
+                if content_key is not None and last_use[content_key] == i and not keep_prepared:
+                    log_analysis_functions.release_prepared_content(df, *content_key)
+        else:
+            _run_steps_concurrently(df, tasks, content_keys, workers, keep_prepared)
+    finally:
+        if not keep_prepared:
+            log_analysis_functions.clear_prepared_content()
+            log_analysis_functions.clear_run_catalogs()
+
+def _run_step(config_item, func, df, kwargs):
+    """
+    Call one step function. Profiled stages of the step are attributed to the step and config item.
+    """
+    profiling.set_context(step=func.__name__, config_item=config_item)
+    try:
+        with profiling.stage("step"):
+            return func(df=df, **kwargs)
+    finally:
+        profiling.set_context()
+
+def _prepare_shared_content(df, content_key):
+    profiling.set_context(step="prepare_content", config_item=str(content_key))
+    try:
+        return log_analysis_functions.prepare_content_shared(df, *content_key)
+    finally:
+        profiling.set_context()
+
+def _run_steps_concurrently(df, tasks, content_keys, workers, keep_prepared=False):
+    """
+    Execute the step graph on a thread pool. A step is submitted as soon as the prepared content
+    it depends on is ready, and the content is released when its last dependent step has finished
+    (unless keep_prepared). The first error is raised after all running nodes have finished.
+    """
+    print(f"Running {len(tasks)} steps and {len(content_keys)} shared content stages with {workers} workers")
+    dependents = {key: [] for key in content_keys}
+    step_content = {task[0]: task[3] for task in tasks}
+    remaining = {key: sum(1 for task in tasks if task[3] == key) for key in content_keys}
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for key in content_keys:
+            futures[pool.submit(_prepare_shared_content, df, key)] = ("content", key)
+        for task in tasks:
+            config_item, func, kwargs, content_key = task
+            if content_key is None:
+                futures[pool.submit(_run_step, config_item, func, df, kwargs)] = ("step", config_item)
+            else:
+                dependents[content_key].append(task)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, item = futures.pop(future)
+                error = future.exception()
+                content_key = step_content[item] if kind == "step" else None
+                if content_key is not None:
+                    remaining[content_key] -= 1
+                    if remaining[content_key] == 0 and not keep_prepared:
+                        log_analysis_functions.release_prepared_content(df, *content_key)
+                if error is not None:
+                    print(f"Failed {kind} {item}: {error}")
+                    errors.append(error)
+                    continue
+                if kind == "content":
+                    for config_item, func, kwargs, _ in dependents[item]:
+                        futures[pool.submit(_run_step, config_item, func, df, kwargs)] = ("step", config_item)
+    flush_output()
+    if errors:
+        raise errors[0]
+
+def configure_output(config):
+    """
+    Apply the output related settings of a config (output folder, table and html format,
+    background writer, UMAP and feature caches and parse workers).
+    """
     # Set output folder
     output_folder = config.get('output_folder')
     table_output = config.get('table_output')
     set_output_folder_and_format(output_folder, table_output)
+    set_html_output(config.get('html_output', "full"), config.get('html_figure_json', False))
+    background_writer = config.get('background_writer', {})
+    set_background_writer(background_writer.get('workers', 0) if background_writer.get('enabled', False) else 0,
+                          background_writer.get('max_queue', 8))
+
+    # Optionally persist fitted UMAP reducers between invocations
+    umap_cache = config.get('umap_cache', {})
+    if umap_cache.get('enabled', False):
+        umap_cache_folder = umap_cache.get('folder', os.path.join(output_folder, "umap_cache"))
+        set_umap_cache(umap_cache_folder, umap_cache.get('max_new_fraction', 0.2), umap_cache.get('keep_in_memory', False),
+                       dataset_key=dataset_key(config))
+    else:
+        set_umap_cache(None)
+
+    # Optionally persist feature matrices between invocations
+    feature_cache = config.get('feature_cache', {})
+    if feature_cache.get('enabled', False):
+        set_feature_cache(feature_cache.get('folder', os.path.join(output_folder, "feature_cache")), feature_cache.get('max_size_mb'))
+    else:
+        set_feature_cache(None)
+
+    # Parse-* content formats in steps use the same number of parse workers as pre_parse
+    set_parse_workers((config.get('pre_parse') or {}).get('workers', 1))
 
-    # Set input data folder
+def get_input_data_folder(config):
+    """
+    Input data folder of a config. Falls back to the LOG_DATA_PATH environment variable.
+    """
     input_data_folder = config.get('input_data_folder')
     if not input_data_folder:
         input_data_folder = os.getenv("LOG_DATA_PATH")
         if not input_data_folder:
             print("WARNING!: LOG_DATA_PATH is not set. This will most likely fail")
+    return input_data_folder
+
+def dataset_key(config):
+    """
+    Key of the prepared dataset a config needs. Configs with the same input folder, run list, masking,
+    pre-parse and preprocessing settings can share one loaded and prepared DataFrame. A run list file
+    is keyed by the hash of its content, so editing the file loads the data again.
+    """
+    run_list = config.get('run_list')
+    if isinstance(run_list, str):
+        with open(log_analysis_functions._get_abs_path(run_list), "rb") as f:
+            run_list = {'sha256': hashlib.sha256(f.read()).hexdigest()}
+    input_data_folder = get_input_data_folder(config)
+    if input_data_folder and not os.path.isabs(input_data_folder):
+        input_data_folder = os.path.join(os.getenv("PWD") or os.getcwd(), input_data_folder)
+    return json.dumps({
+        'input_data_folder': os.path.normpath(input_data_folder) if input_data_folder else None,
+        'regex_masking': config.get('regex_masking'),
+        'pre_parse': config.get('pre_parse'),
+        'preprocessing_steps': config.get('preprocessing_steps', []),
+        'out_of_core': (config.get('out_of_core') or {}).get('enabled', False),
+        'line_index': config.get('line_index'),
+        'run_list': run_list,
+    }, sort_keys=True, default=str)
+
+def load_data(config):
+    """
+    Load the input data of a config and apply masking, pre-parsing and data specific preprocessing.
+    """
+    log_analysis_functions.set_line_index((config.get('line_index') or {}).get('enabled', False))
+    if (config.get('out_of_core') or {}).get('enabled', False):
+        return load_data_out_of_core(config)
+    input_data_folder = get_input_data_folder(config)
     # Read data
-    df, _ = read_folders(input_data_folder)
- 
-    
+    df, _ = read_folders(input_data_folder, runs=config.get('run_list'))
+    return prepare_data(config, df)
+
+def load_data_out_of_core(config):
+    """
+    Ingest the runs of a config one at a time into the per-run Parquet store (see run_store) and
+    return a LazyFrame over the store. Runs already in the store are not ingested again.
+    """
+    out_of_core = config['out_of_core']
+    store_folder = log_analysis_functions._get_abs_path(
+        out_of_core.get('store_folder') or os.path.join(config.get('output_folder'), "run_store"), create=True)
+    # The store filters by runs itself, so the run list is not part of its key and changing it
+    # does not ingest the kept runs again
+    key = dataset_key(dict(config, run_list=None))
+    pre_parse = config.get('pre_parse') or {}
+    if pre_parse.get('enabled', False) and not pre_parse.get('state_folder'):
+        # Runs are parsed separately, event ids must be shared between them
+        config = dict(config, pre_parse=dict(pre_parse, state_folder=os.path.join(store_folder, "template_state")))
+    input_data_folder = log_analysis_functions._get_abs_path(get_input_data_folder(config))
+    run_list = config.get('run_list')
+    if isinstance(run_list, str):
+        run_list = log_analysis_functions.read_run_list(run_list)
+    manifest = run_store.update_run_store(input_data_folder, store_folder, key, lambda df: prepare_data(config, df), runs=run_list)
+    log_analysis_functions.set_out_of_core(out_of_core.get('memory_budget_mb'),
+                                           {run: (entry["bytes"], entry["rows"]) for run, entry in manifest["runs"].items()})
+    return run_store.scan_run_store(store_folder, manifest)
+
+def prepare_data(config, df):
+    """
+    Apply masking, pre-parsing and data specific preprocessing of a config to loaded data.
+    """
+    profiling.set_context(step="load_data")
+    if config['regex_masking']['enabled'] or config['pre_parse']['enabled']:
+        # Only masking and parsing need loglead, plain loading does not
+        from loglead.enhancers import EventLogEnhancer
+        enhancer = EventLogEnhancer(df)
     # Check if masking is enabled
-    enhancer = EventLogEnhancer(df)
     if config['regex_masking']['enabled']:
         # Retrieve and apply patterns
         print("Masking data")
@@ -70,7 +324,9 @@ def main(config_path):
             print(f"Applying pattern: {pattern_name}")
             if hasattr(regex_masking, pattern_name):
                 pattern_list = getattr(regex_masking, pattern_name)
-                df = enhancer.normalize(regexs=pattern_list)
+                with profiling.stage("mask", rows_in=df.height) as record:
+                    df = enhancer.normalize(regexs=pattern_list)
+                    record["rows_out"] = df.height
             else:
                 print(f"Unknown masking pattern: {pattern_name}")
     else:
@@ -81,6 +337,8 @@ def main(config_path):
         # Retrieve and apply patterns
         print("Parsing event templates")
         parsers = config['pre_parse']['parsers']  # This is a list of patterns
+        state_folder = config['pre_parse'].get('state_folder')
+        parse_workers = config['pre_parse'].get('workers', 1)
         
         # Apply the patterns in a loop (currently only the last one will be used)
         for parser in parsers:
@@ -88,61 +346,78 @@ def main(config_path):
             method_name = parser_name.split("-")[1].lower()
             method_name = f"parse_{method_name}"
             print(f"Parsing with: {parser_name}")
+            if state_folder or parse_workers > 1:
+                # Reuse templates from earlier invocations and parse only new messages, in parallel if asked
+                df = template_state.parse_incremental(df, parser_name, state_folder, workers=parse_workers)
+                enhancer = EventLogEnhancer(df)
         # Dynamically call the corresponding method if it exists
-            if hasattr(enhancer, method_name):
+            elif hasattr(enhancer, method_name):
                 method = getattr(enhancer, method_name)
-                df = method()
+                with profiling.stage(f"pre_parse:{parser_name}", rows_in=df.height) as record:
+                    df = method()
+                    record["rows_out"] = df.height
             else:
-                raise ValueError(f"No parse method found for {parse_type}")
+                raise ValueError(f"No parse method found for {parser_name}")
     else:
         print("No pre-parsing")
 
     # Data-specific preprocessing
-    df = preprocess_files(df, config.get('preprocessing_steps', []))
-
-    #Start analysis steps
-    steps = config.get('steps', {})
-    # Map step types that need to be handled differently
-    special_cases = {
-        'plot_run_file': {'func_name': 'plot_run', 'fixed_args': {'file': True, 'content_format':'File'}},
-        'plot_run_content': {'func_name': 'plot_run', 'fixed_args': {'file': False}},
-        'anomaly_run_file': {'func_name': 'anomaly_run', 'fixed_args': {'file': True, 'content_format':'File'}},
-        'anomaly_run_content': {'func_name': 'anomaly_run', 'fixed_args': {'file': False}},
-    }
-
-    for step_type, configs in steps.items():
-        for config_item in configs:
-            # Determine function to call
-            if step_type in special_cases:
-                func_name = special_cases[step_type]['func_name']
-                fixed_args = special_cases[step_type]['fixed_args']
-            else:
-                func_name = step_type
-                fixed_args = {}
-
-            # Get the function from the module
-            func = getattr(log_analysis_functions, func_name, None)
-
-            if func is None:
-                print(f"Function {func_name} not found")
-                continue
-
-            # Get function parameters
-            func_params = inspect.signature(func).parameters
+    with profiling.stage("preprocess_files", rows_in=df.height) as record:
+        df = preprocess_files(df, config.get('preprocessing_steps', []))
+        record["rows_out"] = df.height
+    if (config.get('token_index') or {}).get('enabled', False):
+        update_token_index(config, df)
+    if (config.get('line_index') or {}).get('drop_messages', False):
+        # Masking is done. Original messages are read back from the log files when a step needs them
+        df = line_index.drop_messages(df)
+    profiling.set_context()
+    return df
 
-            # Build kwargs
-            kwargs = {k: v for k, v in config_item.items() if k in func_params}
+def update_token_index(config, df):
+    """
+    Add the runs of prepared data to the token index of the config (see token_index).
+    """
+    masking = config['regex_masking']['pattern'][-1]['name'] if config['regex_masking']['enabled'] else None
+    key = json.dumps({k: config.get(k) for k in ('regex_masking', 'pre_parse', 'preprocessing_steps')}, sort_keys=True, default=str)
+    input_data_folder = log_analysis_functions._get_abs_path(get_input_data_folder(config))
+    index_folder = log_analysis_functions._get_abs_path(token_index.index_folder_of_config(config), create=True)
+    token_index.update_token_index(df, index_folder, key, masking, input_data_folder)
 
-            # Add fixed args
-            kwargs.update(fixed_args)
+def configure_profiling(config):
+    """
+    Enable stage profiling if the config asks for it. Stages recorded before run_config
+    (e.g. loading) are written to the profile of the next config that is run.
+    """
+    profiling.enable_profiling(config.get('profiling', {}).get('enabled', False))
 
-            # Add df
-            kwargs['df'] = df
+def run_config(config, df):
+    """
+    Run the steps of a loaded config against an already loaded and prepared DataFrame.
+    """
+    configure_output(config)
 
-            # Call the function
-            func(**kwargs)
+    #Start analysis steps
+    steps = config.get('steps', {})
+    scheduler = config.get('scheduler', {})
+    try:
+        run_steps(df, steps, workers=scheduler.get('workers', 1))
+    finally:
+        set_background_writer(0)
+    profiling_config = config.get('profiling', {})
+    if profiling_config.get('enabled', False):
+        profiling.write_profile(log_analysis_functions.output_folder, profiling_config.get('format', "json"))
+        if profiling_config.get('summary', True):
+            profiling.print_summary()
+        profiling.reset_profile()
+    print(f"Done! See output in folder: {config.get('output_folder')}")
 
-    print(f"Done! See output in folder: {output_folder}")
+def main(config_path):
+    # Load configuration
+    config = load_config(config_path)
+    print(f"Starting loaded config: {config_path}")
+    configure_profiling(config)
+    df = load_data(config)
+    run_config(config, df)
 
 
 if __name__ == "__main__":
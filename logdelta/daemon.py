@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import warnings
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import Request, urlopen
+from dotenv import load_dotenv, find_dotenv
+
+import logdelta.log_analysis_functions as log_analysis_functions
+from logdelta.config_runner import load_config, dataset_key, load_data, configure_output, run_steps
+from logdelta.log_analysis_functions import set_background_writer, flush_output, start_recording_outputs, stop_recording_outputs
+
+default_host = "127.0.0.1"
+default_port = 8765
+
+class LogDeltaSession:
+    """
+    Loaded datasets of a long-lived process. Each distinct dataset (see config_runner.dataset_key)
+    is loaded, masked, pre-parsed and preprocessed once. Content prepared for the steps
+    (tokenized words, trigrams, parsed events) is kept between requests, and fitted UMAP
+    layouts are kept in memory when the umap_cache of the config is enabled.
+    """
+
+    def __init__(self):
+        self.datasets = {}
+        # Step functions use module level settings (output folder, formats), so requests that run steps are serialized
+        self.steps_lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def resolve_config(self, request):
+        """
+        Config of a request: the YAML file in 'config_path' updated with the keys in 'config'.
+        """
+        config = load_config(request['config_path']) if request.get('config_path') else {}
+        config.update(request.get('config') or {})
+        if not config:
+            raise ValueError("Request needs 'config_path' and/or 'config'")
+        return config
+
+    @staticmethod
+    def dataset_id(config):
+        return hashlib.sha1(dataset_key(config).encode("utf-8")).hexdigest()[:12]
+
+    def load(self, config):
+        """
+        Load the dataset of a config unless it is already loaded.
+
+        Returns:
+        - Tuple (dataset id, DataFrame, True if it was loaded by this call).
+        """
+        key = self.dataset_id(config)
+        with self.load_lock:
+            if key not in self.datasets:
+                self.datasets[key] = {"df": load_data(config), "input_data_folder": config.get('input_data_folder'),
+                                      "loaded": time.strftime("%Y-%m-%dT%H:%M:%S")}
+                return key, self.datasets[key]["df"], True
+        return key, self.datasets[key]["df"], False
+
+    def run(self, config, steps=None):
+        """
+        Run steps against the dataset of a config. Steps use the schema of the 'steps:' section of the
+        YAML config and default to the steps of the config.
+
+        Returns:
+        - Dictionary with the dataset id and the paths of the written outputs.
+        """
+        key, df, _ = self.load(config)
+        steps = steps if steps is not None else config.get('steps', {})
+        umap_cache = config.get('umap_cache')
+        if umap_cache and umap_cache.get('enabled', False):
+            config['umap_cache'] = dict(umap_cache, keep_in_memory=True)
+        with self.steps_lock:
+            configure_output(config)
+            start_recording_outputs()
+            try:
+                run_steps(df, steps, workers=config.get('scheduler', {}).get('workers', 1), keep_prepared=True)
+                flush_output()
+            finally:
+                set_background_writer(0)
+                outputs = stop_recording_outputs()
+        return {"dataset": key, "outputs": outputs}
+
+    def drop(self, key=None):
+        """
+        Release a dataset and its prepared content. Without key all datasets are released.
+        """
+        with self.load_lock:
+            keys = [key] if key else list(self.datasets)
+            for k in keys:
+                entry = self.datasets.pop(k, None)
+                if entry is not None:
+                    log_analysis_functions.clear_prepared_content(entry["df"])
+        return {"dropped": keys}
+
+    def status(self):
+        with self.load_lock:
+            datasets = list(self.datasets.items())
+        return {
+            # Out-of-core datasets are LazyFrames without a row count
+            "datasets": {key: {"rows": getattr(entry["df"], "height", None), "input_data_folder": entry["input_data_folder"], "loaded": entry["loaded"]}
+                         for key, entry in datasets},
+            "prepared_content": [list(key) for key in log_analysis_functions.prepared_content_keys()],
+        }
+
+def _make_handler(session, server_holder):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/status":
+                self._reply(200, session.status())
+            else:
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/load":
+                    key, df, loaded = session.load(session.resolve_config(request))
+                    body = {"dataset": key, "rows": getattr(df, "height", None), "loaded": loaded}
+                elif self.path == "/steps":
+                    body = session.run(session.resolve_config(request), request.get('steps'))
+                elif self.path == "/drop":
+                    body = session.drop(request.get('dataset'))
+                elif self.path == "/shutdown":
+                    body = {"shutdown": True}
+                    threading.Thread(target=server_holder[0].shutdown, daemon=True).start()
+                else:
+                    self._reply(404, {"error": f"Unknown path {self.path}"})
+                    return
+                body["seconds"] = round(time.perf_counter() - start, 3)
+                self._reply(200, body)
+            except Exception as e:
+                self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} {format % args}")
+
+    return Handler
+
+def serve(host=default_host, port=default_port):
+    """
+    Serve a LogDeltaSession over HTTP until /shutdown is requested.
+
+    Endpoints (JSON bodies):
+    - POST /load  {"config_path": ..., "config": {...}} loads the dataset of the config.
+    - POST /steps {"config_path": ..., "config": {...}, "steps": {...}} runs steps and returns the output paths.
+    - POST /drop  {"dataset": id} releases a dataset (all datasets without id).
+    - GET /status lists the loaded datasets.
+    - POST /shutdown stops the server.
+    """
+    session = LogDeltaSession()
+    server_holder = []
+    server = ThreadingHTTPServer((host, port), _make_handler(session, server_holder))
+    server_holder.append(server)
+    print(f"LogDelta daemon listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def request(path, body=None, host=default_host, port=default_port):
+    """
+    Send a request to a running daemon and return the decoded JSON reply.
+    """
+    url = f"http://{host}:{port}{path}"
+    if body is None and path == "/status":
+        req = Request(url)
+    else:
+        req = Request(url, data=json.dumps(body or {}).encode("utf-8"), headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(req) as response:
+            return json.loads(response.read())
+    except Exception as e:
+        # HTTPError carries the JSON error reply of the daemon
+        if hasattr(e, "read"):
+            return json.loads(e.read())
+        raise
+
+
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv(find_dotenv())
+
+    # Suppress specific warnings
+    warnings.filterwarnings("ignore", "WARNING! data has no labels. Only unsupervised methods will work.", UserWarning)
+
+    import argparse
+    parser = argparse.ArgumentParser(description="LogDelta daemon. Keeps loaded and prepared data in memory between step requests.")
+    parser.add_argument("command", choices=["serve", "load", "steps", "status", "drop", "shutdown"],
+                        help="serve starts the daemon, the other commands are sent to a running daemon")
+    parser.add_argument("-c", "--config", help="Configuration file (load and steps)")
+    parser.add_argument("-s", "--steps", help="YAML or JSON file with a 'steps:' section to run instead of the steps of the config")
+    parser.add_argument("-d", "--dataset", help="Dataset id (drop)")
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--port", type=int, default=default_port)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port)
+        sys.exit(0)
+
+    body = {}
+    if args.config:
+        body["config_path"] = os.path.abspath(args.config)
+    if args.steps:
+        import yaml
+        with open(args.steps, "r") as f:
+            steps = yaml.safe_load(f)
+        body["steps"] = steps.get('steps', steps)
+    if args.dataset:
+        body["dataset"] = args.dataset
+    reply = request("/" + args.command, None if args.command == "status" else body, args.host, args.port)
+    print(json.dumps(reply, indent=2, default=str))
+    sys.exit(1 if "error" in reply else 0)
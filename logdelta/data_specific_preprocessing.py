@@ -1,52 +1,94 @@
 #Define here any data specific preprocessing
 
+import functools
 import polars as pl
+from logdelta.log_analysis_functions import encode_run_file_columns
+
+# Preprocessing steps that are defined as Polars expressions (see expression_step)
+expression_steps = {}
+
+def expression_step(func):
+    """
+    Register a preprocessing step that returns a list of Polars expressions instead of transforming
+    a DataFrame. preprocess_files fuses consecutive expression steps into one lazy query.
+    The decorated name can still be called with a DataFrame: remove_run_name_from_file_names(df).
+
+    The expressions see 'run' and 'file_name' as plain strings.
+    """
+    expression_steps[func.__name__] = func
+
+    @functools.wraps(func)
+    def apply(df, *args):
+        return _with_plain_run_file(df).with_columns(func(*args))
+    return apply
+
+def _with_plain_run_file(df):
+    # String operations need plain strings, preprocess_files encodes the columns again afterwards
+    return df.with_columns(pl.col("run").cast(pl.Utf8), pl.col("file_name").cast(pl.Utf8))
 
 def preprocess_files(df, preprocessing_steps):
+    """
+    Apply the preprocessing steps of the config in order. Consecutive expression steps run as one
+    lazy query, other steps get the collected DataFrame. A LazyFrame input stays lazy as long as
+    only expression steps are used.
+    """
+    if not preprocessing_steps:
+        return df
+    lazy = isinstance(df, pl.LazyFrame)
+    frame = df.lazy()
+    fused = []
     for step in preprocessing_steps:
         function_name = step['name']
         args = step.get('args', [])
-        
+
+        if function_name in expression_steps:
+            if not fused:
+                frame = _with_plain_run_file(frame)
+            fused.append(function_name)
+            frame = frame.with_columns(expression_steps[function_name](*args))
+            continue
+
         function_to_call = globals().get(function_name)
         if function_to_call:
             # Call the function with the DataFrame and specified arguments
-            df = function_to_call(df, *args)
+            frame = function_to_call(frame.collect(), *args).lazy()
+            fused = []
         else:
             print(f"Function {function_name} not found in custom_preprocessing.")
-        
-    return df
 
+    if lazy:
+        return frame
+    # Steps may have changed run or file names. Rebuild the Enum categories
+    return encode_run_file_columns(frame.collect())
 
 
 
-def remove_run_name_from_file_names(df):
+
+@expression_step
+def remove_run_name_from_file_names():
     """
-    Adjusts the container log file names in a Hadoop environment by removing 
-    the application ID part from the file names. This is necessary for making 
+    Adjusts the container log file names in a Hadoop environment by removing
+    the application ID part from the file names. This is necessary for making
     file names consistent across different runs, enabling comparison.
-    
+
     For example, in a run with application ID 'application_1445062781478_0011':
-    
+
     - 'container_1445062781478_0011_01_000001.log' becomes 'container_0011_01_000001.log'
     - 'container_1445062781478_0011_01_000002.log' becomes 'container_0011_01_000002.log'
-    
+
     This renaming ensures that log file names match across all runs after preprocessing.
     """
+    print(f"Running hadoop preprocessing remove_run_name_from_file_names")
     # Extract the <Common_part> by removing the 'application' prefix from 'run'
     # Remove all chars before number. My_run_123_2 has common part 123_2
-    df = df.with_columns(
-        pl.col("run").str.replace_all(r"^[^\d]+", "").alias("common_part")
-    )
-    print(f"Running hadoop preprocessing remove_run_name_from_file_names")
-    
-    # Get unique <Common_part> values
-    unique_parts = df["common_part"].unique()
-    # Loop over unique <Common_part> values to replace them in the 'file_name' column
-    for part in unique_parts:
-        df = df.with_columns([
-            pl.col("file_name").str.replace(part, "").alias("file_name")
-        ])
-
-    df = df.drop("common_part")
-
-    return df
\ No newline at end of file
+    common_part = pl.col("run").str.replace_all(r"^[^\d]+", "")
+    # Each row removes the first occurrence of the common part of its own run. str.replace does not
+    # take a pattern per row, so the part is found and cut out with slices. str.find gives a byte
+    # offset, which is the character offset for the ASCII names of Hadoop runs
+    file_name = pl.col("file_name")
+    position = file_name.str.find(common_part, literal=True)
+    without_common_part = file_name.str.slice(0, position) + file_name.str.slice(position + common_part.str.len_chars())
+    return [pl.when(position.is_null() | (common_part.str.len_chars() == 0))
+            .then(file_name)
+            .otherwise(without_common_part)
+            .alias("file_name")]
@@ -0,0 +1,149 @@
+# Content addressed on-disk cache of sparse document-term count matrices and their vocabularies.
+# Distance, anomaly and plot steps vectorize the same documents (runs or files of runs) with the
+# same tokenization. A matrix is stored once as <key>.npz under a key made of a fingerprint of the
+# documents and the settings that produced them (mask, content format, analyzer, aggregation level),
+# so any step of the same or a later invocation can reuse it. Tf-idf weights are derived from the
+# counts by the steps. The least recently used matrices are evicted when the cache exceeds its size.
+import os
+import hashlib
+import threading
+
+import numpy as np
+
+cache_folder = None
+max_bytes = None
+_lock = threading.Lock()
+
+# How documents are split into terms:
+# - items: documents are lists of terms (tokens, lines or event ids) that are counted as such
+# - text: documents are strings tokenized like the default sklearn CountVectorizer
+analyzers = ("items", "text")
+
+def configure(folder, max_size_mb=None):
+    """
+    Set the cache folder (None disables the cache) and its size limit in MB (None is unlimited).
+    """
+    global cache_folder, max_bytes
+    cache_folder = folder
+    max_bytes = max_size_mb * 2**20 if max_size_mb else None
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+def enabled():
+    return cache_folder is not None
+
+def make_key(*parts):
+    """
+    Cache key of the settings and the document fingerprint that produced a matrix.
+    """
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:24]
+
+def fingerprint_documents(documents):
+    """
+    Fingerprint of a list of documents (strings or lists of terms), in order.
+    """
+    digest = hashlib.sha256()
+    for document in documents:
+        data = document if isinstance(document, str) else "\x1f".join(str(term) for term in document)
+        digest.update(hashlib.sha1(data.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+def _path(key):
+    return os.path.join(cache_folder, f"dtm_{key}.npz")
+
+def _create_vectorizer(analyzer):
+    from sklearn.feature_extraction.text import CountVectorizer
+    if analyzer == "items":
+        from logdelta.log_analysis_functions import _identity_tokenizer
+        return CountVectorizer(analyzer=_identity_tokenizer)
+    if analyzer == "text":
+        return CountVectorizer()
+    raise ValueError(f"Unknown analyzer: {analyzer}. Valid options are: {', '.join(analyzers)}")
+
+def vectorize(documents, analyzer):
+    """
+    Count matrix (csr, columns in sorted vocabulary order) and vocabulary of documents.
+    An empty vocabulary gives a matrix without columns.
+    """
+    from scipy import sparse
+    vect = _create_vectorizer(analyzer)
+    try:
+        counts = vect.fit_transform(documents).tocsr()
+    except ValueError as e:
+        if "empty vocabulary" not in str(e):
+            raise
+        return sparse.csr_matrix((len(documents), 0), dtype=np.int64), []
+    return counts, vect.get_feature_names_out().tolist()
+
+def load(key):
+    """
+    Cached (matrix, vocabulary) of a key or None. A hit marks the entry as recently used.
+    """
+    if not enabled():
+        return None
+    from scipy import sparse
+    path = _path(key)
+    try:
+        with np.load(path) as data:
+            matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+            vocabulary = data["vocabulary"].tobytes().decode("utf-8").split("\x1f") if data["vocabulary"].size else []
+        os.utime(path)
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None
+    return matrix, vocabulary
+
+def store(key, matrix, vocabulary):
+    """
+    Write a matrix and its vocabulary and evict the least recently used entries above the size limit.
+    """
+    if not enabled():
+        return
+    path = _path(key)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape),
+                 vocabulary=np.frombuffer("\x1f".join(vocabulary).encode("utf-8"), dtype=np.uint8))
+    os.replace(tmp_path, path)
+    _evict()
+
+def _evict():
+    if max_bytes is None:
+        return
+    with _lock:
+        entries = []
+        for entry in os.scandir(cache_folder):
+            if entry.name.startswith("dtm_") and entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def count_matrix(documents, analyzer, key_parts, fingerprint=None):
+    """
+    Count matrix and vocabulary of documents, read from the cache when possible.
+
+    Parameters:
+    - documents: List of documents, strings for analyzer 'text' and lists of terms for 'items'.
+    - analyzer: 'items' or 'text'.
+    - key_parts: Settings that produced the documents, e.g. (mask, content format, level).
+    - fingerprint: Fingerprint of the documents if already known (e.g. from Polars row hashes).
+
+    Returns:
+    - Tuple (csr matrix with one row per document, vocabulary list, True if read from the cache).
+    """
+    if not enabled():
+        return (*vectorize(documents, analyzer), False)
+    key = make_key(analyzer, *key_parts, fingerprint or fingerprint_documents(documents))
+    cached = load(key)
+    if cached is not None:
+        return (*cached, True)
+    matrix, vocabulary = vectorize(documents, analyzer)
+    store(key, matrix, vocabulary)
+    return matrix, vocabulary, False
@@ -0,0 +1,148 @@
+# Byte offset index of log lines. With the index the original messages can be dropped after masking
+# and tokenization and read back from the log files (memory mapped) only for the rows that are shown,
+# e.g. the files of level 4 outputs.
+import os
+import mmap
+import fnmatch
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+
+index_columns = ("source_file", "line_offset", "line_length")
+
+def _index_file(path, file_name):
+    """
+    Lines of one file with their byte offsets and lengths. The length excludes the line break.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    parts = data.split(b"\n")
+    if parts and parts[-1] == b"":
+        parts.pop()
+    lengths = np.fromiter(map(len, parts), dtype=np.int64, count=len(parts))
+    offsets = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])) if len(parts) else lengths
+    # A line break never occurs inside a multi-byte UTF-8 character, so decoded and byte lines align
+    lines = data.decode("utf-8", errors="replace").split("\n")[:len(parts)]
+    return pl.DataFrame({
+        "m_message": [line[:-1] if line.endswith("\r") else line for line in lines],
+        "file_name": [file_name] * len(parts),
+        "source_file": [path] * len(parts),
+        "line_offset": offsets,
+        "line_length": lengths,
+    }, schema={"m_message": pl.Utf8, "file_name": pl.Utf8, "source_file": pl.Utf8, "line_offset": pl.UInt64, "line_length": pl.UInt32})
+
+def read_indexed_files(path, folder, filename_pattern="*.log", workers=None):
+    """
+    Read plain log files below path like RawLoader (file_name is '/run/file' relative to folder)
+    and add the columns source_file, line_offset and line_length.
+    """
+    files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names if fnmatch.fnmatch(f, filename_pattern))
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        frames = list(executor.map(lambda f: _index_file(f, "/" + os.path.relpath(f, folder).replace(os.sep, "/")), files))
+    if not frames:
+        return _index_file_schema()
+    # Categorical: the path repeats on every line of a file
+    return pl.concat(frames).with_columns(pl.col("source_file").cast(pl.Categorical))
+
+def _index_file_schema():
+    return pl.DataFrame(schema={"m_message": pl.Utf8, "file_name": pl.Utf8, "source_file": pl.Categorical,
+                                "line_offset": pl.UInt64, "line_length": pl.UInt32})
+
+class LineReader:
+    """
+    Read original lines by (source_file, line_offset, line_length) from memory mapped log files.
+    At most max_open files are mapped at a time, the least recently used map is closed first. Use as a
+    context manager or call close() to close the remaining maps.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read(self, source_file, start, end):
+        """
+        Bytes start:end of a file. The map is used under the lock so that it is not closed meanwhile.
+        """
+        with self._lock:
+            mapped = self._maps.pop(source_file, None)
+            if mapped is None:
+                with open(source_file, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                while len(self._maps) >= self.max_open:
+                    self._maps.popitem(last=False)[1].close()
+            self._maps[source_file] = mapped
+            return mapped[start:end]
+
+    def read_line(self, source_file, offset, length):
+        line = self._read(source_file, offset, offset + length).decode("utf-8", errors="replace")
+        return line[:-1] if line.endswith("\r") else line
+
+    def _read_file_lines(self, source_file, offsets, lengths):
+        """
+        Lines of one file at the given offsets, read as one block from the first to the last line.
+        """
+        start, end = int(offsets.min()), int((offsets + lengths).max())
+        block = self._read(source_file, start, end)
+        line_starts = np.concatenate(([0], np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")) + 1)) + start
+        # A line break never occurs inside a multi-byte UTF-8 character, so decoded and byte lines align
+        lines = pl.Series("m_message", block.decode("utf-8", errors="replace").split("\n"), dtype=pl.Utf8)
+        return lines.gather(np.searchsorted(line_starts, offsets)).str.strip_suffix("\r")
+
+    def read_lines(self, df):
+        """
+        Original lines of the rows of df as a Series. Rows without index (e.g. from compressed files) are null.
+        The rows of each file are read together.
+        """
+        index = (df.select(pl.col("source_file").cast(pl.Utf8), "line_offset", "line_length")
+                 .with_row_index("row")
+                 .filter(pl.col("source_file").is_not_null()))
+        messages = pl.repeat(None, df.height, dtype=pl.Utf8, eager=True).alias("m_message")
+        for (source_file,), group in index.group_by("source_file"):
+            lines = self._read_file_lines(source_file, group.get_column("line_offset").to_numpy(),
+                                          group.get_column("line_length").to_numpy())
+            messages.scatter(group.get_column("row"), lines)
+        return messages
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+def has_line_index(df):
+    return all(col in df.columns for col in index_columns)
+
+def drop_messages(df):
+    """
+    Drop m_message of the rows that can be read back with the line index (set to null).
+    """
+    if not has_line_index(df):
+        return df
+    return df.with_columns(pl.when(pl.col("source_file").is_null()).then(pl.col("m_message")).otherwise(None).alias("m_message"))
+
+def attach_messages(df, reader=None):
+    """
+    Fill m_message of rows whose message was dropped from the log files. Call on the slices that need
+    the original messages, e.g. the rows of one file. Without a reader the files are mapped for this
+    call only.
+    """
+    if not has_line_index(df) or ("m_message" in df.columns and df.get_column("m_message").null_count() == 0):
+        return df
+    if reader is None:
+        with LineReader() as reader:
+            messages = reader.read_lines(df)
+    else:
+        messages = reader.read_lines(df)
+    if "m_message" in df.columns:
+        return df.with_columns(pl.coalesce(pl.col("m_message"), pl.lit(messages)).alias("m_message"))
+    return df.with_columns(messages)
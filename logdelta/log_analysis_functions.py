@@ -2,20 +2,38 @@ import os
 import polars as pl
 import inspect
 import datetime
-from loglead.loaders import RawLoader
-from loglead import LogDistance, AnomalyDetector
-import umap
-import plotly.express as px
-import plotly.graph_objects as go
+import hashlib
+import pickle
+import gzip
+import glob
+import fnmatch
+import json
+import threading
+import weakref
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from loglead.enhancers import EventLogEnhancer
+import logdelta.profiling as profiling
+import logdelta.compressed_input as compressed_input
+import logdelta.line_index as line_index
+import logdelta.feature_cache as feature_cache
+# Heavy dependencies (loglead, sklearn, umap with numba, plotly) are imported by the functions
+# that need them so that steps not using them do not pay their import time.
 
-# Ensure this always gets executed in the same location
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 output_folder = None
 table_output = None
+output_writer = None
+html_output = "full"
+html_figure_json = False
+umap_cache_folder = None
+umap_cache_dataset_key = None
+umap_cache_max_new_fraction = 0.2
+umap_cache_keep_in_memory = False
+_umap_fits = {}
+parse_workers = 1
+line_index_enabled = False
+out_of_core_memory_budget = None
+out_of_core_run_sizes = {}
 
 def set_output_folder_and_format(folder_path, table_output_format):
     """
@@ -31,6 +49,133 @@ def set_output_folder_and_format(folder_path, table_output_format):
     table_output = table_output_format
     print(f"Output folder set to: {output_folder}, Table output format: {table_output}")
 
+def set_html_output(html_output_format="full", figure_json=False):
+    """
+    Set how plots are written.
+
+    Parameters:
+        html_output_format (str): 'full' embeds plotly.js in every HTML file. 'directory' writes plotly.min.js
+            once per output folder and references it from each HTML file. 'cdn' references plotly.js from the CDN.
+        figure_json (bool): Also store the figure data as gzip compressed JSON next to the HTML file.
+    """
+    global html_output, html_figure_json
+    if html_output_format not in ("full", "directory", "cdn"):
+        print(f"Unknown html_output:{html_output_format}. Valid options are: full, directory and cdn. Defaulting to full")
+        html_output_format = "full"
+    html_output = html_output_format
+    html_figure_json = figure_json
+    print(f"HTML output: {html_output}, Figure JSON: {html_figure_json}")
+
+def set_umap_cache(folder_path, max_new_fraction=0.2, keep_in_memory=False, dataset_key=None):
+    """
+    Enable persistence of fitted UMAP reducers for the plot steps.
+
+    Parameters:
+        folder_path (str): Folder where fitted vectorizers, reducers and embeddings are stored. None disables the cache.
+        max_new_fraction (float): Share of runs (relative to the runs in the cached fit) that may be projected
+            with `transform` before the cached fit is considered stale and UMAP is refitted.
+        keep_in_memory (bool): Also keep loaded fits in memory so that later plots in the same process
+            do not unpickle them again (used by the daemon).
+        dataset_key (str): Key of the loaded dataset (see config_runner.dataset_key). Fits are only reused
+            for the same dataset, as different input folders can have runs with the same names.
+    """
+    global umap_cache_folder, umap_cache_max_new_fraction, umap_cache_keep_in_memory, umap_cache_dataset_key
+    umap_cache_folder = _get_abs_path(folder_path, create=True) if folder_path else None
+    umap_cache_max_new_fraction = max_new_fraction
+    umap_cache_keep_in_memory = keep_in_memory
+    umap_cache_dataset_key = dataset_key
+    if not keep_in_memory:
+        _umap_fits.clear()
+    print(f"UMAP cache folder set to: {umap_cache_folder}, max new fraction: {umap_cache_max_new_fraction}")
+
+
+def set_feature_cache(folder_path, max_size_mb=None):
+    """
+    Keep document-term count matrices of the distance, anomaly and plot steps on disk (see feature_cache)
+    so that steps of the same or a later invocation reuse them instead of vectorizing again.
+
+    Parameters:
+        folder_path (str): Folder of the cache. None disables the cache.
+        max_size_mb (int): Size limit. The least recently used matrices are removed above it. None is unlimited.
+    """
+    feature_cache.configure(_get_abs_path(folder_path, create=True) if folder_path else None, max_size_mb)
+    print(f"Feature cache folder set to: {feature_cache.cache_folder}, max size: {max_size_mb} MB")
+
+def set_parse_workers(workers=1):
+    """
+    Set the number of worker processes used by Parse-* content formats. With more than one
+    worker the distinct messages are partitioned across processes, see template_state.parse_parallel.
+    """
+    global parse_workers
+    parse_workers = max(1, int(workers))
+
+def set_line_index(enabled=False):
+    """
+    Record the source file, byte offset and length of each line of plain log files when loading
+    (see line_index). Original messages can then be dropped and read back only when needed.
+    """
+    global line_index_enabled
+    line_index_enabled = enabled
+
+def set_out_of_core(memory_budget_mb=None, run_sizes=None):
+    """
+    Configure out-of-core execution, where steps get a LazyFrame over the per-run store (see run_store).
+
+    Parameters:
+        memory_budget_mb (int): Approximate memory for data collected at once. Runs aggregated together
+            are collected in batches that fit the budget and the streaming chunk size is derived from it.
+            None collects all runs a step needs at once.
+        run_sizes (dict): Run -> (estimated in-memory bytes, rows).
+    """
+    global out_of_core_memory_budget, out_of_core_run_sizes
+    out_of_core_memory_budget = memory_budget_mb * 2**20 if memory_budget_mb else None
+    out_of_core_run_sizes = dict(run_sizes or {})
+    if out_of_core_memory_budget and out_of_core_run_sizes:
+        rows = sum(size for _, size in out_of_core_run_sizes.values())
+        row_bytes = sum(size for size, _ in out_of_core_run_sizes.values()) / max(rows, 1)
+        # Leave room for the batches of all streaming threads and for tokenized content
+        chunk_rows = int(out_of_core_memory_budget / max(row_bytes, 1) / (8 * (os.cpu_count() or 1)))
+        pl.Config.set_streaming_chunk_size(max(1000, chunk_rows))
+    print(f"Out-of-core memory budget: {memory_budget_mb} MB")
+
+def _schema(df):
+    """
+    Schema of a DataFrame or LazyFrame. Resolving a LazyFrame schema does not read data.
+    """
+    if isinstance(df, pl.LazyFrame) and hasattr(df, "collect_schema"):
+        return df.collect_schema()
+    return df.schema
+
+def _collect(df):
+    """
+    Collect a LazyFrame (e.g. a run or file slice in out-of-core mode) with the streaming engine.
+    DataFrames are returned as they are.
+    """
+    if not isinstance(df, pl.LazyFrame):
+        return df
+    try:
+        return df.collect(engine="streaming")
+    except TypeError:
+        # Polars versions before the engine argument
+        return df.collect(streaming=True)
+
+def _run_batches(runs):
+    """
+    Split runs into batches whose estimated in-memory size fits the out-of-core memory budget.
+    """
+    if not out_of_core_memory_budget:
+        return [list(runs)] if runs else []
+    batches, batch, batch_bytes = [], [], 0
+    for run in runs:
+        run_bytes = out_of_core_run_sizes.get(run, (0, 0))[0]
+        if batch and batch_bytes + run_bytes > out_of_core_memory_budget:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(run)
+        batch_bytes += run_bytes
+    if batch:
+        batches.append(batch)
+    return batches
 
 def _get_abs_path_OLD(path):
     if not os.path.isabs(path):
@@ -67,14 +212,17 @@ def _get_abs_path(path, create=False):
     
     return abs_path
 
-def read_folders(folder, filename_pattern= "*.log"):
+def read_folders(folder, filename_pattern= "*.log", runs=None):
     """
-    read_folders(folder: str, filename_pattern: str = "*.log") -> Tuple[DataFrame, int]
+    read_folders(folder: str, filename_pattern: str = "*.log", runs=None) -> Tuple[DataFrame, int]
     Loads log files from the specified folder, applying filters and transformations.
 
     Args:
         folder (str): Path to the folder containing log files.
         filename_pattern (str): Pattern for matching files (default: "*.log").
+        runs (list or str): Load only these runs. A string is the path of a run list file
+            (one run per line, see subset_data_to_new_dir). Other folders are not scanned. Runs
+            without a folder are read from the archives placed in folder (see list_runs).
 
     Returns:
         Tuple[DataFrame, int]: 
@@ -87,21 +235,256 @@ def read_folders(folder, filename_pattern= "*.log"):
     """
     folder = _get_abs_path(folder)
     print(f"Loading data from: {folder}")
-    loader = RawLoader(folder, filename_pattern=filename_pattern, strip_full_data_path=folder)
-    df = loader.execute()
-    df = df.filter(pl.col("m_message").is_not_null()) #We lose lines with nulls. 
-    df = df.filter(~pl.col("m_message").str.contains("�")) #We lose non-utf8 lines. 
-
-    df = df.with_columns([
-        # Extract the first part of the path and create the 'run' column
-        pl.col("file_name").str.extract(r'^/([^/]+)', 1).alias("run"),
-        # Remove the first part of the path to keep the rest in 'file_name'
-        pl.col("file_name").str.replace(r'^/[^/]+/', '', literal=False).alias("file_name")
-    ])
-    unique_runs = len(df.select("run").unique().to_series().to_list())
+    if runs is None:
+        df = _load_log_files(folder, folder, filename_pattern)
+    else:
+        if isinstance(runs, str):
+            runs = read_run_list(runs)
+        frames, missing = _load_runs(folder, runs, filename_pattern)
+        if missing:
+            print(f"Runs not found in {folder} and skipped: {missing}")
+        if len(missing) == len(runs):
+            raise ValueError(f"None of the {len(runs)} listed runs exist in {folder}")
+        df = pl.concat(frames, how="diagonal_relaxed") if len(frames) > 1 else frames[0]
+    df = encode_run_file_columns(df)
+    unique_runs = len(run_file_catalog(df)[0])
     print (f"Loaded {unique_runs} runs (folders) with {df.height} rows from folder {folder}. Nulls and non-UTF-8s dropped.")
     return df, unique_runs
 
+def read_run_list(path):
+    """
+    Run names of a run list file: one run per line, empty lines and lines starting with '#' are ignored.
+    A relative path is resolved like the other paths of a config.
+    """
+    with open(_get_abs_path(path), "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+def read_run(folder, run, filename_pattern="*.log"):
+    """
+    Load the log files of one run (a sub folder of folder or a run in an archive in folder) the same
+    way as read_folders.
+
+    Returns:
+    - Polars DataFrame of the run.
+    """
+    folder = _get_abs_path(folder)
+    frames, missing = _load_runs(folder, [run], filename_pattern)
+    if missing:
+        raise FileNotFoundError(f"Run {run} not found in {folder}")
+    df = frames[0]
+    print(f"Loaded run {run} with {df.height} rows from folder {folder}")
+    return encode_run_file_columns(df)
+
+def list_runs(folder):
+    """
+    Names of the runs in folder: its sub folders and the runs in archives placed directly in folder
+    (see compressed_input.archive_runs).
+    """
+    folders = {entry.name for entry in os.scandir(folder) if entry.is_dir() and not entry.name.startswith(".")}
+    return sorted(folders.union(compressed_input.archive_runs(folder)))
+
+def run_paths(folder, run):
+    """
+    Folder of a run or, for a run without folder, the archives in folder that contain it.
+    """
+    run_folder = os.path.join(folder, run)
+    if os.path.isdir(run_folder):
+        return [run_folder]
+    return [path for path, _ in compressed_input.archive_runs(folder).get(run, [])]
+
+def _load_runs(folder, runs, filename_pattern):
+    """
+    Load runs from their folders. Runs without folder are read from the archives in folder.
+
+    Returns:
+    - Tuple (list of DataFrames, list of runs that were not found).
+    """
+    in_folders = [run for run in runs if os.path.isdir(os.path.join(folder, run))]
+    frames = [_load_log_files(os.path.join(folder, run), folder, filename_pattern) for run in in_folders]
+    archived = compressed_input.archive_runs(folder) if len(in_folders) < len(runs) else {}
+    in_archives = [run for run in runs if run not in in_folders and run in archived]
+    if in_archives:
+        sources = sorted({source for run in in_archives for source in archived[run]})
+        frames.append(_load_log_files(folder, folder, filename_pattern, archive_sources=sources, runs=in_archives))
+    return frames, [run for run in runs if run not in in_folders and run not in in_archives]
+
+def _load_log_files(path, folder, filename_pattern, archive_sources=None, runs=None):
+    """
+    Load log files below path. The first folder of the path relative to folder becomes 'run' and the rest 'file_name'.
+    Compressed files and archives are read directly, see compressed_input. With archive_sources only the
+    files of runs in these archives are read.
+    """
+    with profiling.stage("load") as record:
+        frames = []
+        if archive_sources is not None:
+            sources = archive_sources
+        else:
+            sources = compressed_input.find_sources(path, folder)
+            if line_index_enabled:
+                frames.append(line_index.read_indexed_files(path, folder, filename_pattern))
+            elif not sources or _has_plain_log_files(path, filename_pattern):
+                frames.append(_read_plain_log_files(path, folder, filename_pattern))
+        if sources:
+            print(f"Reading {len(sources)} compressed files and archives")
+            frames.append(compressed_input.read_sources(sources, filename_pattern, runs=runs))
+        df = pl.concat(frames, how="diagonal_relaxed") if len(frames) > 1 else frames[0]
+        record["rows_in"] = df.height
+        df = df.filter(pl.col("m_message").is_not_null()) #We lose lines with nulls. 
+        df = df.filter(~pl.col("m_message").str.contains("�")) #We lose non-utf8 lines. 
+
+        df = df.with_columns([
+            # Extract the first part of the path and create the 'run' column
+            pl.col("file_name").str.extract(r'^/([^/]+)', 1).alias("run"),
+            # Remove the first part of the path to keep the rest in 'file_name'
+            pl.col("file_name").str.replace(r'^/[^/]+/', '', literal=False).alias("file_name")
+        ])
+        record["rows_out"] = df.height
+    return df
+
+def _read_plain_log_files(path, folder, filename_pattern):
+    """
+    Read the plain log files below path with one row per line, as loglead RawLoader with
+    strip_full_data_path=folder reads them ('m_message' and 'file_name' as '/run/file'), without
+    importing loglead. Non-UTF-8 bytes become U+FFFD and such lines are dropped by the caller.
+    """
+    queries = []
+    for subdir, _, _ in os.walk(path):
+        for file in sorted(glob.glob(os.path.join(glob.escape(subdir), filename_pattern))):
+            if os.path.getsize(file) > 0:
+                # A separator that does not occur in logs, so every line is one value
+                queries.append(pl.scan_csv(file, has_header=False, schema={"column_1": pl.Utf8}, infer_schema=False, quote_char=None,
+                                           separator="\a", encoding="utf8-lossy", include_file_paths="file_name", truncate_ragged_lines=True))
+    if not queries:
+        raise ValueError(f"No files matching {filename_pattern} in {path}")
+    return (pl.concat(pl.collect_all(queries))
+            .rename({"column_1": "m_message"})
+            .with_columns(pl.col("file_name").str.strip_prefix(folder)))
+
+def _has_plain_log_files(path, filename_pattern):
+    for _, _, files in os.walk(path):
+        if any(fnmatch.fnmatch(f, filename_pattern) for f in files):
+            return True
+    return False
+
+def encode_run_file_columns(df):
+    """
+    Store the 'run' and 'file_name' columns as pl.Enum with lexically sorted categories.
+
+    Each log line then holds integer codes instead of repeated strings. Filters, is_in and group_by on these
+    columns compare codes, and sorting by code equals sorting by name. Call again whenever the values of
+    the columns change (e.g. after data specific preprocessing of file names).
+    """
+    runs = df.get_column("run").cast(pl.Utf8).drop_nulls().unique().sort()
+    files = df.get_column("file_name").cast(pl.Utf8).drop_nulls().unique().sort()
+    return df.with_columns(
+        pl.col("run").cast(pl.Utf8).cast(pl.Enum(runs)),
+        pl.col("file_name").cast(pl.Utf8).cast(pl.Enum(files)),
+    )
+
+def concat_runs(frames):
+    """
+    Concatenate DataFrames of different runs (e.g. a baseline and a newly arrived run) and re-encode
+    the 'run' and 'file_name' columns. Columns missing from a frame are filled with nulls.
+    """
+    frames = [frame.with_columns(pl.col("run").cast(pl.Utf8), pl.col("file_name").cast(pl.Utf8)) for frame in frames]
+    return encode_run_file_columns(pl.concat(frames, how="diagonal_relaxed"))
+
+def run_file_catalog(df):
+    """
+    Sorted run and file names of a DataFrame. For Enum encoded columns (see encode_run_file_columns)
+    they are read from the categories without scanning the data.
+
+    Returns:
+    - Tuple of (runs, files) lists.
+    """
+    catalog = []
+    for col in ("run", "file_name"):
+        dtype = _schema(df)[col]
+        if isinstance(dtype, pl.Enum):
+            catalog.append(dtype.categories.to_list())
+        else:
+            catalog.append(_collect(df.select(pl.col(col).drop_nulls().unique())).get_column(col).sort().to_list())
+    return catalog[0], catalog[1]
+
+class RunCatalog:
+    """
+    Runs and files present in a DataFrame, computed with one group_by pass. Shared by the run and file
+    selection, grouping and plot helpers instead of scanning the data in each of them.
+    Get it with get_run_catalog(df).
+
+    Attributes:
+    - runs: Sorted run names.
+    - files: Sorted file names of all runs.
+    - files_by_run: Run -> sorted file names of the run.
+    - line_counts: Run -> number of lines.
+    - file_line_counts: (run, file name) -> number of lines.
+    - run_parts: Run -> run name split at '_'.
+    """
+
+    def __init__(self, df):
+        counts = (_collect(df.group_by("run", "file_name").agg(pl.len().alias("lines")))
+                  .with_columns(pl.col("run").cast(pl.Utf8), pl.col("file_name").cast(pl.Utf8))
+                  .filter(pl.col("run").is_not_null())
+                  .sort("run", "file_name"))
+        self.files_by_run = {}
+        self.file_line_counts = {}
+        self.line_counts = {}
+        for run, file_name, lines in counts.iter_rows():
+            self.line_counts[run] = self.line_counts.get(run, 0) + lines
+            if file_name is not None:
+                self.files_by_run.setdefault(run, []).append(file_name)
+                self.file_line_counts[(run, file_name)] = lines
+        self.runs = list(self.line_counts)
+        self.files = sorted({file_name for files in self.files_by_run.values() for file_name in files})
+        self.run_parts = {run: run.split("_") for run in self.runs}
+        self._group_labels = {}
+
+    def group_labels(self, group_by_indices):
+        """
+        Group label of each run: the parts of the run name at group_by_indices joined with '_'.
+        Parts that do not exist are empty.
+        """
+        key = tuple(group_by_indices)
+        if key not in self._group_labels:
+            self._group_labels[key] = {
+                run: "_".join(parts[i] if -len(parts) <= i < len(parts) else "" for i in key)
+                for run, parts in self.run_parts.items()
+            }
+        return self._group_labels[key]
+
+_run_catalogs = {}
+
+def _reference(df):
+    # Weak where possible so that the cache does not keep temporary frames alive
+    try:
+        return weakref.ref(df)
+    except TypeError:
+        return lambda: df
+
+def get_run_catalog(df):
+    """
+    RunCatalog of a DataFrame or LazyFrame. Computed on first use and cached until clear_run_catalogs().
+    """
+    entry = _run_catalogs.get(id(df))
+    if entry is not None and entry[0]() is df:
+        return entry[1]
+    catalog = RunCatalog(df)
+    _run_catalogs[id(df)] = (_reference(df), catalog)
+    return catalog
+
+def _inherit_run_catalog(source, derived):
+    """
+    Share the catalog of source with derived, a frame with the same runs, files and lines
+    (e.g. prepared content or an added column).
+    """
+    entry = _run_catalogs.get(id(source))
+    if derived is not source and entry is not None and entry[0]() is source:
+        _run_catalogs[id(derived)] = (_reference(derived), entry[1])
+    return derived
+
+def clear_run_catalogs():
+    _run_catalogs.clear()
+
 def _prepare_runs(df, target_run, comparison_runs="ALL"):
     """
     Prepares and validates the base and comparison runs from the dataframe.
@@ -120,14 +503,14 @@ def _prepare_runs(df, target_run, comparison_runs="ALL"):
     - ValueError: If the base run name or any comparison run name is not found in the dataframe.
     """
     # Extract unique runs
-    unique_runs = df.select("run").unique().sort("run").to_series().to_list()
+    unique_runs = get_run_catalog(df).runs
 
     # Validate base run name
     if target_run not in unique_runs:
         raise ValueError(f"Base run name '{target_run}' not found in the dataframe. Please provide a valid run name.")
     
     # Get the data for the base run
-    base_run_df = df.filter(pl.col("run") == target_run)
+    base_run_df = _collect(df.filter(pl.col("run") == target_run))
     
     # Initialize the validated_comparison_runs variable
     validated_comparison_runs = []
@@ -218,7 +601,7 @@ def _prepare_runs_OLD(df, target_run, comparison_runs="ALL"):
 
 def _check_multiple_target_runs(df, base_runs):
 
-    unique_runs = df.select("run").unique().sort("run").to_series().to_list()
+    unique_runs = get_run_catalog(df).runs
 
     if base_runs == "ALL":
         base_runs = unique_runs 
@@ -259,6 +642,7 @@ def plot_run(df: pl.DataFrame, target_run: str, comparison_runs="ALL", file=True
     - random_seed: Random seed for reproducibility.
     - group_by_indices: List of integers indicating which parts of the 'run' string to group by.
     """
+    df = _collect_plot_runs(df, target_run, comparison_runs)
     # Apply the grouping by indices if specified
     if group_by_indices:
         df = _plot_group_runs_by_indices(df, group_by_indices)
@@ -275,11 +659,14 @@ def plot_run(df: pl.DataFrame, target_run: str, comparison_runs="ALL", file=True
     filtered_df, field = _prepare_content(filtered_df, mask, content_format=content_format)
     #print (f"field: {field}")
     run_file_groups, documents = _plot_aggregate_run_file_groups(filtered_df, field, content_format, group_by_indices)
-    embeddings_2d, num_unique_words_per_file = _plot_create_dtm_and_umap(documents, content_format, vectorizer, random_seed=None)
+    cache_key = ("plot_run", "file" if file else "content", mask, content_format, vectorizer, random_seed)
+    counts = _plot_counts(run_file_groups, field, content_format, ("run", mask))
+    embeddings_2d, num_unique_words_per_file = _plot_create_dtm_and_umap(documents, content_format, vectorizer, random_seed=random_seed,
+                                                                          run_labels=run_file_groups["run"].to_list(), cache_key=cache_key, counts=counts)
     
     #Prepare simple plot lines X unique_terms
-    line_count = filtered_df.group_by("run").agg([pl.count().alias("line_count")]).sort("run")
-    line_count_values = line_count.select("line_count").to_numpy().ravel()
+    line_counts = get_run_catalog(df).line_counts
+    line_count_values = np.array([line_counts[run] for run in run_file_groups["run"].cast(pl.Utf8).to_list()])
     num_unique_words_per_file = np.asarray(num_unique_words_per_file).ravel()  # Ensure it's a 1D array
     line_count_values = np.asarray(line_count_values).ravel()  # Ensure it's a 1D array
     combined_data = np.column_stack((embeddings_2d, num_unique_words_per_file, line_count_values))
@@ -290,6 +677,15 @@ def plot_run(df: pl.DataFrame, target_run: str, comparison_runs="ALL", file=True
     _write_output(fig1, analysis=f"plot_run_{'file' if file else 'content'}_umap", level=1 if file else 2, mask=mask, target_run=target_run, comparison_run="Many", content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
     _write_output(fig2, analysis=f"plot_run_{'file' if file else 'content'}_simple", level=1 if file else 2, mask=mask, target_run=target_run, comparison_run="Many", content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
 
+def _collect_plot_runs(df, target_run, comparison_runs):
+    """
+    Plots embed all included runs at once. In out-of-core mode only those runs are collected.
+    """
+    if not isinstance(df, pl.LazyFrame):
+        return df
+    _, comparison_run_names = _prepare_runs(df, target_run, comparison_runs)
+    return _collect(df.filter(pl.col("run").is_in([target_run] + comparison_run_names)))
+
 def _plot_group_runs_by_indices(df: pl.DataFrame, group_by_indices: list[int]) -> pl.DataFrame:
     """
     Groups the 'run' column based on specified indices.
@@ -301,35 +697,114 @@ def _plot_group_runs_by_indices(df: pl.DataFrame, group_by_indices: list[int]) -
     Returns:
     - Polars DataFrame with an added 'group' column.
     """
+    # Run 1_33_44 with indices [0, 2] gets group 1_44. Labels are computed once per run in the catalog
+    labels = get_run_catalog(df).group_labels(group_by_indices)
+    groups = pl.DataFrame({"run": list(labels.keys()), "group": list(labels.values())},
+                          schema={"run": pl.Utf8, "group": pl.Utf8}).with_columns(pl.col("run").cast(_schema(df)["run"]))
+    return _inherit_run_catalog(df, df.join(groups, on="run", how="left"))
 
-    #S1: Split run string to multiple parts 1_33_44 becomes [1, 33, 44]
-    df = df.with_columns(
-        pl.col("run").str.split("_").alias("run_parts")
-    )
-    #S2:  Loop over and select the parts we want to keep for groups to a new df
-    df_new = None
-    for item in group_by_indices:
-        if df_new is None:
-           df_new = df.select(pl.col("run_parts").list.get(item, null_on_oob=True).alias(f"part_{item}"))
-           df_new = df_new.with_columns(pl.col(f"part_{item}").fill_null(""))
-        else:
-           df_new = df_new.with_columns(df.select(pl.col("run_parts").list.get(item, null_on_oob=True).alias(f"part_{item}")))
-           df_new = df_new.with_columns(pl.col(f"part_{item}").fill_null(""))
-
-    #S3: New df contains only correct columns we merge 
-    df_new = df_new.with_columns(pl.concat_str(pl.col("*"), separator="_",).alias("group"),)
-    #S4: Lose the extra columns
-    df_new = df_new.select(pl.col("group"))
-    df = df.drop("run_parts")
-    #S5 add the group column to df
-    df = df.with_columns(df_new)
-    return df
+_prepared_content = {}
+# Guards changes of _prepared_content. Steps prepare content on worker threads while e.g. the daemon lists it
+_prepared_content_lock = threading.Lock()
+
+def prepare_content_shared(df, mask, content_format):
+    """
+    Prepare content of the full DataFrame once so that several steps can share it.
+
+    The result is kept until clear_prepared_content() is called. Later _prepare_content calls with the
+    same DataFrame object, mask and content format return the shared result instead of recomputing it.
+    """
+    # The entry holds a reference to df, so id(df) cannot be reused while the entry exists
+    entry = _prepared_content.get((id(df), mask, content_format))
+    if entry is not None and entry[0] is df:
+        return entry[1], entry[2]
+    prepared_df, field = _prepare_content(df, mask, content_format)
+    with _prepared_content_lock:
+        _prepared_content[(id(df), mask, content_format)] = (df, prepared_df, field)
+    return prepared_df, field
+
+def register_prepared_content(df, mask, content_format, prepared_df, field):
+    """
+    Register content that was prepared elsewhere (e.g. prepared per run and concatenated) so that
+    _prepare_content(df, mask, content_format) returns it until clear_prepared_content() is called.
+    """
+    with _prepared_content_lock:
+        _prepared_content[(id(df), mask, content_format)] = (df, prepared_df, field)
+
+def prepared_content_keys():
+    """
+    (mask, content format) of each prepared content that is kept, as a snapshot.
+    """
+    with _prepared_content_lock:
+        return [key[1:] for key in _prepared_content]
+
+def clear_prepared_content(df=None):
+    """
+    Release DataFrames kept by prepare_content_shared. With df only the content prepared from df is released.
+    """
+    with _prepared_content_lock, _run_file_counts_lock:
+        if df is None:
+            _prepared_content.clear()
+            _run_file_counts.clear()
+            return
+        released = [df]
+        for key in [key for key, entry in _prepared_content.items() if entry[0] is df]:
+            released.append(_prepared_content.pop(key)[1])
+        for key in [key for key, entry in _run_file_counts.items() if any(entry[0]() is frame for frame in released)]:
+            del _run_file_counts[key]
+
+def release_prepared_content(df, mask, content_format):
+    """
+    Release the content of one mask and content format prepared from df by prepare_content_shared,
+    and the shared counts built on it (see get_run_file_counts).
+    """
+    with _prepared_content_lock, _run_file_counts_lock:
+        entry = _prepared_content.pop((id(df), mask, content_format), None)
+        if entry is not None:
+            for key in [key for key, counts in _run_file_counts.items() if counts[0]() is entry[1]]:
+                del _run_file_counts[key]
 
 def _prepare_content(df, mask, content_format):
     """
     Function to process content (words, trigrams, etc.)  if content format SKLearn or not specified 
     """
+    entry = _prepared_content.get((id(df), mask, content_format))
+    if entry is not None and entry[0] is df:
+        return entry[1], entry[2]
+    if isinstance(df, pl.LazyFrame):
+        return _prepare_content_lazy(df, mask, content_format)
+    with profiling.stage(f"prepare_content:{content_format}", rows_in=df.height) as record:
+        prepared_df, field = _compute_content(df, mask, content_format)
+        record["rows_out"] = prepared_df.height
+    return _inherit_run_catalog(df, prepared_df), field
+
+def _prepare_content_lazy(df, mask, content_format):
+    """
+    _prepare_content for out-of-core mode. Content is computed batch by batch when a slice is collected.
+    Filters on run and file_name are pushed below the computation, so only the rows of the slice are
+    read and tokenized.
+    """
+    if content_format.startswith("Parse-"):
+        # Parsers need all messages at once. Use the event ids of pre_parse instead
+        field_name = f"e_event_{content_format.split('-')[1].lower()}_id"
+        if field_name not in _schema(df):
+            raise ValueError(f"{content_format} needs pre_parse with {content_format} in out-of-core mode")
+        return df, field_name
+    empty, field = _compute_content(_collect(df.head(0)), mask, content_format)
+    prepared_df = df.map_batches(lambda batch: _compute_content(batch, mask, content_format)[0],
+                                 predicate_pushdown=True, projection_pushdown=False, schema=empty.schema, streamable=True)
+    # The catalog of the source reads only run and file_name. On the prepared frame it would tokenize everything
+    get_run_catalog(df)
+    return _inherit_run_catalog(df, prepared_df), field
+
+def _compute_content(df, mask, content_format):
+    """
+    Compute the content column for the content format. See _prepare_content.
+    """
+    from loglead.enhancers import EventLogEnhancer
     field = "e_message_normalized" if mask else "m_message"
+    if field == "m_message":
+        df = line_index.attach_messages(df)
     enhancer = EventLogEnhancer(df)
     if content_format == "Words":
         df = enhancer.words(field)
@@ -338,7 +813,9 @@ def _prepare_content(df, mask, content_format):
         df = enhancer.trigrams(field)
         return df, "e_trigrams"
     elif content_format == "File":
-        return df, "file_name"
+        # file_name is an Enum (see encode_run_file_columns). Content is aggregated, hashed and
+        # vectorized as strings, and grouping by file_name must not collide with the content column
+        return df.with_columns(pl.col("file_name").cast(pl.Utf8).alias("e_file_name")), "e_file_name"
     elif content_format == "Sklearn":
         return df, field
     elif content_format.startswith("Parse-"):
@@ -347,6 +824,10 @@ def _prepare_content(df, mask, content_format):
         method_name = f"parse_{parse_type}"
         field_name = f"e_event_{parse_type}_id"
         
+        if parse_workers > 1:
+            import logdelta.template_state as template_state
+            df = template_state.parse_incremental(df, content_format, field=field, workers=parse_workers)
+            return df, field_name
         # Dynamically call the corresponding method if it exists
         if hasattr(enhancer, method_name):
             method = getattr(enhancer, method_name)
@@ -393,7 +874,7 @@ def _plot_aggregate_run_file_groups(filtered_df_file, field, content_format, gro
             )
         else: 
             run_file_groups = filtered_df_file.select("run", field).group_by("run").agg(
-                pl.col("file_name").unique()
+                pl.col(field).unique()
             )
     else:
         if group_by_indices:
@@ -440,6 +921,7 @@ def _create_vectorizer(content_format: str, vectorizer_type: str):
 
     # vectorizer_params = {}
 
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
     if vectorizer_type == "Count":
         return CountVectorizer
         # return CountVectorizer(**vectorizer_params)
@@ -449,22 +931,20 @@ def _create_vectorizer(content_format: str, vectorizer_type: str):
     else:
         raise ValueError(f"Unsupported vectorizer type: {vectorizer_type}")
 
-def _plot_create_dtm_and_umap(documents, content_format, vectorizer_type, random_seed=None):
+def _identity_tokenizer(tokens):
     """
-    Create a document-term matrix (DTM) and perform UMAP dimensionality reduction.
-
-    Parameters:
-    - documents: List of document strings to be vectorized.
-    - content_format: The format of the content ('Sklearn' or others).
-    - vectorizer_type: Type of vectorizer ('Count' or 'Tfidf').
-    - random_seed: Optional seed for UMAP to ensure reproducibility.
+    Tokenizer for already tokenized content. Module level (not a lambda) so fitted vectorizers can be pickled.
+    """
+    return tokens
 
-    Returns:
-    - embeddings_2d: UMAP-reduced embeddings in 2D space.
+def _plot_create_vectorizer(content_format, vectorizer_type):
     """
+    Create an unfitted vectorizer instance for plotting based on the content format and vectorizer type.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
     # Set vectorizer parameters based on the content format
     vectorizer_params = {
-        'tokenizer': lambda x: x,
+        'tokenizer': _identity_tokenizer,
         'preprocessor': None,
         'token_pattern': None,
         'lowercase': False
@@ -472,23 +952,169 @@ def _plot_create_dtm_and_umap(documents, content_format, vectorizer_type, random
 
     # Create the vectorizer (Count or Tfidf)
     if vectorizer_type == "Count":
-        vect = CountVectorizer(**vectorizer_params)
+        return CountVectorizer(**vectorizer_params)
     elif vectorizer_type == "Tfidf":
-        vect = TfidfVectorizer(**vectorizer_params)
+        return TfidfVectorizer(**vectorizer_params)
     else:
         raise ValueError(f"Unsupported vectorizer type: {vectorizer_type}")
 
-    # Fit the vectorizer to the documents and create the document-term matrix
-    dtm = vect.fit_transform(documents)
+def _plot_counts(run_file_groups, field, content_format, key_parts):
+    """
+    Count matrix of the plot documents from the feature cache, or None when the cache is disabled
+    or fitted UMAP reducers are cached (they keep their own fitted vectorizer).
+    """
+    if not feature_cache.enabled() or umap_cache_folder:
+        return None
+    analyzer = "text" if content_format == "Sklearn" else "items"
+    counts, _, _ = _document_matrix(run_file_groups, ["run"], field, analyzer, (*key_parts, content_format))
+    return counts
+
+def _plot_create_dtm_and_umap(documents, content_format, vectorizer_type, random_seed=None, run_labels=None, cache_key=None, counts=None):
+    """
+    Create a document-term matrix (DTM) and perform UMAP dimensionality reduction.
+
+    Parameters:
+    - documents: List of document strings to be vectorized.
+    - content_format: The format of the content ('Sklearn' or others).
+    - vectorizer_type: Type of vectorizer ('Count' or 'Tfidf').
+    - random_seed: Optional seed for UMAP to ensure reproducibility.
+    - run_labels: Run name of each document. Needed for the UMAP cache.
+    - cache_key: Tuple identifying the plot (mask, content format, vectorizer, file, random seed). If given and the
+      UMAP cache is enabled with set_umap_cache, fitted reducers are reused between invocations.
+    - counts: Count matrix of the documents from the feature cache (see _plot_counts). The vectorizer
+      is then not fitted, tf-idf weights are derived from the counts.
+
+    Returns:
+    - embeddings_2d: UMAP-reduced embeddings in 2D space.
+    """
+    if umap_cache_folder and cache_key is not None and run_labels is not None:
+        return _plot_cached_dtm_and_umap(documents, content_format, vectorizer_type, random_seed, run_labels, cache_key)
+
+    import umap
+    if counts is not None:
+        dtm = counts
+        if vectorizer_type == "Tfidf":
+            from sklearn.feature_extraction.text import TfidfTransformer
+            dtm = TfidfTransformer().fit_transform(counts)
+        elif vectorizer_type != "Count":
+            raise ValueError(f"Unsupported vectorizer type: {vectorizer_type}")
+    else:
+        vect = _plot_create_vectorizer(content_format, vectorizer_type)
+
+        # Fit the vectorizer to the documents and create the document-term matrix
+        with profiling.stage("vectorize", rows_in=len(documents)) as record:
+            dtm = vect.fit_transform(documents)
+            record["rows_out"] = dtm.shape[0]
 
     # Initialize UMAP with or without a random seed
     reducer = umap.UMAP(random_state=random_seed) if isinstance(random_seed, int) else umap.UMAP()
 
     # Perform UMAP dimensionality reduction on the document-term matrix
-    embeddings_2d = reducer.fit_transform(dtm.toarray())
+    with profiling.stage("umap", rows_in=dtm.shape[0]) as record:
+        embeddings_2d = reducer.fit_transform(dtm.toarray())
+        record["rows_out"] = embeddings_2d.shape[0]
     unique_terms_per_document = (dtm > 0).sum(axis=1)
     return embeddings_2d, unique_terms_per_document
 
+def _umap_cache_path(cache_key):
+    """
+    File name of a cached UMAP fit for the dataset of set_umap_cache. The cache key is hashed as it
+    may contain file names.
+    """
+    key_str = "|".join(str(part) for part in (umap_cache_dataset_key, *cache_key))
+    digest = hashlib.sha256(key_str.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(umap_cache_folder, f"umap_{digest}.pkl")
+
+def _document_fingerprint(document):
+    """
+    Fingerprint of one document (a string or a list of tokens) used to detect changed runs.
+    """
+    if isinstance(document, str):
+        data = document
+    else:
+        data = "\x1f".join(str(token) for token in document)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+def _plot_cached_dtm_and_umap(documents, content_format, vectorizer_type, random_seed, run_labels, cache_key):
+    """
+    Same as _plot_create_dtm_and_umap but reuses a persisted fit.
+
+    Runs that were part of the cached fit keep their stored coordinates, new runs are projected
+    with `transform` into the existing layout. The cache is refitted when a run of the cached fit
+    has changed content or when the share of new runs exceeds umap_cache_max_new_fraction.
+    """
+    import umap
+    cache_path = _umap_cache_path(cache_key)
+    fingerprints = [_document_fingerprint(doc) for doc in documents]
+
+    cached = _umap_fits.get(cache_path)
+    if cached is None and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+
+    stale_reason = None
+    if cached is None:
+        stale_reason = "no cached fit"
+    else:
+        fitted = cached["fitted_fingerprints"]
+        changed = [run for run, fp in zip(run_labels, fingerprints) if run in fitted and fitted[run] != fp]
+        new_runs = [run for run in run_labels if run not in fitted]
+        if changed:
+            stale_reason = f"{len(changed)} runs have changed content"
+        elif len(new_runs) > umap_cache_max_new_fraction * len(fitted):
+            stale_reason = f"{len(new_runs)} new runs exceed max new fraction {umap_cache_max_new_fraction}"
+
+    to_project = []
+    if stale_reason:
+        print(f"UMAP cache refit ({stale_reason})")
+        vect = _plot_create_vectorizer(content_format, vectorizer_type)
+        with profiling.stage("vectorize", rows_in=len(documents)) as record:
+            dtm = vect.fit_transform(documents)
+            record["rows_out"] = dtm.shape[0]
+        reducer = umap.UMAP(random_state=random_seed) if isinstance(random_seed, int) else umap.UMAP()
+        with profiling.stage("umap", rows_in=dtm.shape[0]) as record:
+            embeddings_2d = reducer.fit_transform(dtm.toarray())
+            record["rows_out"] = embeddings_2d.shape[0]
+        cached = {
+            "vectorizer": vect,
+            "reducer": reducer,
+            "fitted_fingerprints": dict(zip(run_labels, fingerprints)),
+            "embeddings": {run: (fp, emb) for run, fp, emb in zip(run_labels, fingerprints, embeddings_2d)},
+        }
+        unique_terms_per_document = (dtm > 0).sum(axis=1)
+    else:
+        vect = cached["vectorizer"]
+        reducer = cached["reducer"]
+        embeddings_2d = np.zeros((len(documents), 2))
+        for idx, (run, fp) in enumerate(zip(run_labels, fingerprints)):
+            stored = cached["embeddings"].get(run)
+            if stored is not None and stored[0] == fp:
+                embeddings_2d[idx] = stored[1]
+            else:
+                to_project.append(idx)
+        if to_project:
+            with profiling.stage("vectorize", rows_in=len(to_project)) as record:
+                dtm_new = vect.transform([documents[idx] for idx in to_project])
+                record["rows_out"] = dtm_new.shape[0]
+            with profiling.stage("umap_transform", rows_in=dtm_new.shape[0]) as record:
+                projected = reducer.transform(dtm_new.toarray())
+                record["rows_out"] = projected.shape[0]
+            for idx, emb in zip(to_project, projected):
+                embeddings_2d[idx] = emb
+                cached["embeddings"][run_labels[idx]] = (fingerprints[idx], emb)
+        print(f"UMAP cache hit: {len(documents) - len(to_project)} runs reused, {len(to_project)} runs projected into cached layout")
+        # Unique terms are counted with the analyzer as the cached vocabulary does not contain terms of new runs
+        analyzer = vect.build_analyzer()
+        unique_terms_per_document = np.array([len(set(analyzer(doc))) for doc in documents])
+
+    # Write only when the fit or the stored embeddings changed
+    if stale_reason or to_project:
+        with open(cache_path, "wb") as f:
+            pickle.dump(cached, f)
+    if umap_cache_keep_in_memory:
+        _umap_fits[cache_path] = cached
+    return embeddings_2d, unique_terms_per_document
+
 def _plot_create_umap_plot(embeddings_2d, run_file_groups, group_by_indices, target_run, file):
     """
     Create a UMAP plot using Plotly based on the provided embeddings and run group information.
@@ -504,6 +1130,7 @@ def _plot_create_umap_plot(embeddings_2d, run_file_groups, group_by_indices, tar
     - fig1: First Plotly scatter plot figure object.
     - fig2: Second Plotly scatter plot figure object.
     """
+    import plotly.express as px
 
     if isinstance(file, str):
         title = f"Textual Content Comparison Between Files: {file} <br>Target run with diamond:<br>{target_run}"
@@ -615,6 +1242,7 @@ def plot_file_content(df: pl.DataFrame, target_run: str, comparison_runs="ALL",
     
     The function will create a document-term matrix from the file names for each run.
     """
+    df = _collect_plot_runs(df, target_run, comparison_runs)
     # Apply the grouping by indices if specified
     if group_by_indices:
         df = _plot_group_runs_by_indices(df, group_by_indices)
@@ -628,21 +1256,24 @@ def plot_file_content(df: pl.DataFrame, target_run: str, comparison_runs="ALL",
     # Filter out target run and comparison runs from the DataFrame
     runs_to_include = [target_run] + comparison_run_names
     filtered_df = df.filter(pl.col("run").is_in(runs_to_include))
-    target_files = _prepare_files(df_run1, target_files)
+    target_files = _prepare_files(df_run1, target_files, get_run_catalog(df).files_by_run.get(target_run, []))
 
     filtered_df, field = _prepare_content(filtered_df, mask, content_format=content_format)
 
     for file in target_files:
         filtered_df_file = filtered_df.filter(pl.col("file_name") == file).sort("file_name")
         run_file_groups, documents = _plot_aggregate_run_file_groups(filtered_df_file, field, content_format, group_by_indices)
-        embeddings_2d, num_unique_words_per_file = _plot_create_dtm_and_umap(documents=documents, content_format=content_format, vectorizer_type=vectorizer, random_seed=random_seed)
+        cache_key = ("plot_file_content", mask, content_format, vectorizer, file, random_seed)
+        counts = _plot_counts(run_file_groups, field, content_format, ("file", file, mask))
+        embeddings_2d, num_unique_words_per_file = _plot_create_dtm_and_umap(documents=documents, content_format=content_format, vectorizer_type=vectorizer, random_seed=random_seed,
+                                                                              run_labels=run_file_groups["run"].to_list(), cache_key=cache_key, counts=counts)
         
         #fig = _plot_create_umap_plot(embeddings_2d, run_file_groups, group_by_indices, target_run, file)
         
         #num_unique_words_per_file = (dtm > 0).sum(axis=1).A1
         #Prepare simple plot lines X unique_terms
-        line_count = filtered_df_file.group_by("run").agg([pl.count().alias("line_count")]).sort("run")
-        line_count_values = line_count.select("line_count").to_numpy().ravel()
+        file_line_counts = get_run_catalog(df).file_line_counts
+        line_count_values = np.array([file_line_counts[(run, file)] for run in run_file_groups["run"].cast(pl.Utf8).to_list()])
         num_unique_words_per_file = np.asarray(num_unique_words_per_file).ravel()  # Ensure it's a 1D array
         line_count_values = np.asarray(line_count_values).ravel()  # Ensure it's a 1D array
         combined_data = np.column_stack((embeddings_2d, num_unique_words_per_file, line_count_values))
@@ -671,7 +1302,7 @@ def distance_run_file(df, target_run, comparison_runs="ALL", file_name_prefix=""
     )
     # Compare the base run to each specified comparison run
     for other_run in comparison_run_names:
-        run2 = df.filter(pl.col("run") == other_run)
+        run2 = _collect(df.filter(pl.col("run") == other_run))
         
         # Extract unique file names from each run
         file_names_run1 = run1.select("file_name").unique()
@@ -726,25 +1357,24 @@ def distance_run_content(df, target_run, comparison_runs="ALL", mask=False, cont
         f"Executing {inspect.currentframe().f_code.co_name} with target run '{target_run}' normalized:{mask}, content format:{content_format}, vectorizer:{vectorizer}, field:{field} and {len(comparison_run_names)} comparison runs"
         + (f": {comparison_run_names}" if len(comparison_run_names) < 6 else "")
     )
+    # Run vectors are sums of the file rows of the shared (run, file) counts, pairs are measured on them
+    run_files, _ = get_run_file_counts(df, [target_run] + comparison_run_names, field, "text", mask, content_format)
+    counts = run_files.run_counts([target_run] + comparison_run_names)
+    target_text = run_files.run_text(df, target_run)
+    line_counts = get_run_catalog(df).line_counts
     # Compare the base run to each specified comparison run
-    for other_run in comparison_run_names:
-        run2 = df.filter(pl.col("run") == other_run)
-        
-        vectorizer_obj=_create_vectorizer(content_format=content_format, vectorizer_type=vectorizer)
-        distance = LogDistance(run1, run2,vectorizer=vectorizer_obj, field=field)
-
-        # Measure distances between the base run and the current run
-        cosine = distance.cosine()
-        jaccard = distance.jaccard()
-        compression = distance.compression()
-        containment = distance.containment()
+    for other_row, other_run in enumerate(comparison_run_names, start=1):
+        with profiling.stage("distance", rows_in=line_counts[target_run] + line_counts[other_run]):
+            # Measure distances between the base run and the current run
+            cosine, jaccard, compression, containment = _content_distances(
+                counts[[0, other_row]], target_text, run_files.run_text(df, other_run), vectorizer)
 
         # Append results to the list
         results.append({
             "target_run": target_run,
             "comparison_run": other_run,
-            "target_lines": distance.size1,
-            "comparison_lines": distance.size2,
+            "target_lines": line_counts[target_run],
+            "comparison_lines": line_counts[other_run],
             "cosine": cosine,
             "jaccard": jaccard,
             "compression": compression,
@@ -759,6 +1389,7 @@ def distance_run_content(df, target_run, comparison_runs="ALL", mask=False, cont
     print()  # Newline after progress dots
     results_df = pl.DataFrame(results)
     _write_output(results_df, analysis="dis", level=2, target_run=target_run, comparison_run="Many", mask=mask, content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
+    return results_df
 
 def distance_file_content(df, target_run, comparison_runs="ALL", target_files=False, mask=False, content_format="Words", vectorizer="Count", file_name_prefix=""):
     """
@@ -776,19 +1407,22 @@ def distance_file_content(df, target_run, comparison_runs="ALL", target_files=Fa
     run1, comparison_run_names = _prepare_runs(df, target_run, comparison_runs) 
     results = []
     if target_files:
-        target_files = _prepare_files(run1, target_files)
+        target_files = _prepare_files(run1, target_files, get_run_catalog(df).files_by_run.get(target_run, []))
 
     print(
         f"Executing {inspect.currentframe().f_code.co_name} with target run '{target_run}' normalize:{mask} content_format:{content_format} and {len(comparison_run_names)} comparison runs"
         + (f": {comparison_run_names}" if len(comparison_run_names) < 6 else "")
     )
+    # Pairs of files are measured on rows of the shared (run, file) counts
+    run_files, _ = get_run_file_counts(df, [target_run] + comparison_run_names, field, "text", mask, content_format)
+    counts, row_of_run_file = run_files.counts, run_files.row_of
+    target_texts = run_files.file_texts(df, target_run)
+    file_line_counts = get_run_catalog(df).file_line_counts
+    files_by_run = get_run_catalog(df).files_by_run
     # Compare the base run to each specified comparison run
     for other_run in comparison_run_names:
-        run2 = df.filter(pl.col("run") == other_run)
-        file_names_run1 = run1.select("file_name").unique()
-        file_names_run2 = run2.select("file_name").unique()
-        matching_file_names = file_names_run1.filter(pl.col("file_name").is_in(file_names_run2.get_column("file_name")))
-        matching_file_names_list = matching_file_names.get_column("file_name").to_list()
+        file_names_run2 = set(files_by_run.get(other_run, []))
+        matching_file_names_list = [file_name for file_name in files_by_run.get(target_run, []) if file_name in file_names_run2]
 
         if target_files:
             matching_file_names_list = list(set(target_files).intersection(set(matching_file_names_list)))
@@ -798,18 +1432,17 @@ def distance_file_content(df, target_run, comparison_runs="ALL", target_files=Fa
             f"Comparing against '{other_run}' with {len(matching_file_names_list)} matching files"
             + (f":  {matching_file_names_list}" if len(matching_file_names_list) < 6 else "")
             )
+        other_texts = run_files.file_texts(df, other_run)
         for file_name in matching_file_names_list:
-            run1_file = run1.filter(pl.col("file_name") == file_name)
-            run2_file = run2.filter(pl.col("file_name") == file_name)
+            row1 = row_of_run_file[(target_run, file_name)]
+            row2 = row_of_run_file[(other_run, file_name)]
+            target_lines = file_line_counts[(target_run, file_name)]
+            comparison_lines = file_line_counts[(other_run, file_name)]
 
             # Calculate the distances
-            # Initialize LogSimilarity class for each pair of runs
-            distance = LogDistance(run1_file, run2_file, field=field)
-            # Measure distances between the base run and the current run
-            cosine = distance.cosine()
-            jaccard = distance.jaccard()
-            compression = distance.compression()
-            containment = distance.containment()
+            with profiling.stage("distance", rows_in=target_lines + comparison_lines):
+                # Measure distances between the base run and the current run
+                cosine, jaccard, compression, containment = _content_distances(counts[[row1, row2]], target_texts[file_name], other_texts[file_name])
             #Too slow
             #same, changed, deleted, added = similarity.diff_lines() 
             
@@ -818,8 +1451,8 @@ def distance_file_content(df, target_run, comparison_runs="ALL", target_files=Fa
                 'file_name': file_name,
                 'target_run': target_run,
                 'comparison_run': other_run,
-                'target_lines': distance.size1,
-                'comparison_lines': distance.size2, 
+                'target_lines': target_lines,
+                'comparison_lines': comparison_lines, 
                 'cosine': cosine,
                 'jaccard': jaccard,
                 'compression': compression,
@@ -846,10 +1479,11 @@ def distance_line_content(df, target_run, comparison_runs="ALL", target_files="A
     - base_run_name: Name of the run to compare against others.
     - comparison_runs: Optional list of run names to compare against. If None, compares against all other runs.
     """    
+    from loglead import LogDistance
     field = "e_message_normalized" if mask else "m_message"
     # Extract unique runs and files
     df_run1, comparison_run_names = _prepare_runs(df, target_run, comparison_runs) 
-    target_files = _prepare_files(df_run1, target_files)
+    target_files = _prepare_files(df_run1, target_files, get_run_catalog(df).files_by_run.get(target_run, []))
     df_other_runs = df.filter(pl.col("run").is_in(comparison_run_names))
     print(
         f"Executing {inspect.currentframe().f_code.co_name} with target run '{target_run}' and {len(comparison_run_names)} comparison runs"
@@ -858,17 +1492,19 @@ def distance_line_content(df, target_run, comparison_runs="ALL", target_files="A
     # Compare the base run to each specified comparison run
     for other_run in comparison_run_names:
         for file_name in target_files:
-            df_run1_file =  df_run1.filter(pl.col("file_name") == file_name)
+            df_run1_file = line_index.attach_messages(df_run1.filter(pl.col("file_name") == file_name))
             df_other_run_file = df_other_runs.filter(pl.col("run") == other_run) #Filter one run
-            df_other_run_file = df_other_run_file.filter(pl.col("file_name") == file_name) #Filter one file
-            distance = LogDistance(df_run1_file, df_other_run_file, field=field)
-            diff = distance.diff_lines()
+            df_other_run_file = line_index.attach_messages(_collect(df_other_run_file.filter(pl.col("file_name") == file_name))) #Filter one file
+            with profiling.stage("distance_diff", rows_in=df_run1_file.height + df_other_run_file.height) as record:
+                distance = LogDistance(df_run1_file, df_other_run_file, field=field)
+                diff = distance.diff_lines()
+                record["rows_out"] = diff.height
             
             _write_output(diff, analysis="dis", level=4, target_run=target_run, comparison_run=other_run, mask=mask, file=file_name, file_name_prefix=file_name_prefix)
             print(".", end="", flush=True) #Progress on screen
     print()  # Newline after progress dots
 
-def _prepare_files(df_run1, files="ALL"):
+def _prepare_files(df_run1, files="ALL", available_files=None):
     """
     Prepares and validates the files from the base run data based on the provided configuration.
 
@@ -876,6 +1512,7 @@ def _prepare_files(df_run1, files="ALL"):
     - df_run1: Polars DataFrame containing the data for the base run with a 'file_name' column.
     - files: List of file names, 'ALL' to use all files in the base run, an integer specifying the number of files to use, 
              or a list of file names to be processed (default is 'ALL').
+    - available_files: Files of the base run, e.g. from the RunCatalog. Read from df_run1 if not given.
 
     Returns:
     - files: List of file names to be used in the analysis.
@@ -885,7 +1522,8 @@ def _prepare_files(df_run1, files="ALL"):
     """
     
     # Extract available files from the base run
-    available_files = df_run1.select("file_name").unique().to_series().to_list()
+    if available_files is None:
+        available_files = df_run1.select("file_name").unique().sort("file_name").to_series().cast(pl.Utf8).to_list()
 
     if isinstance(files, list):
         # Check if each specified file exists in the base run data
@@ -940,17 +1578,9 @@ def _calculate_moving_average_all_numeric(df: pl.DataFrame, window_size: int) ->
     if not numeric_cols:
         raise ValueError("No numeric columns found in the DataFrame")
 
-    # Create a new DataFrame with the moving averages
-    moving_avg_df = pl.DataFrame()
-
-    # Add moving average for each numeric column to the new DataFrame
-    for column in numeric_cols:
-        moving_avg_column = f"moving_avg_{window_size}_{column}"
-        moving_avg_df = moving_avg_df.hstack(
-            df.select(pl.col(column).rolling_mean(window_size).alias(moving_avg_column))
-        )
-
-    return moving_avg_df
+    # Create a new DataFrame with the moving average of each numeric column
+    return df.select([pl.col(column).rolling_mean(window_size).alias(f"moving_avg_{window_size}_{column}")
+                      for column in numeric_cols])
 
 def _calculate_zscore_sum(results):
     import numpy as np
@@ -1073,7 +1703,47 @@ def _normalize_measure_columns(df, columns):
         ((df[col] - measure_min) / (measure_max - measure_min)).alias(col) for col in columns
     ])
 
-def _ano_plot_line_scores(df, title, display_mode="markers"):
+def _downsample_min_max(df, column, max_points):
+    """
+    Peak preserving downsampling of one score column.
+
+    Lines are split into equally sized buckets and within each bucket only the rows with the
+    minimum and the maximum score are kept. At most max_points rows are returned so spikes
+    remain visible while the plot stays small.
+
+    Parameters:
+    - df: Polars DataFrame with 'line_number', the score column and 'hover_text'.
+    - column: Name of the score column to downsample.
+    - max_points: Point budget for the column. None or 0 disables downsampling.
+
+    Returns:
+    - Polars DataFrame with 'line_number', the score column and 'hover_text'.
+    """
+    df = df.select("line_number", column, "hover_text")
+    if not max_points or df.height <= max_points:
+        return df
+    bucket_size = -(-df.height // max(max_points // 2, 1))  # Ceil division, two points per bucket
+    df = df.with_columns((pl.col("line_number") // bucket_size).alias("bucket"))
+    peaks = (df
+             .filter(pl.col(column).is_not_null())
+             .filter((pl.col(column) == pl.col(column).min().over("bucket")) |
+                     (pl.col(column) == pl.col(column).max().over("bucket")))
+             .unique(subset=["bucket", column], keep="first", maintain_order=True)
+             .drop("bucket"))
+    return peaks.sort("line_number")
+
+def _ano_plot_line_scores(df, title, display_mode="markers", max_points=None, webgl=True):
+    """
+    Plot normalized line level anomaly scores.
+
+    Parameters:
+    - df: Polars DataFrame with 'line_number', 'm_message' and the score columns.
+    - title: Title of the plot.
+    - display_mode: 'lines', 'markers', or 'lines+markers'.
+    - max_points: Point budget per score column. Larger files are downsampled with min/max per bucket.
+      None keeps all points.
+    - webgl: Use Scattergl (WebGL) traces instead of SVG Scatter traces.
+    """
     # Define the different sets of measures
     measure_groups = {
         "kmeans": [col for col in df.columns if "kmeans" in col],
@@ -1082,12 +1752,16 @@ def _ano_plot_line_scores(df, title, display_mode="markers"):
         "OOVD": [col for col in df.columns if "OOVD" in col]
     }
 
-    # Assuming line_number or row_nr represents the index (X-axis)
-    line_numbers = df['line_number'].to_list()
-    m_messages = df['m_message'].to_list()  # Hover text for each point
-    
-    # Create an empty DataFrame for normalized data
-    df_normalized = df
+    import plotly.graph_objects as go
+    # Hover text for each point. Break into two lines for m_message
+    df_normalized = df.with_columns(
+        pl.concat_str([
+            pl.lit("Log: "),
+            pl.col("m_message").str.slice(0, 100),
+            pl.lit("<br>"),
+            pl.col("m_message").str.slice(100, 105),
+        ]).alias("hover_text")
+    )
 
     # Normalize each measure group separately
     for measure, columns in measure_groups.items():
@@ -1095,21 +1769,22 @@ def _ano_plot_line_scores(df, title, display_mode="markers"):
             df_normalized = df_normalized.with_columns(
                 _normalize_measure_columns(df, columns)
             )
-    
+
     # Create a figure
     fig = go.Figure()
+    scatter = go.Scattergl if webgl else go.Scatter
 
     # Add traces for each normalized column
     for measure, columns in measure_groups.items():
         for col in columns:
             if col in df_normalized.columns:
-                fig.add_trace(go.Scatter(
-                    x=line_numbers,
-                    y=df_normalized[col].to_list(),
+                df_trace = _downsample_min_max(df_normalized, col, max_points)
+                fig.add_trace(scatter(
+                    x=df_trace["line_number"].to_numpy(),
+                    y=df_trace[col].to_numpy(),
                     mode=display_mode,  # Use the display_mode parameter ('lines', 'markers', or 'lines+markers')
                     name=col,
-                    #text=m_messages,  # Set m_message as the hover text
-                    text=[f"Log: {msg[:100]}<br>{msg[100:205]}" for ln, msg in zip(line_numbers, m_messages)],  # Break into two lines for m_message                    hoverinfo='text',  # Show only the text in the tooltip
+                    text=df_trace["hover_text"].to_list(),
                     connectgaps=False,  # Show gaps where there are None values
                     marker=dict(symbol="x", size=4),
                 ))
@@ -1142,15 +1817,18 @@ def anomaly_run(df, target_run, comparison_runs="ALL", file = False, detectors=[
     print(f"Executing {inspect.currentframe().f_code.co_name} with {'file' if file else 'content'} format:{content_format} vectorizer:{vectorizer} anomalies of {len(target_run_names)} target runs with {comparison_runs} comparison runs")
     print(f"Target runs: {target_run_names}")
     print(f"Comparison runs: {comparison_runs}")
+    comparisons = {run: _prepare_runs(df, run, comparison_runs)[1] for run in target_run_names}
+    # The features of a target run are sums of the file rows of the shared (run, file) counts
+    runs = sorted(set(target_run_names).union(*comparisons.values()))
+    run_files, _ = get_run_file_counts(df, runs, field, "items", mask, content_format)
     for target_run_name in target_run_names:
-        df_run1, comparison_run_names = _prepare_runs(df, target_run_name, comparison_runs)
-        df_run1 = _aggregate_dataframe(df_run1, 'run', field)
-        df_other_runs = df.filter(pl.col("run").is_in(comparison_run_names))
-        df_other_runs = _aggregate_dataframe(df_other_runs, 'run', field)
-        #else:
-        #    df_run1 = df_run1.group_by("run").agg(pl.col(field).alias(field))
-        #    df_other_runs = df.filter(pl.col("run").is_in(comparison_run_names)).group_by("run").agg(pl.col(field).alias(field))
-        df_anos = _run_anomaly_detection(df_run1, df_other_runs, detectors=detectors, field= field)
+        comparison_run_names = comparisons[target_run_name]
+        df_run1 = run_files.run_documents(df, [target_run_name])
+        # With the features given the detectors read only the test documents
+        df_other_runs = pl.DataFrame({"run": comparison_run_names}, schema={"run": pl.Utf8})
+        features = _train_test_features(run_files.counts, [run_files.rows_by_run[run] for run in comparison_run_names],
+                                        [run_files.rows_by_run[target_run_name]], vectorizer)
+        df_anos = _run_anomaly_detection(df_run1, df_other_runs, detectors=detectors, field= field, vectorizer=vectorizer, features=features)
         comparison_runs_out = " ".join(comparison_run_names)
         df_anos = df_anos.with_columns(pl.lit(comparison_runs_out).alias("comparison_runs"))
         df_anos_merge = df_anos_merge.vstack(df_anos)
@@ -1159,6 +1837,7 @@ def anomaly_run(df, target_run, comparison_runs="ALL", file = False, detectors=[
     #df_anos_merge = pl.DataFrame(_calculate_zscore_sum_anos(df_anos_merge.to_dict()))
     df_anos_merge = _calculate_zscore_sum_anos(df_anos_merge)
     _write_output(df_anos_merge, analysis="ano", level=1 if file else 2, target_run="Many", comparison_run="Many", mask=mask, file_name_prefix=file_name_prefix)
+    return df_anos_merge
 
 def anomaly_file_content(df, target_run, comparison_runs="ALL", target_files="ALL", detectors=["KMeans"], mask=False, content_format="Words", vectorizer="Count", file_name_prefix=""):
     """
@@ -1174,31 +1853,40 @@ def anomaly_file_content(df, target_run, comparison_runs="ALL", target_files="AL
     df, field = _prepare_content(df, mask, content_format=content_format) 
 
     target_run_names = _check_multiple_target_runs(df, target_run)
+    comparisons = {run: _prepare_runs(df, run, comparison_runs)[1] for run in target_run_names}
+    # A training document (a file name over all comparison runs) is the sum of its rows in the shared (run, file) counts
+    runs = sorted(set(target_run_names).union(*comparisons.values()))
+    run_files, _ = get_run_file_counts(df, runs, field, "items", mask, content_format)
+    counts, row_of_run_file = run_files.counts, run_files.row_of
     # Extract unique runs
     df_anos_merge = pl.DataFrame() 
     for target_run in target_run_names:
-        df_run1, comparison_run_names = _prepare_runs(df, target_run, comparison_runs) 
+        comparison_run_names = comparisons[target_run]
         # Generate output CSV file name based on base run
         print(
             f"Executing {inspect.currentframe().f_code.co_name} with format:{content_format}, vectorizer:{vectorizer}, target_run:{target_run}, field:{field} and {len(comparison_run_names)} comparison runs"
             + (f": {comparison_run_names}" if len(comparison_run_names) < 6 else "")
         )
-        target_files = _prepare_files(df_run1, target_files)
+        target_files = _prepare_files(None, target_files, get_run_catalog(df).files_by_run.get(target_run, []))
         print(f"Predicting {len(target_files)} files: {target_files}")
-        df_other_runs = df.filter(pl.col("run").is_in(comparison_run_names))
         #df_anos_merge = pl.DataFrame()
-        df_other_runs_files = _aggregate_dataframe(df_other_runs,'file_name', field)
+        train_groups = run_files.file_groups(comparison_run_names)
+        target_documents = run_files.file_documents(df, target_run)
+        df_other_runs_files = pl.DataFrame({"file_name": list(train_groups)}, schema={"file_name": pl.Utf8})
 
         for file_name in target_files:
             
-            df_run1_files =  df_run1.filter(pl.col("file_name") == file_name)
-            df_run1_files = _aggregate_dataframe(df_run1_files, 'file_name', field)
             if df_other_runs_files.height == 0:
                 print(f"Found no files matching files in comparisons runs for file: {file_name}")
                 continue
+            row = row_of_run_file.get((target_run, file_name))
+            if row is None:
+                continue
+            df_run1_files = target_documents.filter(pl.col("file_name") == file_name)
 
             #df_anos = _run_anomaly_detection(df_run1_files,df_other_runs_files,detectors=detectors, field= field)
-            df_anos = _run_anomaly_detection(df_run1_files,df_other_runs_files, field= field, detectors=detectors, vectorizer=vectorizer)
+            features = _train_test_features(counts, list(train_groups.values()), [[row]], vectorizer)
+            df_anos = _run_anomaly_detection(df_run1_files,df_other_runs_files, field= field, detectors=detectors, vectorizer=vectorizer, features=features)
 
             df_anos = df_anos.with_columns(pl.lit(file_name).alias("file_name"))
             df_anos = df_anos.with_columns(pl.lit(target_run).alias("target_run"))
@@ -1209,7 +1897,7 @@ def anomaly_file_content(df, target_run, comparison_runs="ALL", target_files="AL
     df_anos_merge = _calculate_zscore_sum_anos(df_anos_merge)
     _write_output(df_anos_merge, analysis="ano", level=3, target_run=target_run, comparison_run="Many", mask=mask, content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
 
-def anomaly_line_content(df, target_run, comparison_runs="ALL", target_files="ALL", detectors=["KMeans"], mask=False, content_format="Words", vectorizer="Count", file_name_prefix=""):
+def anomaly_line_content(df, target_run, comparison_runs="ALL", target_files="ALL", detectors=["KMeans"], mask=False, content_format="Words", vectorizer="Count", file_name_prefix="", plot_max_points=20000, plot_webgl=True):
     """
     Measure distances between one run and specified other runs in the dataframe and save the results as a CSV file.
     
@@ -1219,6 +1907,8 @@ def anomaly_line_content(df, target_run, comparison_runs="ALL", target_files="AL
     - df: Polars DataFrame containing the data with a 'run' column.
     - base_run_name: Name of the run to compare against others.
     - comparison_runs: Optional list of run names to compare against. If ALL, compares against all other runs.
+    - plot_max_points: Point budget per score column in the plot. Longer files are downsampled preserving peaks. None keeps all points.
+    - plot_webgl: Render the plot with WebGL (Scattergl) traces.
     """
     # Extract unique runs
     df, field = _prepare_content(df, mask, content_format=content_format)
@@ -1230,13 +1920,14 @@ def anomaly_line_content(df, target_run, comparison_runs="ALL", target_files="AL
             f"Executing {inspect.currentframe().f_code.co_name} with format:{content_format}, vectorizer:{vectorizer}, target_run:{target_run}, field:{field} and {len(comparison_run_names)} comparison runs"
             + (f": {comparison_run_names}" if len(comparison_run_names) < 6 else "")
         )
-        target_files = _prepare_files(df_run1, target_files)
+        target_files = _prepare_files(df_run1, target_files, get_run_catalog(df).files_by_run.get(target_run, []))
         df_other_runs = df.filter(pl.col("run").is_in(comparison_run_names))
         print(f"Predicting {len(target_files)} files: {target_files}")
         # Loop over each file first
         for file_name in target_files:
-            df_run1_files =  df_run1.filter(pl.col("file_name") == file_name)
-            df_other_runs_files = df_other_runs.filter(pl.col("file_name") == file_name)
+            # Original messages only for the target file. They are shown in the output and the plot
+            df_run1_files = line_index.attach_messages(df_run1.filter(pl.col("file_name") == file_name))
+            df_other_runs_files = _collect(df_other_runs.filter(pl.col("file_name") == file_name))
             if df_other_runs_files.height == 0:
                 print(f"Found no files matching files in comparisons runs for file: {file_name}")
                 continue
@@ -1251,12 +1942,438 @@ def anomaly_line_content(df, target_run, comparison_runs="ALL", target_files="AL
             #Write to file and plot
             _write_output(df_anos, analysis="ano", level=4, target_run=target_run, comparison_run="Many", mask=mask,content_format=content_format, vectorizer=vectorizer,  file=file_name, file_name_prefix=file_name_prefix)
             title = f"Anomaly scores - Normalized:{mask}, Tokenization:{content_format}, Vectorizer:{vectorizer}<br>Target run: {target_run}<br>Target file: {file_name}"
-            fig = _ano_plot_line_scores(df_anos, title)
+            fig = _ano_plot_line_scores(df_anos, title, max_points=plot_max_points, webgl=plot_webgl)
             _write_output(fig, analysis="ano_plot", level=4, target_run=target_run, comparison_run="Many", mask=mask, content_format=content_format, vectorizer=vectorizer, file=file_name, file_name_prefix=file_name_prefix)
             print(".", end="", flush=True) #Progress on screen
         print()  # Newline after progress dots
     print()  # Newline after progress dots
 
+# Score column of each detector in the output of _run_anomaly_detection
+_detector_columns = {
+    "KMeans": "kmeans_pred_ano_proba",
+    "IsolationForest": "IF_pred_ano_proba",
+    "RarityModel": "RM_pred_ano_proba",
+    "OOVDetector": "OOVD_pred_ano_proba",
+}
+
+def anomaly_sweep(df, target_run, comparison_runs="ALL", normal_runs="*Normal*", content_formats=["Words"], vectorizers=["Count"],
+                  detectors=[["KMeans"]], mask=False, workers=None, file_name_prefix=""):
+    """
+    Evaluate a grid of content formats, vectorizers and detector combinations at the run level (as
+    anomaly_run_content) and write one table with the AUC-ROC and timings of each combination.
+
+    Parameters:
+    - target_run: Runs to score, e.g. "PageRank*".
+    - comparison_runs: Runs the detectors are trained on. A target run is left out of its own training runs.
+    - normal_runs: Pattern or list of patterns (fnmatch) of the target runs that are normal. Other target runs are anomalous.
+    - content_formats, vectorizers: Options to combine.
+    - detectors: List of detector combinations. A combination is a detector name or a list of names
+      whose scores are combined with a z-score sum.
+    - workers: Threads that train and score detectors in parallel. Defaults to the number of CPUs.
+
+    Run level counts of each content format are summed from the shared (run, file) counts (see
+    get_run_file_counts) once and shared by all vectorizers and detectors. With set_feature_cache
+    they are also kept on disk for later invocations.
+    """
+    from sklearn.metrics import roc_auc_score
+    target_run_names = _check_multiple_target_runs(df, target_run)
+    patterns = [normal_runs] if isinstance(normal_runs, str) else list(normal_runs)
+    labels = np.array([0 if any(fnmatch.fnmatch(run, p) for p in patterns) else 1 for run in target_run_names])
+    # Target runs with the same training runs are scored together
+    groups = {}
+    for run in target_run_names:
+        _, comparison_run_names = _prepare_runs(df, run, comparison_runs)
+        groups.setdefault(tuple(comparison_run_names), []).append(run)
+    combinations = [[combination] if isinstance(combination, str) else list(combination) for combination in detectors]
+    print(f"Executing {inspect.currentframe().f_code.co_name} with {len(content_formats)} content formats, {len(vectorizers)} vectorizers and "
+          f"{len(combinations)} detector combinations on {len(target_run_names)} target runs ({int(labels.sum())} anomalous)")
+
+    results = []
+    for content_format in content_formats:
+        start = datetime.datetime.now()
+        df_content, field = _prepare_content(df, mask, content_format=content_format)
+        runs = sorted(set(target_run_names).union(*[set(comparison) for comparison in groups]))
+        run_files, cached = get_run_file_counts(df_content, runs, field, "items", mask, content_format)
+        # The detectors read only the test documents, the training runs are given as features
+        documents = run_files.run_documents(df_content, target_run_names)
+        row_of_target = {run: i for i, run in enumerate(documents.get_column("run").to_list())}
+        counts = run_files.run_counts(runs)
+        row_of_run = {run: i for i, run in enumerate(runs)}
+        features_seconds = (datetime.datetime.now() - start).total_seconds()
+        for vectorizer in vectorizers:
+            tasks = [(detector, comparison, targets) for detector in sorted({d for c in combinations for d in c})
+                     for comparison, targets in groups.items()]
+
+            def score(task):
+                detector, comparison, targets = task
+                task_start = datetime.datetime.now()
+                features = _train_test_features(counts, [[row_of_run[run]] for run in comparison], [[row_of_run[run]] for run in targets], vectorizer)
+                df_anos = _run_anomaly_detection(documents[[row_of_target[run] for run in targets]], pl.DataFrame({"run": list(comparison)}),
+                                                 field, detectors=[detector], vectorizer=vectorizer, features=features)
+                return df_anos.get_column(_detector_columns[detector]).to_numpy(), (datetime.datetime.now() - task_start).total_seconds()
+
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+                outputs = list(executor.map(score, tasks))
+            scores = {detector: np.zeros(len(target_run_names)) for detector, _, _ in tasks}
+            seconds = {detector: 0.0 for detector, _, _ in tasks}
+            for (detector, _, targets), (target_scores, elapsed) in zip(tasks, outputs):
+                for run, value in zip(targets, target_scores):
+                    scores[detector][target_run_names.index(run)] = value
+                seconds[detector] += elapsed
+            for combination in combinations:
+                combined = _combine_detector_scores([scores[d] for d in combination])
+                auc = roc_auc_score(labels, combined) if 0 < labels.sum() < len(labels) else None
+                results.append({
+                    "content_format": content_format, "vectorizer": vectorizer, "detectors": "+".join(combination),
+                    "auc_roc": auc, "features_seconds": features_seconds, "features_cached": cached,
+                    "detect_seconds": sum(seconds[d] for d in combination),
+                    "target_runs": len(target_run_names), "anomalous_runs": int(labels.sum()),
+                })
+        print(".", end="", flush=True)
+    print()
+    df_results = pl.DataFrame(results).sort("auc_roc", descending=True, nulls_last=True)
+    _write_output(df_results, analysis="ano_sweep", level=2, target_run="Many", comparison_run="Many", mask=mask, file_name_prefix=file_name_prefix)
+    return df_results
+
+def _combine_detector_scores(scores):
+    if len(scores) == 1:
+        return scores[0]
+    from scipy.stats import zscore
+    return np.nansum([np.nan_to_num(zscore(s)) for s in scores], axis=0)
+
+def _document_texts(documents, field):
+    """
+    Documents aggregated with _aggregate_dataframe as strings, joined as loglead LogDistance joins lines and tokens.
+    """
+    return documents.select(pl.col(field).list.join(" ")).to_series().to_list()
+
+def _document_matrix(documents, group_cols, field, analyzer, key_parts, texts=None):
+    """
+    Count matrix of documents aggregated with _aggregate_dataframe (field holds the lines or tokens of
+    each document). Shared with other steps through the feature cache (see set_feature_cache).
+
+    Parameters:
+    - documents: DataFrame with one row per document.
+    - group_cols: Columns that identify a document, e.g. ['run'] or ['run', 'file_name'].
+    - analyzer: 'items' counts the lines or tokens as they are (AnomalyDetector, plots), 'text' tokenizes
+      the joined document like the default sklearn CountVectorizer (LogDistance, Sklearn plots).
+    - key_parts: Settings that produced the documents, e.g. (level, mask, content_format).
+    - texts: Joined documents if already computed (see _document_texts).
+
+    Returns:
+    - Tuple (csr matrix with one row per row of documents, vocabulary, True if read from the cache).
+    """
+    items = documents.get_column(field).to_list() if analyzer == "items" else (texts or _document_texts(documents, field))
+    fingerprint = None
+    if feature_cache.enabled():
+        # Row hashes of Polars are stable within a version only
+        hashes = documents.select(*[pl.col(col).cast(pl.Utf8) for col in group_cols], pl.col(field).hash()).write_csv()
+        fingerprint = hashlib.sha256(f"{pl.__version__}|{hashes}".encode("utf-8")).hexdigest()
+    with profiling.stage("vectorize", rows_in=documents.height) as record:
+        matrix, vocabulary, cached = feature_cache.count_matrix(items, analyzer, key_parts, fingerprint)
+        record["rows_out"] = matrix.shape[0]
+    return matrix, vocabulary, cached
+
+def _sum_rows(counts, groups):
+    """
+    Matrix with one row per group of row indices holding the sum of the rows of the group.
+    """
+    from scipy import sparse
+    rows = [row for group in groups for row in group]
+    owner = [i for i, group in enumerate(groups) for _ in group]
+    indicator = sparse.csr_matrix((np.ones(len(rows)), (owner, rows)), shape=(len(groups), counts.shape[0]))
+    return (indicator @ counts).tocsr()
+
+def _merge_count_matrices(parts):
+    """
+    Stack count matrices with different vocabularies. Columns are remapped to the sorted union of the vocabularies.
+
+    Returns:
+    - Tuple (csr matrix, vocabulary).
+    """
+    from scipy import sparse
+    vocabulary = sorted(set().union(*[vocab for _, vocab in parts]))
+    terms = np.array(vocabulary, dtype=object)
+    merged = []
+    for matrix, vocab in parts:
+        columns = np.searchsorted(terms, np.array(vocab, dtype=object)).astype(np.int64) if vocab else np.zeros(0, dtype=np.int64)
+        merged.append(sparse.csr_matrix((matrix.data, columns[matrix.indices], matrix.indptr), shape=(matrix.shape[0], len(vocabulary))))
+    return sparse.vstack(merged, format="csr"), vocabulary
+
+class RunFileCounts:
+    """
+    Count matrix with one row per file of a run, shared by distance_run_content, distance_file_content,
+    anomaly_run and anomaly_file_content. The content is tokenized and counted once at (run, file) level.
+    Run level vectors are sums of the rows of a run, tf-idf weights are applied on top by the steps.
+    Rows of runs are added when a step first needs them (see add_runs). Get it with get_run_file_counts.
+
+    Only the sparse counts are kept. The content itself is aggregated again for the few documents
+    that need it (the compression distance and the test documents of the detectors), except the
+    joined texts of in-memory data, which are kept for the compression distance.
+
+    Attributes:
+    - counts: csr matrix, columns in sorted vocabulary order.
+    - vocabulary: Terms of the columns.
+    - keys: (run, file name) of each row.
+    - row_of: (run, file name) -> row.
+    - rows_by_run: Run -> rows of the run in file name order.
+    """
+
+    def __init__(self, field, analyzer, key_parts):
+        self.field = field
+        self.analyzer = analyzer
+        self.key_parts = key_parts
+        self.counts = None
+        self.vocabulary = []
+        self.keys = []
+        self.row_of = {}
+        self.rows_by_run = {}
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def add_runs(self, df, runs):
+        """
+        Count the files of the runs that have no rows yet. In out-of-core mode the runs are collected in
+        batches that fit the memory budget and the content of a batch is released before the next one.
+        With set_feature_cache each run is kept on disk separately, so a run is counted once even when it
+        is compared in different sets of runs.
+
+        Returns:
+        - True if no run had to be counted (all rows were present or read from the cache).
+        """
+        with self._lock:
+            missing = [run for run in dict.fromkeys(runs) if run not in self.rows_by_run]
+            if not missing:
+                return True
+            keep_texts = self.analyzer == "text" and not isinstance(df, pl.LazyFrame)
+            parts = [] if self.counts is None else [(self.counts, self.vocabulary)]
+            keys, cached = [], True
+            for batch in _run_batches(missing):
+                documents = self._aggregate(df, batch)
+                texts = _document_texts(documents, self.field) if self.analyzer == "text" else None
+                if feature_cache.enabled() and documents.height:
+                    start = 0
+                    for run_documents in documents.partition_by("run", maintain_order=True):
+                        run = run_documents.item(0, "run")
+                        run_texts = texts[start:start + run_documents.height] if texts is not None else None
+                        matrix, vocab, run_cached = _document_matrix(run_documents, ["run", "file_name"], self.field, self.analyzer,
+                                                                     ("run_file", *self.key_parts, run), texts=run_texts)
+                        parts.append((matrix, vocab))
+                        cached = cached and run_cached
+                        start += run_documents.height
+                else:
+                    matrix, vocab, batch_cached = _document_matrix(documents, ["run", "file_name"], self.field, self.analyzer,
+                                                                   ("run_file", *self.key_parts), texts=texts)
+                    parts.append((matrix, vocab))
+                    cached = cached and batch_cached
+                batch_keys = list(documents.select("run", "file_name").iter_rows())
+                if keep_texts:
+                    self._texts.update(zip(batch_keys, texts))
+                keys.extend(batch_keys)
+                # Only the counts of the batch are kept
+                del documents, texts
+            counts, vocabulary = _merge_count_matrices(parts) if len(parts) > 1 else parts[0]
+
+            for row, key in enumerate(keys, start=len(self.keys)):
+                self.row_of[key] = row
+                self.rows_by_run.setdefault(key[0], []).append(row)
+            for run in missing:
+                self.rows_by_run.setdefault(run, [])
+            # Rows only grow, so rows read by other steps stay valid
+            self.keys = self.keys + keys
+            self.counts, self.vocabulary = counts, vocabulary
+            return cached
+
+    def _aggregate(self, df, runs, group_by_col=("run", "file_name")):
+        """
+        Content of runs aggregated per group (see _aggregate_dataframe) with run and file_name as strings.
+        """
+        documents = _aggregate_dataframe(_collect(df.filter(pl.col("run").is_in(runs))), list(group_by_col), self.field)
+        return (documents.with_columns(*[pl.col(col).cast(pl.Utf8) for col in group_by_col])
+                .sort(*group_by_col))
+
+    def run_counts(self, runs):
+        """
+        Run level count matrix with one row per run.
+        """
+        return _sum_rows(self.counts, [self.rows_by_run[run] for run in runs])
+
+    def file_texts(self, df, run):
+        """
+        File name -> joined content of each file of a run (analyzer 'text').
+        """
+        if self._texts:
+            return {self.keys[row][1]: self._texts[self.keys[row]] for row in self.rows_by_run[run]}
+        documents = self._aggregate(df, [run])
+        return dict(zip(documents.get_column("file_name").to_list(), _document_texts(documents, self.field)))
+
+    def run_text(self, df, run):
+        """
+        Joined content of a run, its files in file name order.
+        """
+        return " ".join(text for text in self.file_texts(df, run).values() if text)
+
+    def file_documents(self, df, run):
+        """
+        One row per file of a run with file_name and its content, for the detectors.
+        """
+        return self._aggregate(df, [run]).select("file_name", self.field)
+
+    def run_documents(self, df, runs):
+        """
+        One row per run with the content of its files, in the order of runs, for the detectors.
+        """
+        documents = self._aggregate(df, runs, ("run",))
+        position = {run: i for i, run in enumerate(documents.get_column("run").to_list())}
+        return documents[[position[run] for run in runs if run in position]]
+
+    def file_groups(self, runs):
+        """
+        File name -> rows of the file in runs. The sum of the rows is the file over all runs.
+        """
+        groups = {}
+        for run in runs:
+            for row in self.rows_by_run[run]:
+                file_name = self.keys[row][1]
+                if file_name is not None:
+                    groups.setdefault(file_name, []).append(row)
+        return groups
+
+_run_file_counts = {}
+_run_file_counts_lock = threading.Lock()
+
+def get_run_file_counts(df, runs, field, analyzer, mask, content_format):
+    """
+    RunFileCounts of prepared content (see _prepare_content) with the rows of runs. One structure per
+    DataFrame, analyzer, mask and content format is kept until the DataFrame is released or
+    clear_prepared_content() is called, so the steps of an invocation count each file once.
+
+    Returns:
+    - Tuple (RunFileCounts, True if no run had to be counted).
+    """
+    key = (id(df), analyzer, mask, content_format)
+    with _run_file_counts_lock:
+        for stale in [k for k, entry in _run_file_counts.items() if entry[0]() is None]:
+            del _run_file_counts[stale]
+        entry = _run_file_counts.get(key)
+        if entry is None or entry[0]() is not df:
+            entry = (_reference(df), RunFileCounts(field, analyzer, (mask, content_format)))
+            _run_file_counts[key] = entry
+    counts = entry[1]
+    return counts, counts.add_runs(df, runs)
+
+def _train_test_features(counts, train_groups, test_groups, vectorizer="Count"):
+    """
+    Training and test features from a shared count matrix, as AnomalyDetector.prepare_train_test_data
+    creates them: each document is the sum of its rows, the vocabulary is the one of the training
+    documents and tf-idf weights are fitted on the training documents.
+
+    Returns:
+    - Tuple (X_train, X_test).
+    """
+    from sklearn.feature_extraction.text import TfidfTransformer
+    train = _sum_rows(counts, train_groups)
+    columns = np.flatnonzero(np.asarray(train.sum(axis=0)).ravel())
+    X_train = train[:, columns]
+    X_test = _sum_rows(counts, test_groups)[:, columns]
+    if vectorizer == "Tfidf":
+        tfidf = TfidfTransformer().fit(X_train)
+        X_train, X_test = tfidf.transform(X_train), tfidf.transform(X_test)
+    elif vectorizer != "Count":
+        raise ValueError(f"Unsupported vectorizer type: {vectorizer}")
+    return X_train, X_test
+
+class _PreparedFeatures:
+    """
+    Hands training and test features from a shared count matrix (see _train_test_features) to a
+    loglead AnomalyDetector in place of prepare_train_test_data, which would vectorize the item lists
+    again. It sets the attributes prepare_train_test_data sets for data without labels.
+
+    loglead versions other than the checked ones are probed once: prepare_train_test_data is run on a
+    two row frame and must not set attributes this adapter does not know about.
+    """
+    # Versions (major.minor) whose prepare_train_test_data was checked against the attributes below
+    checked_versions = ("1.2", "2.0")
+    attributes = ("X_train", "labels_train", "vectorizer", "X_test", "labels_test",
+                  "X_train_no_anos", "vectorizer_no_anos", "X_test_no_anos", "labels_test_no_anos",
+                  "encoder", "encoder_no_anos")
+    _compatible = None
+    _lock = threading.Lock()
+
+    def __init__(self, X_train, X_test):
+        self.X_train = X_train
+        self.X_test = X_test
+
+    def apply(self, sad):
+        self._check_loglead()
+        # Without labels the no-anos data is the same as the full data
+        values = {"X_train": self.X_train, "labels_train": [], "vectorizer": None,
+                  "X_test": self.X_test, "labels_test": [],
+                  "X_train_no_anos": self.X_train, "vectorizer_no_anos": None,
+                  "X_test_no_anos": self.X_test, "labels_test_no_anos": [],
+                  "encoder": None, "encoder_no_anos": None}
+        for name in self.attributes:
+            setattr(sad, name, values[name])
+
+    @classmethod
+    def _check_loglead(cls):
+        with cls._lock:
+            if cls._compatible is None:
+                from importlib.metadata import version
+                loglead_version = version("loglead")
+                cls._compatible = ".".join(loglead_version.split(".")[:2]) in cls.checked_versions or cls._probe()
+                if not cls._compatible:
+                    raise RuntimeError(f"loglead {loglead_version} prepares anomaly detection data differently than "
+                                       f"loglead {' or '.join(cls.checked_versions)}. Shared feature matrices cannot be used with it.")
+        if not cls._compatible:
+            raise RuntimeError("The installed loglead cannot be used with shared feature matrices.")
+
+    @classmethod
+    def _probe(cls):
+        import warnings
+        from loglead import AnomalyDetector
+        sad = AnomalyDetector(item_list_col="items", print_scores=False)
+        sad.train_df = sad.test_df = pl.DataFrame({"items": [["a", "b"], ["b"]]})
+        before = set(vars(sad))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            sad.prepare_train_test_data()
+        return not set(vars(sad)) - before - set(cls.attributes)
+
+def _content_distances(pair, text1, text2, vectorizer="Count"):
+    """
+    Cosine, Jaccard, compression and containment distance of two documents as loglead LogDistance
+    measures them, from their rows of a shared count matrix instead of a vectorizer fitted on the pair.
+
+    Parameters:
+    - pair: Two row count matrix ('text' analyzer, see _document_matrix).
+    - text1, text2: The joined documents, for the compression distance.
+
+    Returns:
+    - Tuple (cosine, jaccard, compression, containment). All None when the documents have no terms.
+    """
+    import bz2 as compressor
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.metrics.pairwise import cosine_similarity
+    # Vocabulary of the pair as when the vectorizer is fitted on the two documents
+    columns = np.flatnonzero(np.asarray(pair.sum(axis=0)).ravel())
+    if len(columns) == 0:
+        return None, None, None, None
+    pair = pair[:, columns]
+    if vectorizer == "Tfidf":
+        pair = TfidfTransformer().fit_transform(pair)
+    cosine = 1 - float(cosine_similarity(pair[0], pair[1])[0][0])
+    binary = (pair > 0).astype(int)
+    intersection = binary[0].multiply(binary[1]).sum()
+    jaccard = 1 - float(intersection / len(columns))
+    smaller = min(binary[0].sum(), binary[1].sum())
+    containment = 1 - float(intersection / smaller if smaller > 0 else 0)
+    len1 = len(compressor.compress(text1.encode()))
+    len2 = len(compressor.compress(text2.encode()))
+    combined_len = len(compressor.compress((text1 + text2).encode()))
+    compression = (combined_len - min(len1, len2)) / max(len1, len2)
+    return cosine, jaccard, compression, containment
+
 def _aggregate_dataframe(df: pl.DataFrame, group_by_col: str, field: str) -> pl.DataFrame:
     """
     Aggregate a Polars DataFrame based on the data type of the specified field.
@@ -1269,15 +2386,19 @@ def _aggregate_dataframe(df: pl.DataFrame, group_by_col: str, field: str) -> pl.
     -----------
     df : pl.DataFrame
         Input DataFrame to aggregate
-    group_by_col : str
-        Column name to group by (e.g., 'run', 'file_name')
+    group_by_col : str or list of str
+        Column name(s) to group by (e.g., 'run', 'file_name' or ['run', 'file_name'])
     field : str
         Field to aggregate; must be either a string column or a list of strings column
     """    
+    group_by_cols = [group_by_col] if isinstance(group_by_col, str) else list(group_by_col)
+    if field in group_by_cols:
+        # The content would be a second output column with the name of a group column
+        raise ValueError(f"Content field {field} cannot be one of the group by columns {group_by_col}")
     dtype = df.select(pl.col(field)).dtypes[0]
     if  dtype == pl.datatypes.List(pl.datatypes.Utf8): #We get list of str, e.g. words
         return (df
-                .select(group_by_col, field)
+                .select(*group_by_cols, field)
                 .explode(field)
                 .group_by(group_by_col)
                 .agg(pl.col(field)))
@@ -1288,7 +2409,7 @@ def _aggregate_dataframe(df: pl.DataFrame, group_by_col: str, field: str) -> pl.
     else: 
         raise ValueError(f"Error: Unsupported datatype {dtype} in field {field}. Supported types are: Utf8, List[Utf8]")
 
-def _run_anomaly_detection(df_run1_files,df_other_runs_files, field, detectors=["KMeans", "RarityModel"], vectorizer="Count"):
+def _run_anomaly_detection(df_run1_files,df_other_runs_files, field, detectors=["KMeans", "RarityModel"], vectorizer="Count", features=None):
     """
     Run anomaly detection using specified models.
     
@@ -1298,10 +2419,14 @@ def _run_anomaly_detection(df_run1_files,df_other_runs_files, field, detectors=[
     - field: Column name used by the AnomalyDetector as the item list column.
     - detectors: List of detector names to run (e.g., ["KMeans", "IsolationForest", "RarityModel"]).
                  If None, all detectors are run.
+    - features: Optional (X_train, X_test) in the row order of the DataFrames, see _train_test_features.
+                The vectorizer is then not fitted again.
                  
     Returns:
     - DataFrame containing the predictions from the specified anomaly detectors.
     """
+    from loglead import AnomalyDetector
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
     # Initialize the AnomalyDetector
     sad = AnomalyDetector(item_list_col=field, print_scores=False, auc_roc=True)
     
@@ -1309,38 +2434,46 @@ def _run_anomaly_detection(df_run1_files,df_other_runs_files, field, detectors=[
     sad.train_df = df_other_runs_files
     sad.test_df = df_run1_files
     
-    # Create the vectorizer (Count or Tfidf)
-
-    if vectorizer == "Count":
-        vectorizer_class = CountVectorizer
-    elif vectorizer == "Tfidf":
-        vectorizer_class = TfidfVectorizer
+    if features is not None:
+        # The matrices prepare_train_test_data would create
+        _PreparedFeatures(*features).apply(sad)
     else:
-        raise ValueError(f"Unsupported vectorizer type: {vectorizer}")
+        # Create the vectorizer (Count or Tfidf)
+
+        if vectorizer == "Count":
+            vectorizer_class = CountVectorizer
+        elif vectorizer == "Tfidf":
+            vectorizer_class = TfidfVectorizer
+        else:
+            raise ValueError(f"Unsupported vectorizer type: {vectorizer}")
 
-    # Prepare the data
-    sad.prepare_train_test_data(vectorizer_class=vectorizer_class)
+        # Prepare the data
+        with profiling.stage("vectorize", rows_in=df_other_runs_files.height + df_run1_files.height):
+            sad.prepare_train_test_data(vectorizer_class=vectorizer_class)
     
     # Initialize the output DataFrame
     df_anos = None
     
     # Run specified detectors or all if none are specified
     if detectors is None or "KMeans" in detectors:
-        sad.train_KMeans()
-        df_anos = sad.predict()
+        with profiling.stage("detector:KMeans", rows_in=df_run1_files.height):
+            sad.train_KMeans()
+            df_anos = sad.predict()
         df_anos = df_anos.rename({"pred_ano_proba": "kmeans_pred_ano_proba"})
     
     if detectors is None or "IsolationForest" in detectors:
-        sad.train_IsolationForest()
-        predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "IF_pred_ano_proba"})
+        with profiling.stage("detector:IsolationForest", rows_in=df_run1_files.height):
+            sad.train_IsolationForest()
+            predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "IF_pred_ano_proba"})
         if df_anos is not None:
             df_anos = df_anos.with_columns(predictions)
         else:
             df_anos = predictions
     
     if detectors is None or "RarityModel" in detectors:
-        sad.train_RarityModel()
-        predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "RM_pred_ano_proba"})
+        with profiling.stage("detector:RarityModel", rows_in=df_run1_files.height):
+            sad.train_RarityModel()
+            predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "RM_pred_ano_proba"})
         if df_anos is not None:
             df_anos = df_anos.with_columns(predictions)
         else:
@@ -1350,8 +2483,9 @@ def _run_anomaly_detection(df_run1_files,df_other_runs_files, field, detectors=[
         #sad.X_train=None
         #sad.labels_train = None
         #sad.train_OOVDetector(filter_anos=False) #This just creates the object. No training for OOVD needed
-        sad.train_OOVDetector() 
-        predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "OOVD_pred_ano_proba"})
+        with profiling.stage("detector:OOVDetector", rows_in=df_run1_files.height):
+            sad.train_OOVDetector() 
+            predictions = sad.predict().select("pred_ano_proba").rename({"pred_ano_proba": "OOVD_pred_ano_proba"})
         if df_anos is not None:
             df_anos = df_anos.with_columns(predictions)
         else:
@@ -1404,10 +2538,51 @@ def _write_output(df, analysis, level=0, target_run="", comparison_run="", file=
     
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     output_csv += f"_{timestamp}"
-    # Finalize the file name with the CSV extension
 
+    write_args = dict(analysis=analysis, level=level, target_run=target_run, comparison_run=comparison_run, file=file,
+                      mask=mask, content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
+    if output_writer is not None:
+        # The writer takes ownership of df. Callers do not modify frames or figures after writing them
+        output_writer.submit(_write_output_file, df, output_csv, **write_args)
+    else:
+        _write_output_file(df, output_csv, **write_args)
+
+def _write_output_file(df, output_csv, analysis, level, target_run, comparison_run, file, mask, content_format, vectorizer, file_name_prefix):
+    """
+    Write a Polars DataFrame or a Plotly figure to the output folder using output_csv (without extension) as the file name.
+    """
+    with profiling.stage(f"write_output:{analysis}", rows_in=df.height if isinstance(df, pl.DataFrame) else None):
+        _write_output_file_now(df, output_csv, analysis, level, target_run, comparison_run, file, mask, content_format, vectorizer, file_name_prefix)
+
+_recorded_outputs = None
+_recorded_outputs_lock = threading.Lock()
+
+def start_recording_outputs():
+    """
+    Start collecting the paths of written output files. See stop_recording_outputs.
+    """
+    global _recorded_outputs
+    with _recorded_outputs_lock:
+        _recorded_outputs = []
+
+def stop_recording_outputs():
+    """
+    Stop collecting output paths and return the paths written since start_recording_outputs.
+    Call flush_output first when the background writer is enabled.
+    """
+    global _recorded_outputs
+    with _recorded_outputs_lock:
+        paths, _recorded_outputs = _recorded_outputs or [], None
+    return paths
+
+def _record_output(path):
+    with _recorded_outputs_lock:
+        if _recorded_outputs is not None:
+            _recorded_outputs.append(path)
+
+def _write_output_file_now(df, output_csv, analysis, level, target_run, comparison_run, file, mask, content_format, vectorizer, file_name_prefix):
     global output_folder
-    output_directory = os.path.join(script_dir, output_folder)    
+    output_directory = output_folder
     # Ensure the directory exists; if not, create it
     os.makedirs(output_directory, exist_ok=True)
     # Construct the full path for the CSV file
@@ -1417,10 +2592,14 @@ def _write_output(df, analysis, level=0, target_run="", comparison_run="", file=
         if table_output == "xlsx":
             output_path += ".xlsx"
             df.write_excel(output_path)
+            _record_output(output_path)
+        elif table_output == "parquet":
+            _write_parquet_dataset(df, output_csv, analysis=analysis, level=level, target_run=target_run, comparison_run=comparison_run, file=file,
+                                   mask=mask, content_format=content_format, vectorizer=vectorizer, file_name_prefix=file_name_prefix)
         else:
             output_path += ".csv"
             if table_output != "csv":
-                print (f"Unknown table_output:{table_output}. Valid options are: xlsx and csv. Defaulting to csv")
+                print (f"Unknown table_output:{table_output}. Valid options are: xlsx, csv and parquet. Defaulting to csv")
             #Identify columns that are not nested. CSV writer cannot handel them
             non_nested_columns = [
                 col for col, dtype in zip(df.columns, df.dtypes)
@@ -1428,9 +2607,147 @@ def _write_output(df, analysis, level=0, target_run="", comparison_run="", file=
             ]
             # Step 2: Select non-nested columns and write to CSV
             df.select(non_nested_columns).write_csv(output_path, separator='\t')
+            _record_output(output_path)
         
     else:
         output_path += ".html"
-        df.write_html(output_path)
+        # 'directory' writes plotly.min.js next to the HTML files only if it does not exist yet
+        include_plotlyjs = {"directory": "directory", "cdn": "cdn"}.get(html_output, True)
+        df.write_html(output_path, include_plotlyjs=include_plotlyjs)
+        _record_output(output_path)
+        if html_figure_json:
+            with gzip.open(output_path[:-len(".html")] + ".json.gz", "wt", encoding="utf-8") as f:
+                f.write(df.to_json())
     #print(f"Results saved to {output_path}")
-    
\ No newline at end of file
+
+_manifest_lock = threading.Lock()
+
+def _partition_value(value):
+    """
+    Make a value usable as a directory name in a Hive style partition path (key=value). The value is
+    percent-encoded so that reading with hive_partitioning restores it unchanged.
+    """
+    value = str(value) if value not in (None, "") else "none"
+    return urllib.parse.quote(value, safe="")
+
+def _write_parquet_dataset(df, output_name, analysis, level, target_run, comparison_run, file, mask, content_format, vectorizer, file_name_prefix):
+    """
+    Write a result DataFrame into the partitioned Parquet dataset of the output folder.
+
+    All steps write into <output_folder>/results, partitioned Hive style by analysis, level, target_run
+    and file_name. Nested columns are kept. When the DataFrame has its own 'target_run' or 'file_name'
+    columns (e.g. results of many target runs) the rows are partitioned by those values. Both columns are
+    stored in the path only, reading with hive_partitioning restores them. Each written part is appended
+    to <output_folder>/results/manifest.jsonl.
+    """
+    dataset_folder = os.path.join(output_folder, "results")
+    # The manifest is written even when there are no rows and so no partitions
+    os.makedirs(dataset_folder, exist_ok=True)
+    partition_columns = [col for col in ("target_run", "file_name") if col in df.columns]
+    if partition_columns:
+        parts = df.partition_by(partition_columns, as_dict=True, include_key=True)
+    else:
+        parts = {(): df}
+
+    manifest_entries = []
+    for key, part in parts.items():
+        values = dict(zip(partition_columns, key))
+        part_target_run = values.get("target_run", target_run)
+        part_file = values.get("file_name", file)
+        # Partition columns are stored in the path only. Reading with hive_partitioning restores them
+        part = part.drop(partition_columns)
+        partition_path = os.path.join(
+            dataset_folder,
+            f"analysis={_partition_value(file_name_prefix + '_' + analysis if file_name_prefix else analysis)}",
+            f"level={level}",
+            f"target_run={_partition_value(part_target_run)}",
+            f"file_name={_partition_value(part_file)}",
+        )
+        os.makedirs(partition_path, exist_ok=True)
+        part_path = os.path.join(partition_path, output_name + ".parquet")
+        part.write_parquet(part_path)
+        _record_output(part_path)
+        manifest_entries.append({
+            "path": os.path.relpath(part_path, dataset_folder),
+            "analysis": analysis,
+            "level": level,
+            "target_run": part_target_run,
+            "comparison_run": comparison_run,
+            "file": part_file,
+            "mask": mask,
+            "content_format": content_format,
+            "vectorizer": vectorizer,
+            "file_name_prefix": file_name_prefix,
+            "rows": part.height,
+            "columns": part.columns,
+            "written": datetime.datetime.now().isoformat(timespec="seconds"),
+        })
+
+    with _manifest_lock:
+        with open(os.path.join(dataset_folder, "manifest.jsonl"), "a", encoding="utf-8") as f:
+            for entry in manifest_entries:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+class _BackgroundWriter:
+    """
+    Writes outputs on a thread pool while the analysis continues.
+
+    At most max_queue writes are pending. submit() blocks when the queue is full so memory held by
+    not yet written frames and figures stays bounded. flush() waits until all pending writes are done
+    and re-raises the first error of a failed write.
+    """
+    def __init__(self, workers=2, max_queue=8):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="logdelta_writer")
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, func, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(profiling.bind_context(func), *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.pending.append(future)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        errors = [future.exception() for future in pending]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            if len(errors) > 1:
+                print(f"{len(errors)} output writes failed. Raising the first error")
+            raise errors[0]
+
+    def shutdown(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+def set_background_writer(workers=2, max_queue=8):
+    """
+    Write outputs in the background while computation continues.
+
+    Parameters:
+        workers (int): Number of writer threads. 0 writes synchronously (default behaviour).
+        max_queue (int): Maximum number of pending writes before the analysis waits for the writer.
+    """
+    global output_writer
+    if output_writer is not None:
+        output_writer.shutdown()
+        output_writer = None
+    if workers and workers > 0:
+        output_writer = _BackgroundWriter(workers=workers, max_queue=max_queue)
+    print(f"Background writer: {'disabled' if output_writer is None else f'{workers} workers, queue of {max_queue}'}")
+
+def flush_output():
+    """
+    Barrier that waits until all outputs have been written. Errors of failed writes are raised here.
+    """
+    if output_writer is not None:
+        output_writer.flush()
@@ -0,0 +1,191 @@
+# Stage level profiling: wall time, process CPU time, rows in/out and peak RSS per stage, step and config item.
+# Stages can be nested (e.g. "step" around the stages of a step). Besides the total time of a stage its
+# self time, without the nested stages of the same thread, is recorded so that totals add up.
+import os
+import time
+import json
+import datetime
+import threading
+import functools
+from contextlib import contextmanager
+
+import polars as pl
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+profiling_enabled = False
+_records = []
+_records_lock = threading.Lock()
+_context = threading.local()
+
+def enable_profiling(enabled=True):
+    """
+    Enable or disable recording of stage timings. Disabled by default.
+    """
+    global profiling_enabled
+    profiling_enabled = enabled
+
+def reset_profile():
+    """
+    Drop all recorded stages.
+    """
+    with _records_lock:
+        _records.clear()
+
+def set_context(step=None, config_item=None):
+    """
+    Set the step and config item that stages recorded by the calling thread belong to.
+    """
+    _context.step = step
+    _context.config_item = config_item
+
+def get_context():
+    return getattr(_context, "step", None), getattr(_context, "config_item", None)
+
+def bind_context(func):
+    """
+    Wrap func so that it records stages with the context of the calling thread, e.g. when
+    the function is executed later on a worker thread.
+    """
+    step, config_item = get_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = get_context()
+        set_context(step, config_item)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            set_context(*previous)
+    return wrapper
+
+def _peak_rss_mb():
+    """
+    Peak resident set size of the process in MB or None if it cannot be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Record one stage. Use as a context manager. The yielded dictionary can be used to set
+    'rows_out' (and 'rows_in' if it is known only later).
+
+        with profiling.stage("mask", rows_in=df.height) as record:
+            df = ...
+            record["rows_out"] = df.height
+
+    When profiling is disabled nothing is recorded.
+
+    process_cpu_s is the CPU time of the whole process during the stage. It includes the Polars and
+    other native worker threads of the stage, but also stages that run at the same time on other
+    threads (scheduler workers). process_peak_rss_mb is the peak RSS of the process so far and
+    peak_rss_growth_mb how much the stage raised it.
+    """
+    record = {"rows_in": rows_in, "rows_out": None}
+    if not profiling_enabled:
+        yield record
+        return
+    step, config_item = get_context()
+    start = datetime.datetime.now()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    peak_rss_start = _peak_rss_mb()
+    # Time of nested stages of this thread, subtracted for the self time
+    nested = {"wall_s": 0.0, "process_cpu_s": 0.0}
+    if not hasattr(_context, "stages"):
+        _context.stages = []
+    stack = _context.stages
+    stack.append(nested)
+    try:
+        yield record
+    finally:
+        stack.pop()
+        wall_s = time.perf_counter() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        peak_rss = _peak_rss_mb()
+        if stack:
+            stack[-1]["wall_s"] += wall_s
+            stack[-1]["process_cpu_s"] += cpu_s
+        record.update({
+            "stage": name,
+            "step": step,
+            "config_item": config_item,
+            "thread": threading.current_thread().name,
+            "start": start.isoformat(timespec="milliseconds"),
+            "wall_s": wall_s,
+            "process_cpu_s": cpu_s,
+            "self_wall_s": wall_s - nested["wall_s"],
+            "self_process_cpu_s": cpu_s - nested["process_cpu_s"],
+            "process_peak_rss_mb": peak_rss,
+            "peak_rss_growth_mb": peak_rss - peak_rss_start if peak_rss is not None else None,
+        })
+        with _records_lock:
+            _records.append(record)
+
+def get_profile():
+    """
+    Recorded stages as a Polars DataFrame.
+    """
+    columns = ["stage", "step", "config_item", "thread", "start", "wall_s", "process_cpu_s", "self_wall_s",
+               "self_process_cpu_s", "rows_in", "rows_out", "process_peak_rss_mb", "peak_rss_growth_mb"]
+    with _records_lock:
+        records = [{col: record.get(col) for col in columns} for record in _records]
+    if not records:
+        return pl.DataFrame(schema={col: pl.Utf8 for col in columns})
+    return pl.DataFrame(records, infer_schema_length=None)
+
+def write_profile(folder, profile_format="json"):
+    """
+    Write recorded stages to folder as profile_<timestamp>.json or .parquet.
+
+    Returns:
+    - Path of the written file.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    os.makedirs(folder, exist_ok=True)
+    df = get_profile()
+    if profile_format == "parquet":
+        path = os.path.join(folder, f"profile_{timestamp}.parquet")
+        df.write_parquet(path)
+    else:
+        path = os.path.join(folder, f"profile_{timestamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(df.to_dicts(), f, indent=1, default=str)
+    print(f"Profile written to: {path}")
+    return path
+
+def summary():
+    """
+    Totals per stage: calls, wall and process CPU time, rows, the highest process peak RSS seen and the
+    largest growth of it by one call. wall_s and process_cpu_s include nested stages (a "step" includes
+    all stages of the step), the self_ columns do not and add up over the stages without counting
+    time twice. With concurrent steps the process CPU time of overlapping stages is counted in each.
+    """
+    df = get_profile()
+    if df.height == 0:
+        return df
+    return (df
+            .group_by("stage")
+            .agg(
+                pl.len().alias("calls"),
+                pl.col("wall_s").sum().alias("wall_s"),
+                pl.col("process_cpu_s").sum().alias("process_cpu_s"),
+                pl.col("self_wall_s").sum().alias("self_wall_s"),
+                pl.col("self_process_cpu_s").sum().alias("self_process_cpu_s"),
+                pl.col("rows_in").sum().alias("rows_in"),
+                pl.col("rows_out").sum().alias("rows_out"),
+                pl.col("process_peak_rss_mb").max().alias("process_peak_rss_mb"),
+                pl.col("peak_rss_growth_mb").max().alias("peak_rss_growth_mb"))
+            .sort("self_wall_s", descending=True))
+
+def print_summary():
+    with pl.Config(tbl_rows=100, tbl_cols=13, fmt_str_lengths=40):
+        print(summary())
@@ -0,0 +1,102 @@
+# Per-run Parquet store for out-of-core execution. Each run is ingested, masked, parsed and
+# preprocessed on its own and written to <store_folder>/<run>.parquet, so loading never holds
+# more than one run in memory. Steps then work on a LazyFrame over the store.
+import os
+import json
+
+import polars as pl
+
+import logdelta.profiling as profiling
+from logdelta.log_analysis_functions import read_run, list_runs, run_paths
+
+manifest_name = "store.json"
+
+def _run_signature(paths):
+    """
+    Number of files, total size and latest modification time of the files of a run (its folder or
+    the archives that contain it, see run_paths). A run is ingested again when its signature changes.
+    """
+    files = []
+    for path in paths:
+        files.extend([path] if os.path.isfile(path) else [os.path.join(root, f) for root, _, names in os.walk(path) for f in names])
+    count, size, latest = 0, 0, 0.0
+    for f in files:
+        stat = os.stat(f)
+        count += 1
+        size += stat.st_size
+        latest = max(latest, stat.st_mtime)
+    return [count, size, latest]
+
+def _run_path(store_folder, run):
+    return os.path.join(store_folder, f"{run}.parquet")
+
+def load_manifest(store_folder):
+    path = os.path.join(store_folder, manifest_name)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"dataset_key": None, "runs": {}}
+
+def update_run_store(input_data_folder, store_folder, dataset_key, prepare, filename_pattern="*.log", runs=None):
+    """
+    Bring the store up to date with the runs of input_data_folder.
+
+    Parameters:
+    - input_data_folder: Folder with one sub folder per run (or archives with the run folders, see list_runs).
+    - store_folder: Folder of the store.
+    - dataset_key: Settings the stored data depends on (see config_runner.dataset_key). The store is
+      rebuilt when they change.
+    - prepare: Function applied to the DataFrame of each run before it is stored (masking, parsing, preprocessing).
+    - runs: Store only these runs (list of names). None stores all runs.
+
+    Returns:
+    - The store manifest with rows and estimated in-memory bytes of each run.
+    """
+    os.makedirs(store_folder, exist_ok=True)
+    manifest = load_manifest(store_folder)
+    if manifest["dataset_key"] != dataset_key:
+        for run in manifest["runs"]:
+            if os.path.exists(_run_path(store_folder, run)):
+                os.remove(_run_path(store_folder, run))
+        manifest = {"dataset_key": dataset_key, "runs": {}}
+
+    selected = set(runs) if runs is not None else None
+    runs = [run for run in list_runs(input_data_folder) if selected is None or run in selected]
+    for run in [run for run in manifest["runs"] if run not in runs]:
+        print(f"Run store: removing run {run}")
+        if os.path.exists(_run_path(store_folder, run)):
+            os.remove(_run_path(store_folder, run))
+        del manifest["runs"][run]
+
+    ingested = 0
+    for run in runs:
+        signature = _run_signature(run_paths(input_data_folder, run))
+        entry = manifest["runs"].get(run)
+        if entry is not None and entry["signature"] == signature and os.path.exists(_run_path(store_folder, run)):
+            continue
+        with profiling.stage("store_run") as record:
+            df = prepare(read_run(input_data_folder, run, filename_pattern))
+            record["rows_in"] = df.height
+            # Plain strings: categories of Enum columns differ between runs
+            df = df.with_columns(pl.col("run").cast(pl.Utf8), pl.col("file_name").cast(pl.Utf8))
+            df.write_parquet(_run_path(store_folder, run), statistics=True)
+            record["rows_out"] = df.height
+        manifest["runs"][run] = {"signature": signature, "rows": df.height, "bytes": df.estimated_size()}
+        ingested += 1
+        del df
+        # Written after every run so that an interrupted ingestion resumes where it stopped
+        with open(os.path.join(store_folder, manifest_name), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+    print(f"Run store {store_folder}: {len(runs)} runs, {ingested} ingested")
+    return manifest
+
+def scan_run_store(store_folder, manifest=None):
+    """
+    LazyFrame over all runs of the store. Each run file holds a single run, so Parquet statistics
+    let filters on 'run' skip the files of other runs.
+    """
+    manifest = manifest or load_manifest(store_folder)
+    scans = [pl.scan_parquet(_run_path(store_folder, run)) for run in sorted(manifest["runs"])]
+    if not scans:
+        raise ValueError(f"Run store {store_folder} contains no runs")
+    return pl.concat(scans, how="diagonal_relaxed")
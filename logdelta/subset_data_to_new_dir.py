@@ -1,54 +1,171 @@
 import os
+import sys
+import errno
 import shutil
 import random
-from dotenv import load_dotenv, find_dotenv
-load_dotenv(find_dotenv())
-full_data = os.getenv("LOG_DATA_PATH")
-if not full_data:
-    print("WARNING!: LOG_DATA_PATH is not set. This will most likely fail")
-# Ensure this always gets executed in the same location
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
+from concurrent.futures import ThreadPoolExecutor
 
-def copy_portion_of_folders(source_folder, destination_folder, portion=0.5):
+link_modes = ("copy", "hardlink", "symlink", "reflink")
+# Default of the functions and the command line: no data is copied where links are possible
+default_link_mode = "hardlink"
+
+# ioctl request of Linux FICLONE (copy-on-write clone on btrfs, XFS and similar file systems)
+_FICLONE = 0x40049409
+
+def run_group_label(run, group_by_indices):
+    """
+    Group of a run as in group_by_indices of the plot steps: the parts of the run name (split at '_')
+    at the given indices joined with '_'. Parts that do not exist are empty.
+    """
+    parts = run.split("_")
+    return "_".join(parts[i] if -len(parts) <= i < len(parts) else "" for i in group_by_indices)
+
+def select_runs(source_folder, portion=0.5, seed=None, group_by_indices=None):
+    """
+    Select a random portion of the run folders of source_folder.
+
+    Parameters:
+    - source_folder (str): Folder with one sub folder per run.
+    - portion (float): A fraction (0 < portion <= 1) of the runs to select.
+    - seed (int): Seed for a reproducible selection. None selects differently on every call.
+    - group_by_indices (list of int): Stratify by run name groups (see run_group_label). The portion is
+      taken from each group separately and every group keeps at least one run.
+
+    Returns:
+    - Sorted list of selected run names.
+    """
+    all_folders = sorted(f for f in os.listdir(source_folder) if os.path.isdir(os.path.join(source_folder, f)))
+    rng = random.Random(seed)
+    if not group_by_indices:
+        return sorted(rng.sample(all_folders, int(len(all_folders) * portion)))
+    groups = {}
+    for run in all_folders:
+        groups.setdefault(run_group_label(run, group_by_indices), []).append(run)
+    selected = []
+    for label in sorted(groups):
+        runs = groups[label]
+        selected.extend(rng.sample(runs, max(1, round(len(runs) * portion))))
+    return sorted(selected)
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+
+def link_or_copy_file(src, dst, mode=default_link_mode):
+    """
+    Place src at dst without copying data if the mode allows it. Falls back to a copy when the link
+    cannot be made (e.g. hardlink across file systems or reflink on a file system without support).
+
+    Returns:
+    - The mode that was used.
+    """
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return mode
+        if mode == "symlink":
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+        if mode == "reflink":
+            _reflink(src, dst)
+            return mode
+    except (OSError, ImportError) as e:
+        if isinstance(e, OSError) and e.errno == errno.EEXIST:
+            raise
+        if os.path.lexists(dst):
+            os.remove(dst)
+    shutil.copy2(src, dst)
+    return "copy"
+
+def copy_runs(source_folder, destination_folder, runs, mode=default_link_mode, workers=8):
+    """
+    Place the files of runs from source_folder in destination_folder. Folders are created, files are
+    linked (mode hardlink, symlink or reflink) or copied (mode copy) in parallel.
+
+    Returns:
+    - Dictionary mode -> number of files placed with it.
+    """
+    if mode not in link_modes:
+        raise ValueError(f"Unknown mode: {mode}. Valid options are: {', '.join(link_modes)}")
+    tasks = []
+    for run in runs:
+        src_run = os.path.join(source_folder, run)
+        for root, _, files in os.walk(src_run):
+            dst_root = os.path.join(destination_folder, os.path.relpath(root, source_folder))
+            os.makedirs(dst_root, exist_ok=True)
+            tasks.extend((os.path.join(root, f), os.path.join(dst_root, f)) for f in files)
+    used = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for used_mode in executor.map(lambda task: link_or_copy_file(task[0], task[1], mode), tasks):
+            used[used_mode] = used.get(used_mode, 0) + 1
+    return used
+
+def write_run_list(path, runs):
+    """
+    Write runs one per line. read_folders(..., runs=path) and the run_list config key load only these runs.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{run}\n" for run in runs))
+
+def copy_portion_of_folders(source_folder, destination_folder=None, portion=0.5, mode=default_link_mode, seed=None,
+                            group_by_indices=None, workers=8, run_list=None):
     """
     Copy a certain portion of top-level folders from the source folder to the destination folder.
 
     Parameters:
     - source_folder (str): Path to the source directory containing folders to copy.
     - destination_folder (str): Path to the destination directory where folders will be copied.
+      None only selects the runs (use with run_list).
     - portion (float): A fraction (0 < portion <= 1) representing the portion of folders to copy.
+    - mode (str): copy, hardlink (default), symlink or reflink. Links fall back to copies where they are not possible.
+    - seed (int): Seed for a reproducible selection.
+    - group_by_indices (list of int): Stratify the selection by run name groups.
+    - workers (int): Number of parallel copy threads.
+    - run_list (str): Also write the selected runs to this file.
+
+    Returns:
+    - List of selected runs.
     """
     # Check if the source directory exists
     if not os.path.exists(source_folder):
         print(f"Source folder '{source_folder}' does not exist.")
-        return
-
-    # Ensure the destination directory exists
-    os.makedirs(destination_folder, exist_ok=True)
-
-    # List all top-level folders in the source directory
-    all_folders = [f for f in os.listdir(source_folder) if os.path.isdir(os.path.join(source_folder, f))]
-
-    # Calculate the number of folders to copy based on the portion
-    number_of_folders_to_copy = int(len(all_folders) * portion)
+        return []
 
-    # Select a random subset of folders to copy
-    folders_to_copy = random.sample(all_folders, number_of_folders_to_copy)
+    runs = select_runs(source_folder, portion, seed, group_by_indices)
+    if run_list:
+        write_run_list(run_list, runs)
+        print(f"Wrote {len(runs)} runs to '{run_list}'")
+    if destination_folder:
+        os.makedirs(destination_folder, exist_ok=True)
+        used = copy_runs(source_folder, destination_folder, runs, mode, workers)
+        print(f"Finished placing {len(runs)} folders in '{destination_folder}': {used}")
+    return runs
 
-    # Copy each selected folder to the destination directory
-    for folder_name in folders_to_copy:
-        src_path = os.path.join(source_folder, folder_name)
-        dst_path = os.path.join(destination_folder, folder_name)
-        shutil.copytree(src_path, dst_path)
-        print(f"Copied '{src_path}' to '{dst_path}'")
 
-    print(f"Finished copying {number_of_folders_to_copy} folders to '{destination_folder}'.")
+if __name__ == "__main__":
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
 
-source_folder = os.path.join(full_data, "comp_ws", 
-                    "all_data")
-destination_folder = os.path.join(full_data, "comp_ws", 
-                    "all_data_10_percent")
-portion_to_copy = 0.1  # Change this to the portion of folders you want to copy
+    import argparse
+    parser = argparse.ArgumentParser(description="Select a portion of the run folders, e.g. for a development set.")
+    parser.add_argument("-s", "--source", default=os.getenv("LOG_DATA_PATH"),
+                        help="Folder with one sub folder per run (default: LOG_DATA_PATH)")
+    parser.add_argument("-d", "--destination", help="Folder to place the selected runs in")
+    parser.add_argument("-p", "--portion", type=float, default=0.1, help="Portion of runs to select (default: 0.1)")
+    parser.add_argument("-m", "--mode", choices=link_modes, default=default_link_mode,
+                        help="How files are placed in the destination (default: hardlink, copies where linking fails)")
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible selection")
+    parser.add_argument("-g", "--group-by-indices", type=int, nargs="+",
+                        help="Stratify by the run name parts at these indices, as group_by_indices in the plot steps")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Parallel copy threads (default: 8)")
+    parser.add_argument("-r", "--run-list", help="Write the selected runs to this file. Set it as run_list in the config to load only these runs")
+    args = parser.parse_args()
 
-copy_portion_of_folders(source_folder, destination_folder, portion_to_copy)
\ No newline at end of file
+    if not args.source:
+        parser.error("--source is required when LOG_DATA_PATH is not set")
+    if not args.destination and not args.run_list:
+        parser.error("Give --destination and/or --run-list")
+    runs = copy_portion_of_folders(args.source, args.destination, args.portion, args.mode, args.seed,
+                                   args.group_by_indices, args.workers, args.run_list)
+    sys.exit(0 if runs else 1)
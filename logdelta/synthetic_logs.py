@@ -0,0 +1,145 @@
+# Deterministic synthetic log corpus shaped like the Hadoop data used in demo/config.yml
+import os
+import csv
+import json
+import random
+import datetime
+
+# Words used to build log templates. Templates look like Hadoop log messages:
+# "<component>: <words> <variable> <words> ..."
+_components = [
+    "org.apache.hadoop.mapreduce.v2.app.MRAppMaster", "org.apache.hadoop.mapred.Task",
+    "org.apache.hadoop.mapreduce.v2.app.rm.RMContainerAllocator", "org.apache.hadoop.hdfs.DFSClient",
+    "org.apache.hadoop.mapred.MapTask", "org.apache.hadoop.ipc.Client", "org.apache.hadoop.yarn.event.AsyncDispatcher",
+    "org.apache.hadoop.mapreduce.task.reduce.Fetcher", "org.apache.hadoop.metrics2.impl.MetricsSystemImpl",
+]
+_words = [
+    "task", "attempt", "container", "allocated", "finished", "started", "reading", "writing", "block",
+    "from", "to", "for", "with", "size", "bytes", "records", "map", "reduce", "output", "input", "spill",
+    "merge", "segment", "job", "node", "heartbeat", "scheduled", "completed", "buffer", "progress",
+    "committed", "assigned", "resource", "memory", "vcores", "event", "state", "transitioned", "queue",
+]
+_variables = ["<NUM>", "<IP>", "<HEX>", "<PATH>", "<DURATION>"]
+_levels = ["INFO", "INFO", "INFO", "INFO", "WARN", "DEBUG"]
+_anomaly_messages = [
+    "ERROR org.apache.hadoop.hdfs.DFSClient: Failed to connect to /<IP>:<NUM> for block, add to deadNodes and continue",
+    "WARN org.apache.hadoop.ipc.Client: Address change detected. Old: <IP> New: <IP> retrying <NUM> times",
+    "ERROR org.apache.hadoop.mapred.Task: Could not delete hdfs:<PATH> disk quota exceeded <NUM> bytes",
+    "FATAL org.apache.hadoop.mapred.YarnChild: Error running child : java.io.IOException: No space left on device",
+    "WARN org.apache.hadoop.mapreduce.v2.app.rm.RMContainerAllocator: Going to preempt <NUM> due to lack of space for maps",
+]
+
+def _make_templates(rng, count):
+    """
+    Create count distinct message templates with variable slots.
+    """
+    templates = []
+    seen = set()
+    while len(templates) < count:
+        words = rng.sample(_words, rng.randint(3, 8))
+        for _ in range(rng.randint(1, 3)):
+            words.insert(rng.randint(0, len(words)), rng.choice(_variables))
+        template = f"{rng.choice(_levels)} [{rng.choice(['main', 'IPC Server handler', 'fetcher', 'eventHandlingThread'])}] {rng.choice(_components)}: {' '.join(words)}"
+        if template not in seen:
+            seen.add(template)
+            templates.append(template)
+    return templates
+
+def _fill(template, rng):
+    """
+    Replace the variable slots of a template with random values.
+    """
+    out = []
+    for token in template.split(" "):
+        if "<NUM>" in token:
+            token = token.replace("<NUM>", str(rng.randint(0, 100000)))
+        if "<IP>" in token:
+            token = token.replace("<IP>", f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}")
+        if "<HEX>" in token:
+            token = token.replace("<HEX>", f"{rng.getrandbits(48):012x}")
+        if "<PATH>" in token:
+            token = token.replace("<PATH>", f"//msra-sa-41:9000/tmp/hadoop-yarn/staging/job_{rng.randint(1, 99):04d}/part-{rng.randint(0, 999):05d}")
+        if "<DURATION>" in token:
+            token = token.replace("<DURATION>", f"{rng.randint(1, 5000)}ms")
+        out.append(token)
+    return " ".join(out)
+
+def generate_corpus(output_folder, runs=20, files_per_run=5, lines_per_file=1000, templates=50,
+                    anomalous_runs=2, anomaly_rate=0.02, seed=42):
+    """
+    Generate a deterministic synthetic log corpus with the Hadoop layout of demo/config.yml.
+
+    Each run is a folder application_<cluster>_<nnnn> containing container_<cluster>_<nnnn>_01_<kkkkkk>.log
+    files, so the remove_run_name_from_file_names preprocessing gives matching file names
+    (container__01_000001.log, ...) across runs. Anomalous runs get error templates injected at
+    anomaly_rate and a shifted template distribution. The same parameters always give the same corpus.
+
+    Parameters:
+    - output_folder: Folder to write the run folders to. Created if it does not exist.
+    - runs: Number of runs (folders).
+    - files_per_run: Number of container log files per run.
+    - lines_per_file: Number of lines per file.
+    - templates: Number of distinct normal message templates (template diversity).
+    - anomalous_runs: Number of runs with injected anomalies.
+    - anomaly_rate: Share of lines replaced with anomalous messages in anomalous runs.
+    - seed: Random seed.
+
+    Returns:
+    - List of (run, label) where label is 'Normal' or 'Anomaly'. Also written to labels.csv in output_folder.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_folder, exist_ok=True)
+    normal_templates = _make_templates(rng, templates)
+    # Zipf like template frequencies, as in real logs a few templates dominate
+    weights = [1.0 / (rank + 1) for rank in range(len(normal_templates))]
+    anomalous = set(rng.sample(range(runs), min(anomalous_runs, runs)))
+    start_time = datetime.datetime(2015, 10, 17, 15, 37, 56)
+
+    labels = []
+    for run_idx in range(runs):
+        cluster = 1445062781478 + (run_idx // 25) * 7654321
+        run_id = f"{cluster}_{run_idx % 25 + 1:04d}"
+        run_name = f"application_{run_id}"
+        is_anomalous = run_idx in anomalous
+        labels.append((run_name, "Anomaly" if is_anomalous else "Normal"))
+        run_folder = os.path.join(output_folder, run_name)
+        os.makedirs(run_folder, exist_ok=True)
+        run_weights = list(reversed(weights)) if is_anomalous and rng.random() < 0.5 else weights
+        for file_idx in range(files_per_run):
+            file_path = os.path.join(run_folder, f"container_{run_id}_01_{file_idx + 1:06d}.log")
+            timestamp = start_time + datetime.timedelta(minutes=run_idx * 30 + file_idx)
+            chosen = rng.choices(normal_templates, weights=run_weights, k=lines_per_file)
+            with open(file_path, "w", encoding="utf-8") as f:
+                for template in chosen:
+                    timestamp += datetime.timedelta(milliseconds=rng.randint(0, 2000))
+                    if is_anomalous and rng.random() < anomaly_rate:
+                        message = _fill(rng.choice(_anomaly_messages), rng)
+                    else:
+                        message = _fill(template, rng)
+                    f.write(f"{timestamp.strftime('%Y-%m-%d %H:%M:%S')},{timestamp.microsecond // 1000:03d} {message}\n")
+
+    with open(os.path.join(output_folder, "labels.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["run", "label"])
+        writer.writerows(labels)
+    with open(os.path.join(output_folder, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump({"runs": runs, "files_per_run": files_per_run, "lines_per_file": lines_per_file, "templates": templates,
+                   "anomalous_runs": anomalous_runs, "anomaly_rate": anomaly_rate, "seed": seed}, f, indent=1)
+    print(f"Generated {runs} runs with {files_per_run} files of {lines_per_file} lines to {output_folder}")
+    return labels
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic Hadoop-like log corpus")
+    parser.add_argument("-o", "--output", default="Synthetic", help="Output folder (default: Synthetic)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--files", type=int, default=5, help="Files per run")
+    parser.add_argument("--lines", type=int, default=1000, help="Lines per file")
+    parser.add_argument("--templates", type=int, default=50, help="Number of distinct templates")
+    parser.add_argument("--anomalous-runs", type=int, default=2)
+    parser.add_argument("--anomaly-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate_corpus(args.output, runs=args.runs, files_per_run=args.files, lines_per_file=args.lines, templates=args.templates,
+                    anomalous_runs=args.anomalous_runs, anomaly_rate=args.anomaly_rate, seed=args.seed)
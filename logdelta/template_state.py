@@ -0,0 +1,237 @@
+# Persisted log template state for pre-parsing. Messages seen in earlier invocations keep their
+# event id and only messages that match no known template go through the (slow) parser.
+import os
+import hashlib
+from collections import Counter
+
+import polars as pl
+
+import logdelta.profiling as profiling
+
+wildcard = "<*>"
+
+def template_signature(messages):
+    """
+    Token-wise template of messages that a parser put into the same group. Tokens equal in all
+    messages are kept, others become <*>. If the messages have different token counts the most
+    common count is used (ties go to the shorter one). The result does not depend on message order.
+    """
+    tokenized = [message.split() for message in messages]
+    lengths = Counter(len(tokens) for tokens in tokenized)
+    length = min(lengths, key=lambda n: (-lengths[n], n))
+    tokenized = [tokens for tokens in tokenized if len(tokens) == length]
+    return " ".join(
+        column[0] if all(token == column[0] for token in column) else wildcard
+        for column in zip(*tokenized)
+    )
+
+def template_id(template):
+    """
+    Stable event id of a template. The same template always gets the same id, in every run.
+    """
+    return "T" + hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+
+def _matches(tokens, template_tokens):
+    return len(tokens) == len(template_tokens) and all(
+        t == wildcard or t == token for t, token in zip(template_tokens, tokens))
+
+def _template_index(rows):
+    # Index templates by token count and first token so each message is compared with few candidates
+    index = {}
+    for event_id, template in rows:
+        _add_to_index(index, event_id, template.split())
+    return index
+
+def _add_to_index(index, event_id, tokens):
+    first = tokens[0] if tokens else ""
+    index.setdefault((len(tokens), first), []).append((event_id, tokens))
+
+def _find_template(index, tokens):
+    first = tokens[0] if tokens else ""
+    for event_id, template_tokens in index.get((len(tokens), first), []) + index.get((len(tokens), wildcard), []):
+        if _matches(tokens, template_tokens):
+            return event_id
+    return None
+
+def match_known_templates(messages, templates):
+    """
+    Match messages against known templates.
+
+    Parameters:
+    - messages: List of messages.
+    - templates: Polars DataFrame with 'event_id' and 'template' columns.
+
+    Returns:
+    - Dictionary message -> event_id for the messages that match a known template.
+    """
+    index = _template_index(templates.select("event_id", "template").iter_rows())
+    matched = {}
+    for message in messages:
+        event_id = _find_template(index, message.split())
+        if event_id is not None:
+            matched[message] = event_id
+    return matched
+
+def reconcile_templates(templates):
+    """
+    Merge templates that are special cases of a more general template. Partitions parsed
+    separately can produce e.g. 'open file <*>' and 'open file a.txt' for the same event.
+
+    Parameters:
+    - templates: Polars DataFrame with 'event_id' and 'template' columns.
+
+    Returns:
+    - Tuple (templates that remain, dictionary event_id -> event_id of the general template).
+    """
+    rows = sorted(templates.select("event_id", "template").iter_rows(),
+                  key=lambda row: (-row[1].split().count(wildcard), row[1]))
+    index = {}
+    kept = []
+    remap = {}
+    # More general templates come first, so a template can only be merged into one that is already kept
+    for event_id, template in rows:
+        tokens = template.split()
+        general_id = _find_template(index, tokens)
+        if general_id is None:
+            _add_to_index(index, event_id, tokens)
+            kept.append((event_id, template))
+        else:
+            remap[event_id] = general_id
+    return pl.DataFrame(kept, schema={"event_id": pl.Utf8, "template": pl.Utf8}, orient="row"), remap
+
+def parse_messages(messages, parse_type, field="e_message_normalized"):
+    """
+    Parse distinct messages with a LogLead parser and give every parser group a stable id.
+
+    Parameters:
+    - messages: List of distinct messages.
+    - parse_type: Parser name as in EventLogEnhancer.parse_<parse_type>, e.g. 'tip' or 'drain'.
+
+    Returns:
+    - Tuple of Polars DataFrames (mapping with field and 'event_id', templates with 'event_id' and 'template').
+    """
+    from loglead.enhancers import EventLogEnhancer
+    method_name = f"parse_{parse_type}"
+    group_col = f"e_event_{parse_type}_id"
+    enhancer = EventLogEnhancer(pl.DataFrame({field: messages}))
+    if not hasattr(enhancer, method_name):
+        raise ValueError(f"No parse method found for {parse_type}")
+    parsed = getattr(enhancer, method_name)(field)
+    groups = parsed.group_by(group_col).agg(pl.col(field))
+    mapping = {}
+    templates = {}
+    for _, group_messages in groups.iter_rows():
+        template = template_signature(group_messages)
+        event_id = template_id(template)
+        templates[event_id] = template
+        for message in group_messages:
+            mapping[message] = event_id
+    return (pl.DataFrame({field: list(mapping.keys()), "event_id": list(mapping.values())}, schema={field: pl.Utf8, "event_id": pl.Utf8}),
+            pl.DataFrame({"event_id": list(templates.keys()), "template": list(templates.values())}, schema={"event_id": pl.Utf8, "template": pl.Utf8}))
+
+def _parse_partition(messages, parse_type, field):
+    # Runs in a worker process
+    return parse_messages(messages, parse_type, field)
+
+def parse_parallel(messages, parse_type, workers, field="e_message_normalized"):
+    """
+    Parse distinct messages in worker processes and merge the results into one id space.
+
+    The sorted messages are split into contiguous partitions (similar messages end up in the
+    same partition) and each partition is parsed by its own worker. Templates are identified
+    by their text, so equal templates from different workers get the same id, and templates
+    that are special cases of a more general one are merged into it.
+
+    Parameters:
+    - messages: List of distinct messages.
+    - parse_type: Parser name as in EventLogEnhancer.parse_<parse_type>.
+    - workers: Number of worker processes.
+
+    Returns:
+    - Tuple of Polars DataFrames as in parse_messages.
+    """
+    if workers <= 1 or len(messages) < 2 * workers:
+        return parse_messages(messages, parse_type, field)
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    messages = sorted(messages)
+    size = -(-len(messages) // workers)
+    partitions = [messages[i:i + size] for i in range(0, len(messages), size)]
+    # spawn: forking a process that already runs Polars threads can deadlock
+    with ProcessPoolExecutor(max_workers=len(partitions), mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(_parse_partition, partitions, [parse_type] * len(partitions), [field] * len(partitions)))
+    mapping = pl.concat([result[0] for result in results])
+    templates = pl.concat([result[1] for result in results]).unique(subset="event_id", keep="first", maintain_order=True)
+    templates, remap = reconcile_templates(templates)
+    if remap:
+        mapping = mapping.with_columns(pl.col("event_id").replace(remap))
+    return mapping, templates
+
+def _state_paths(state_folder, parse_type):
+    return (os.path.join(state_folder, f"{parse_type}_messages.parquet"),
+            os.path.join(state_folder, f"{parse_type}_templates.parquet"))
+
+def load_state(state_folder, parse_type, field="e_message_normalized"):
+    """
+    Load the message -> event id mapping and the templates of a parser. Empty if nothing is stored yet.
+    """
+    messages_path, templates_path = _state_paths(state_folder, parse_type)
+    if os.path.exists(messages_path) and os.path.exists(templates_path):
+        return pl.read_parquet(messages_path), pl.read_parquet(templates_path)
+    return _empty_state(field)
+
+def _empty_state(field):
+    return (pl.DataFrame(schema={field: pl.Utf8, "event_id": pl.Utf8}),
+            pl.DataFrame(schema={"event_id": pl.Utf8, "template": pl.Utf8}))
+
+def save_state(state_folder, parse_type, messages, templates):
+    os.makedirs(state_folder, exist_ok=True)
+    messages_path, templates_path = _state_paths(state_folder, parse_type)
+    messages.write_parquet(messages_path)
+    templates.write_parquet(templates_path)
+
+def parse_incremental(df, parser_name, state_folder=None, field="e_message_normalized", workers=1):
+    """
+    Add event ids (e_event_<type>_id) to df using the template state stored in state_folder.
+
+    Messages seen before get their stored id without parsing. New messages that match a known
+    template get its id. Only the remaining messages go through the parser, and the state is
+    saved with the new messages and templates. Ids are derived from the template text so they
+    stay stable across invocations.
+
+    Parameters:
+    - df: Polars DataFrame with the masked message column.
+    - parser_name: Parser as in the config, e.g. 'Parse-Tip' or 'Parse-Drain'.
+    - state_folder: Folder for the persisted state. None parses all messages and stores nothing.
+    - field: Message column to parse.
+    - workers: Number of worker processes for parsing, see parse_parallel.
+    """
+    parse_type = parser_name.split("-")[1].lower()
+    id_col = f"e_event_{parse_type}_id"
+    known_messages, templates = load_state(state_folder, parse_type, field) if state_folder else _empty_state(field)
+
+    with profiling.stage(f"parse_templates:{parser_name}", rows_in=df.height) as record:
+        distinct = df.select(pl.col(field).drop_nulls().unique())
+        unknown = distinct.join(known_messages, on=field, how="anti").get_column(field).to_list()
+        matched = match_known_templates(unknown, templates) if unknown else {}
+        unmatched = [message for message in unknown if message not in matched]
+        if state_folder:
+            print(f"Template state: {distinct.height - len(unknown)} known messages, {len(matched)} matched known templates, {len(unmatched)} parsed")
+
+        new_parts = [known_messages]
+        if matched:
+            new_parts.append(pl.DataFrame({field: list(matched.keys()), "event_id": list(matched.values())}, schema=known_messages.schema))
+        if unmatched:
+            parsed_messages, parsed_templates = parse_parallel(unmatched, parse_type, workers, field)
+            new_parts.append(parsed_messages)
+            templates = pl.concat([templates, parsed_templates]).unique(subset="event_id", keep="first", maintain_order=True)
+        if len(new_parts) > 1:
+            known_messages = pl.concat(new_parts)
+        if len(new_parts) > 1 and state_folder:
+            save_state(state_folder, parse_type, known_messages, templates)
+
+        if id_col in df.columns:
+            df = df.drop(id_col)
+        df = df.join(known_messages.rename({"event_id": id_col}), on=field, how="left")
+        record["rows_out"] = df.height
+    return df
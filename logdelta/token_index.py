@@ -0,0 +1,251 @@
+# Persisted inverted index from masked tokens and event template ids to the lines that contain them.
+# It is built during ingestion (token_index in the config) and answers "which runs / files contain X"
+# and "runs containing X but not Y" without reading the log files again, e.g. when labeling runs
+# (compare demo/label_investigation/find_string.py).
+#
+# Layout of the index folder:
+# - lines/<run>.parquet: token, run, file_name, line (position of the line among the loaded lines of the file)
+# - runs/<run>.parquet: distinct tokens of the run
+# - index.json: settings the index depends on and the signature of each indexed run
+# Postings are sorted by token, so the Parquet statistics let queries skip most of the data.
+import os
+import sys
+import json
+import time
+
+import polars as pl
+
+import logdelta.profiling as profiling
+import logdelta.regex_masking as regex_masking
+from logdelta.run_store import _run_signature
+
+manifest_name = "index.json"
+event_prefix = "event:"
+
+def _lines_path(index_folder, run):
+    return os.path.join(index_folder, "lines", f"{run}.parquet")
+
+def _runs_path(index_folder, run):
+    return os.path.join(index_folder, "runs", f"{run}.parquet")
+
+def load_manifest(index_folder):
+    path = os.path.join(index_folder, manifest_name)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"dataset_key": None, "masking": None, "runs": {}}
+
+def _save_manifest(index_folder, manifest):
+    path = os.path.join(index_folder, manifest_name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _remove_run(index_folder, run):
+    for path in (_lines_path(index_folder, run), _runs_path(index_folder, run)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _event_columns(df):
+    # e_event_drain_id -> drain
+    return {col: col[len("e_event_"):-len("_id")] for col in df.columns if col.startswith("e_event_") and col.endswith("_id")}
+
+def _postings(df_run, field):
+    """
+    Distinct (token, run, file_name, line) rows of one run. Tokens are the space separated words
+    of field and 'event:<parser>:<id>' for each pre-parsed event id column.
+    """
+    lines = df_run.select(
+        pl.col("run").cast(pl.Utf8),
+        pl.col("file_name").cast(pl.Utf8),
+        (pl.int_range(pl.len(), dtype=pl.UInt32).over("file_name") + 1).alias("line"),
+        pl.col(field).cast(pl.Utf8).alias("text"),
+        *[pl.col(col).cast(pl.Utf8).alias(col) for col in _event_columns(df_run)],
+    )
+    frames = [lines.select("run", "file_name", "line", pl.col("text").str.split(" ").alias("token")).explode("token")]
+    for col, parser in _event_columns(df_run).items():
+        frames.append(lines.select("run", "file_name", "line", (pl.lit(f"{event_prefix}{parser}:") + pl.col(col)).alias("token")))
+    postings = pl.concat([frame.select("token", "run", "file_name", "line") for frame in frames])
+    return (postings.filter(pl.col("token").is_not_null() & (pl.col("token") != ""))
+            .unique().sort("token", "file_name", "line"))
+
+def update_token_index(df, index_folder, dataset_key, masking=None, input_data_folder=None):
+    """
+    Add the runs of a prepared DataFrame to the index. Runs whose folder has not changed since they were
+    indexed are skipped. The index is rebuilt when dataset_key (masking, parsing, preprocessing) changes.
+
+    Parameters:
+    - df: Prepared (masked, parsed and preprocessed) data of one or more runs.
+    - index_folder: Folder of the index.
+    - dataset_key: Settings the tokens depend on.
+    - masking: Name of the regex_masking pattern list, applied to query strings.
+    - input_data_folder: Folder with the run folders, used for the run signatures.
+    """
+    os.makedirs(os.path.join(index_folder, "lines"), exist_ok=True)
+    os.makedirs(os.path.join(index_folder, "runs"), exist_ok=True)
+    manifest = load_manifest(index_folder)
+    if manifest["dataset_key"] != dataset_key:
+        for run in manifest["runs"]:
+            _remove_run(index_folder, run)
+        manifest = {"dataset_key": dataset_key, "masking": masking, "runs": {}}
+
+    field = "e_message_normalized" if "e_message_normalized" in df.columns else "m_message"
+    if df.get_column(field).null_count() == df.height and df.height:
+        print(f"Token index: {field} was dropped, index is not updated")
+        return manifest
+    runs = df.get_column("run").cast(pl.Utf8).unique().sort().to_list()
+    for run in runs:
+        signature = _run_signature(os.path.join(input_data_folder, run)) if input_data_folder else None
+        entry = manifest["runs"].get(run)
+        if entry is not None and signature is not None and entry["signature"] == signature and os.path.exists(_lines_path(index_folder, run)):
+            continue
+        with profiling.stage("token_index") as record:
+            df_run = df.filter(pl.col("run").cast(pl.Utf8) == run)
+            record["rows_in"] = df_run.height
+            postings = _postings(df_run, field)
+            postings.write_parquet(_lines_path(index_folder, run), statistics=True)
+            postings.select("token").unique().sort("token").with_columns(pl.lit(run).alias("run")).write_parquet(_runs_path(index_folder, run), statistics=True)
+            record["rows_out"] = postings.height
+        manifest["runs"][run] = {"signature": signature, "postings": postings.height, "field": field}
+        _save_manifest(index_folder, manifest)
+    return manifest
+
+class TokenIndex:
+    """
+    Queries against an index folder written by update_token_index.
+
+    A query is a string that is masked with the masking of the index and split at spaces, so
+    "Going to preempt 1 due to lack of space for maps" matches the lines that contain all of
+    its masked words. Words are matched whole, or with substring=True as substrings of the
+    indexed words (e.g. "hdfs:" in "hdfs://host/path"), closer to a plain text search. The order
+    of the words is not checked. 'event:<parser>:<id>' queries an event id.
+    """
+
+    def __init__(self, index_folder):
+        self.index_folder = index_folder
+        self.manifest = load_manifest(index_folder)
+        if not self.manifest["runs"]:
+            raise FileNotFoundError(f"No token index in {index_folder}")
+
+    def tokens(self, query):
+        if query.startswith(event_prefix):
+            return [query]
+        masking = self.manifest.get("masking")
+        if masking and hasattr(regex_masking, masking):
+            # Masked by loglead like the messages at ingestion (each pattern applied twice)
+            from loglead.enhancers import EventLogEnhancer
+            masked = EventLogEnhancer(pl.DataFrame({"m_message": [query]})).normalize(regexs=getattr(regex_masking, masking))
+            query = masked.get_column("e_message_normalized").item()
+        return list(dict.fromkeys(token for token in query.split(" ") if token))
+
+    def _scan(self, kind):
+        return pl.scan_parquet(os.path.join(self.index_folder, kind, "*.parquet"))
+
+    def _matching_tokens(self, words, substring=False):
+        """
+        Indexed tokens that match each query word: the word itself, or with substring all tokens containing it.
+
+        Returns:
+        - DataFrame with token and word.
+        """
+        if not substring:
+            return pl.DataFrame({"token": words, "word": words}, schema={"token": pl.Utf8, "word": pl.Utf8})
+        vocabulary = self._scan("runs").select("token").unique()
+        return pl.concat([vocabulary.filter(pl.col("token").str.contains(word, literal=True)).with_columns(pl.lit(word).alias("word"))
+                          for word in words]).collect()
+
+    def _with_all_words(self, scan, matches, words, group_by):
+        return (scan.filter(pl.col("token").is_in(matches.get_column("token").unique().to_list()))
+                .join(matches.lazy(), on="token")
+                .group_by(*group_by).agg(pl.col("word").n_unique().alias("n"))
+                .filter(pl.col("n") == len(words)).drop("n"))
+
+    def runs_with_tokens(self, tokens, substring=False):
+        """
+        Runs that contain all tokens anywhere (not necessarily on the same line).
+        """
+        matches = self._matching_tokens(tokens, substring)
+        return set(self._with_all_words(self._scan("runs"), matches, tokens, ["run"]).collect().get_column("run").to_list())
+
+    def lines(self, query, runs=None, substring=False):
+        """
+        Lines that contain all words of the query.
+
+        Returns:
+        - DataFrame with run, file_name and line.
+        """
+        empty = pl.DataFrame(schema={"run": pl.Utf8, "file_name": pl.Utf8, "line": pl.UInt32})
+        tokens = self.tokens(query)
+        if not tokens:
+            return empty
+        matches = self._matching_tokens(tokens, substring)
+        candidates = set(self._with_all_words(self._scan("runs"), matches, tokens, ["run"]).collect().get_column("run").to_list())
+        if runs is not None:
+            candidates &= set(runs)
+        if not candidates:
+            return empty
+        scan = pl.concat([pl.scan_parquet(_lines_path(self.index_folder, run)) for run in sorted(candidates)])
+        return (self._with_all_words(scan, matches, tokens, ["run", "file_name", "line"])
+                .sort("run", "file_name", "line").collect())
+
+    def files(self, query, substring=False):
+        """
+        Files that contain the query with the number of matching lines.
+        """
+        return self.lines(query, substring=substring).group_by("run", "file_name").agg(pl.len().alias("lines")).sort("run", "file_name")
+
+    def runs(self, query, without=None, substring=False):
+        """
+        Sorted runs that contain the query, minus the runs that contain any of the queries in without.
+        """
+        tokens = self.tokens(query)
+        if len(tokens) == 1:
+            found = self.runs_with_tokens(tokens, substring)
+        else:
+            found = set(self.lines(query, substring=substring).get_column("run").to_list())
+        for excluded in ([without] if isinstance(without, str) else without or []):
+            found -= set(self.lines(excluded, runs=found, substring=substring).get_column("run").to_list()) if found else set()
+        return sorted(found)
+
+def index_folder_of_config(config):
+    token_index = config.get('token_index') or {}
+    return token_index.get('folder') or os.path.join(config.get('output_folder'), "token_index")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the token index built with token_index in the config.")
+    parser.add_argument("command", choices=["runs", "files", "lines"], help="What to list for the query")
+    parser.add_argument("query", help="String to search, or event:<parser>:<id>")
+    parser.add_argument("-n", "--not", dest="without", action="append", default=[],
+                        help="Exclude runs that contain this string (runs only, can be repeated)")
+    parser.add_argument("-s", "--substring", action="store_true",
+                        help="Match the words of the query as substrings of the indexed words, like a text search")
+    parser.add_argument("-i", "--index", help="Index folder")
+    parser.add_argument("-c", "--config", help="Configuration file, the index folder is taken from it")
+    parser.add_argument("--limit", type=int, default=50, help="Rows to print for files and lines (default: 50)")
+    args = parser.parse_args()
+
+    if args.index:
+        folder = args.index
+    elif args.config:
+        from logdelta.config_runner import load_config
+        folder = index_folder_of_config(load_config(args.config))
+    else:
+        parser.error("Give --index or --config")
+
+    start = time.perf_counter()
+    index = TokenIndex(folder)
+    if args.command == "runs":
+        result = index.runs(args.query, args.without, substring=args.substring)
+        print("\n".join(result))
+        count = len(result)
+    else:
+        result = index.files(args.query, args.substring) if args.command == "files" else index.lines(args.query, substring=args.substring)
+        with pl.Config(tbl_rows=args.limit, fmt_str_lengths=100):
+            print(result.head(args.limit))
+        count = result.height
+    print(f"{count} {args.command} in {time.perf_counter() - start:.3f} s", file=sys.stderr)
@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import datetime
+import threading
+import warnings
+from dotenv import load_dotenv, find_dotenv
+
+import polars as pl
+
+import logdelta.log_analysis_functions as log_analysis_functions
+import logdelta.line_index as line_index
+import logdelta.template_state as template_state
+from logdelta.log_analysis_functions import read_run, list_runs, run_paths, concat_runs, run_file_catalog, prepare_content_shared, register_prepared_content, flush_output
+from logdelta.config_runner import load_config, get_input_data_folder, load_data, prepare_data, configure_output, plan_steps
+
+# Steps that score a new run against the baseline
+watch_steps = {'anomaly_run', 'distance_run_content'}
+
+def run_is_complete(paths, settle_seconds=30, complete_marker=None):
+    """
+    A run (its folder or the archives that contain it, see run_paths) is complete when its folder
+    contains complete_marker (if given) or when no file of it has been modified for settle_seconds.
+    Archives have no marker and are complete when they have not changed for settle_seconds.
+    """
+    if not paths:
+        return False
+    if complete_marker and os.path.isdir(paths[0]):
+        return os.path.exists(os.path.join(paths[0], complete_marker))
+    latest = 0.0
+    for path in paths:
+        try:
+            latest = max(latest, os.path.getmtime(path))
+        except FileNotFoundError:
+            continue
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    latest = max(latest, os.path.getmtime(os.path.join(root, f)))
+                except FileNotFoundError:
+                    continue
+    return time.time() - latest >= settle_seconds
+
+def _start_notifier(folder, event):
+    """
+    Set event when something changes below folder. Uses inotify (through the optional watchdog package)
+    if available. Returns the observer or None when the caller has to rely on polling.
+    """
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, _):
+            event.set()
+
+    observer = Observer()
+    observer.schedule(Handler(), folder, recursive=True)
+    observer.start()
+    return observer
+
+class RunWatcher:
+    """
+    Score new runs against a baseline that is loaded once and kept in memory.
+
+    The configured anomaly_run (also anomaly_run_content/anomaly_run_file) and distance_run_content
+    steps are run with each new run as target run. Content of the baseline is prepared once per
+    mask and content format, and only the new run is prepared when it arrives. Parse-* content is
+    parsed with a template state kept in the output folder (see template_state.parse_incremental),
+    so the event ids of a new run match the ids of the baseline. Scores are appended to
+    watch_<step>.csv in the output folder.
+    """
+
+    def __init__(self, config):
+        if (config.get('out_of_core') or {}).get('enabled', False):
+            print("Out-of-core mode is not supported in watch mode. The baseline is kept in memory.")
+            config = dict(config, out_of_core={'enabled': False})
+        self.config = config
+        self.watch_config = config.get('watch', {})
+        self.input_data_folder = log_analysis_functions._get_abs_path(get_input_data_folder(config))
+        pre_parse = config.get('pre_parse', {})
+        if pre_parse.get('enabled', False) and not pre_parse.get('state_folder'):
+            # Event ids of new runs must match the ids of the baseline
+            pre_parse['state_folder'] = os.path.join(config.get('output_folder'), "template_state")
+        self.tasks = [task for task in plan_steps(config.get('steps', {}))[0] if task[1].__name__ in watch_steps]
+        if not self.tasks:
+            print(f"Warning: No {' or '.join(sorted(watch_steps))} steps in the config. New runs are loaded but not scored.")
+        self.template_state_folder = self.watch_config.get('template_state_folder') or os.path.join(config.get('output_folder'), "watch_template_state")
+        self.baseline = None
+        self.baseline_runs = []
+        self.baseline_content = {}
+        self.known_runs = set()
+
+    def load_baseline(self):
+        configure_output(self.config)
+        self.known_runs = set(list_runs(self.input_data_folder))
+        self.baseline_content = {}
+        if self.known_runs:
+            self.baseline = load_data(self.config)
+            self.baseline_runs = run_file_catalog(self.baseline)[0]
+        print(f"Baseline: {len(self.baseline_runs)} runs")
+
+    def new_complete_runs(self):
+        settle_seconds = self.watch_config.get('settle_seconds', 30)
+        complete_marker = self.watch_config.get('complete_marker')
+        return [run for run in list_runs(self.input_data_folder)
+                if run not in self.known_runs
+                and run_is_complete(run_paths(self.input_data_folder, run), settle_seconds, complete_marker)]
+
+    def score_run(self, run):
+        """
+        Ingest one run, score it against the baseline and append the scores to the output tables.
+
+        Returns:
+        - Dictionary of config item (e.g. 'anomaly_run_content[0]') -> scores DataFrame.
+        """
+        start = time.perf_counter()
+        df_run = prepare_data(self.config, read_run(self.input_data_folder, run))
+        df = concat_runs([self.baseline, df_run]) if self.baseline is not None else df_run
+        content = {}
+        try:
+            for content_key in {task[3] for task in self.tasks}:
+                if content_key is not None and self.baseline is not None:
+                    # Prepare the baseline once and only the new run per arrival
+                    baseline_prepared, field = self._baseline_prepared(*content_key)
+                    run_prepared, _ = self._prepare(df_run, *content_key)
+                    content[content_key] = (concat_runs([baseline_prepared, run_prepared]), field)
+                    register_prepared_content(df, *content_key, *content[content_key])
+
+            scores = {}
+            for config_item, func, kwargs, _ in self.tasks:
+                kwargs = dict(kwargs, target_run=run)
+                if kwargs.get('comparison_runs', "ALL") == "ALL":
+                    kwargs['comparison_runs'] = self.baseline_runs
+                if not kwargs['comparison_runs']:
+                    print(f"No baseline runs to compare {run} against")
+                    break
+                result = func(df=df, **kwargs)
+                if result is not None:
+                    scores[config_item] = result
+                    self._append_scores(func.__name__, config_item, run, result)
+            flush_output()
+        finally:
+            # Also release the concatenated frames when scoring failed
+            log_analysis_functions.clear_prepared_content(df)
+
+        self.known_runs.add(run)
+        if self.watch_config.get('extend_baseline', False):
+            # Later runs are also compared against this one
+            if self.baseline is not None:
+                log_analysis_functions.clear_prepared_content(self.baseline)
+            self.baseline = df
+            self.baseline_runs = run_file_catalog(df)[0]
+            self.baseline_content = content
+        print(f"Scored run {run} in {time.perf_counter() - start:.1f}s")
+        return scores
+
+    def _baseline_prepared(self, mask, content_format):
+        if (mask, content_format) not in self.baseline_content:
+            if content_format.startswith("Parse-"):
+                self.baseline_content[(mask, content_format)] = self._prepare(self.baseline, mask, content_format)
+            else:
+                self.baseline_content[(mask, content_format)] = prepare_content_shared(self.baseline, mask, content_format)
+        return self.baseline_content[(mask, content_format)]
+
+    def _prepare(self, df, mask, content_format):
+        """
+        Prepared content of df. Parse-* formats are parsed with the persisted template state of the
+        watcher instead of a parser fitted on df alone, whose event ids would not match the baseline.
+        """
+        if not content_format.startswith("Parse-"):
+            return log_analysis_functions._prepare_content(df, mask, content_format)
+        field = "e_message_normalized" if mask else "m_message"
+        if field == "m_message":
+            df = line_index.attach_messages(df)
+        parse_type = content_format.split("-")[1].lower()
+        prepared = template_state.parse_incremental(df, content_format, os.path.join(self.template_state_folder, field), field=field,
+                                                    workers=log_analysis_functions.parse_workers)
+        return prepared, f"e_event_{parse_type}_id"
+
+    def _append_scores(self, step, config_item, run, result):
+        """
+        Append the scores of a run to the running output table <output_folder>/watch_<step>.csv.
+        """
+        result = result.select([col for col, dtype in result.schema.items() if not isinstance(dtype, (pl.List, pl.Struct, pl.Array))])
+        result = result.with_columns(
+            pl.lit(datetime.datetime.now().isoformat(timespec="seconds")).alias("scored_at"),
+            pl.lit(config_item).alias("config_item"),
+            pl.lit(run).alias("watched_run"),
+        )
+        os.makedirs(log_analysis_functions.output_folder, exist_ok=True)
+        path = os.path.join(log_analysis_functions.output_folder, f"watch_{step}.csv")
+        csv_text = result.write_csv(separator='\t')
+        if os.path.exists(path):
+            # Header only once
+            csv_text = csv_text.split("\n", 1)[1]
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(csv_text)
+
+    def watch(self, stop_event=None):
+        """
+        Watch the input data folder and score new runs until stop_event is set (or forever).
+        """
+        stop_event = stop_event or threading.Event()
+        changed = threading.Event()
+        observer = _start_notifier(self.input_data_folder, changed)
+        poll_seconds = self.watch_config.get('poll_seconds', 10)
+        print(f"Watching {self.input_data_folder} for new runs ({'inotify' if observer else f'polling every {poll_seconds}s'})")
+        try:
+            while not stop_event.is_set():
+                for run in self.new_complete_runs():
+                    try:
+                        self.score_run(run)
+                    except Exception as e:
+                        print(f"Scoring run {run} failed: {e}")
+                        self.known_runs.add(run)
+                # Runs that are still being written are checked again after poll_seconds even without events
+                changed.wait(poll_seconds)
+                changed.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+def main(config_path):
+    config = load_config(config_path)
+    watcher = RunWatcher(config)
+    watcher.load_baseline()
+    watcher.watch()
+
+
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv(find_dotenv())
+
+    # Suppress specific warnings
+    warnings.filterwarnings("ignore", "WARNING! data has no labels. Only unsupervised methods will work.", UserWarning)
+
+    import argparse
+    parser = argparse.ArgumentParser(description="LogDelta watch mode. Scores new runs of the input data folder as they arrive.")
+    parser.add_argument(
+        "-c", "--config",
+        default="config.yml",
+        help="Path to the configuration file (default: config.yml)"
+    )
+    args = parser.parse_args()
+    try:
+        main(args.config)
+    except KeyboardInterrupt:
+        sys.exit(0)